@@ -5,38 +5,144 @@
 
 # Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
 
+import hashlib
 import json
 import logging
+import threading
 import time
-from collections import OrderedDict
+from collections import namedtuple
 from json.decoder import JSONDecodeError
 
 import requests
 from requests.adapters import HTTPAdapter
 
+from analystApi import profiling
 from analystApi.exceptions import *
+from analystApi.rate_limit import parse_retry_after
+from analystApi.retry import RetryPolicy, give_up, log_retry
+from analystApi.singleflight import SingleFlight
 
-MAX_RETRY_COUNT = 100
-MAX_RETRY_TIME = 3600   # 1 hour
-RETRY_DELAY = 300       # 5 minutes
+# When to pull the details of a query (GET /queries/{id}), they are only needed for distance_used:
+# eager: right after creating the query, lazy: while or after collecting the values, skip: never
+DETAILS_EAGER = 'eager'
+DETAILS_LAZY = 'lazy'
+DETAILS_SKIP = 'skip'
+DETAILS_MODES = (DETAILS_EAGER, DETAILS_LAZY, DETAILS_SKIP)
+details_mode = DETAILS_LAZY
+
+# analystApi.retry.RetryPolicy used by call_with_retries
+retry_policy = RetryPolicy()
 
-username = ''
-password = ''
-endpoint = ''
 include_unknown_default = False
-poolsize = 2
+DEFAULT_POOLSIZE = 2
+
+# Optional analystApi.cache.SqliteCache for georef results, keyed by normalized address
+georef_cache = None
+# Optional analystApi.cache.SqliteCache mapping the hash of a query document to its queryId and details
+query_registry = None
+# Optional analystApi.cache.ResultCache for /results, keyed by query hash and type
+result_cache = None
+# Optional analystApi.cache.SqliteCache for the variable documentation of /vars, keyed by endpoint and username
+vars_cache = None
+# Seconds the cached variable documentation is used without asking the API whether it changed
+DEFAULT_VARS_MAX_AGE = 3600
+vars_max_age = DEFAULT_VARS_MAX_AGE
+# Never ask the API for the variable documentation, only use vars_cache
+offline = False
+# Data vintage reported by the API (or set in the configuration), cached results are bound to it
+data_vintage = None
+VINTAGE_KEYS = ('dataVintage', 'vintage', 'dataVersion', 'dataStand')
+# Optional analystApi.concurrency.AdaptiveConcurrencyLimit for the requests in flight
+concurrency_limit = None
+# Optional analystApi.rate_limit.RateLimiter with request budgets per endpoint
+rate_limiter = None
+# Optional analystApi.circuit_breaker.CircuitBreaker pausing all requests while the API is down
+circuit_breaker = None
+# Optional analystApi.maintenance.MaintenanceSchedule, no requests are sent within its windows
+maintenance = None
+# Optional analystApi.metrics.Metrics, latencies, status codes, retries, waits and bytes per endpoint
+metrics = None
+# Optional analystApi.progress.Progress, counts the requests in flight and the retries
+progress = None
+# QueryLimitReached, GeorefOffline
+OVERLOAD_STATUS_CODES = (429, 503)
 
 json_headers = {
     "Content-Type": "application/json",
     "Accept": "application/json",
 }
 
-column_documentation = {}
+
+class AnalystApiClient:
+    """Endpoint, credentials, HTTP session and variable documentation (/vars) shared by all queries.
+
+    The session is set up and the variable documentation is loaded once, by the first thread that needs them, and
+    kept for the whole run. configure() must be called before.
+    """
+
+    def __init__(self, endpoint='', username='', password='', poolsize=DEFAULT_POOLSIZE):
+        self.endpoint = endpoint
+        self.username = username
+        self.password = password
+        self.poolsize = poolsize
+        self.session = requests.Session()
+        self.mounted = False
+        # Free connections of the pool, to tell the time waited for one
+        self.connections = None
+        # Variable key -> documentation, None until loaded
+        self.column_documentation = None
+        # Loading the documentation sends a request, which mounts the session
+        self.session_lock = threading.Lock()
+        self.documentation_lock = threading.Lock()
+
+    def configure(self, endpoint=None, username=None, password=None, poolsize=None):
+        with self.session_lock:
+            if self.mounted or self.column_documentation is not None:
+                raise Exception('The API client is in use already, configure it before the first request')
+            if endpoint is not None:
+                self.endpoint = endpoint
+            if username is not None:
+                self.username = username
+            if password is not None:
+                self.password = password
+            if poolsize is not None:
+                self.poolsize = poolsize
+
+    def get_session(self):
+        if not self.mounted:
+            with self.session_lock:
+                if not self.mounted:
+                    logging.info(f"Initialize the API client with poolsize {self.poolsize}")
+                    # ... making concurrent requests from multiple threads using the same Session.
+                    self.session.mount('https://', HTTPAdapter(pool_maxsize=self.poolsize, pool_block=True))
+                    self.session.mount('http://', HTTPAdapter(pool_maxsize=self.poolsize, pool_block=True))
+                    self.connections = threading.BoundedSemaphore(self.poolsize)
+                    self.mounted = True
+        return self.session
+
+    def documentation(self):
+        """The variable documentation, loaded on first use"""
+        documentation = self.column_documentation
+        if documentation is None:
+            with self.documentation_lock:
+                if self.column_documentation is None:
+                    self.column_documentation = load_variable_documentation()
+                documentation = self.column_documentation
+        return documentation
+
+
+# The client used by immobrain_search_query and api_request
+client = AnalystApiClient()
+
+# Identical georef and query requests of concurrent workers are sent only once
+georef_flight = SingleFlight()
+query_flight = SingleFlight()
+details_flight = SingleFlight()
 
 
 # noinspection PyPep8Naming
 class immobrain_search_query:
-    session = requests.Session()
+    __slots__ = ('id', 'filter', 'meta_data', 'details', 'from_registry', 'data', 'cached_query', 'cached_query_hash')
 
     def __init__(self, id_=None):
         if id_ == '':
@@ -47,34 +153,10 @@ class immobrain_search_query:
         self.filter = {}
         self.meta_data = None
         self.details = None
+        self.from_registry = False
         self.data = {}
-
-        if not column_documentation:
-            immobrain_search_query.load_variable_documentation()
-
-    @staticmethod
-    def load_variable_documentation():
-        immobrain_search_query.session.adapters = OrderedDict()
-        logging.info(f"Initialize immobrain_search_query with poolsize {poolsize}")
-        immobrain_search_query.session.mount('https://', HTTPAdapter(pool_maxsize=poolsize,  pool_block=True))
-        immobrain_search_query.session.mount('http://', HTTPAdapter(pool_maxsize=poolsize, pool_block=True))
-
-        # ... making concurrent requests from multiple threads using the same Session.
-        r = immobrain_search_query.session.get(endpoint + '/vars/',
-                                               auth=(username, password),
-                                               headers=json_headers)
-        r.encoding = 'utf-8'
-        if r.status_code >= 300:
-            try:
-                error = json.loads(r.text)['error']
-            except JSONDecodeError as jde:
-                raise Exception(f'Error loading variable documentation, status code: {r.status_code}\n'
-                                f'Invalid JSON received: "{r.text[:80]}\"...', jde)
-            raise Exception(f'Error loading variable documentation, error message from server was: {error}')
-
-        # Iterate over every possible variable
-        for item in json.loads(r.text)['vars']:
-            column_documentation[item['key']] = item
+        self.cached_query = None
+        self.cached_query_hash = None
 
     @staticmethod
     def get_filter_for_column(column):
@@ -86,14 +168,15 @@ class immobrain_search_query:
             return get_filter('peripherySpatialFilter')
         if column.lower() == 'segment':
             return get_filter("segmentFilter")
+        # fl_wohnen::von // fl_wohnen::bis
+        column = column.split('::')[0].lower()
+        # A failing /vars is raised, not taken for an invalid column
+        column_documentation = client.documentation()
         try:
-            # fl_wohnen::von // fl_wohnen::bis
-            column = column.split('::')[0].lower()
-            if column in column_documentation.keys():
+            if column in column_documentation:
                 return get_filter(column_documentation[column]['filterModelName'])
-        except BaseException as be:
-            logging.exception(be)
-            pass
+        except KeyError as ke:
+            logging.exception(ke)
         return None
 
     def get_precision(self):
@@ -113,54 +196,114 @@ class immobrain_search_query:
             logging.exception("Georef failed", exc_info=True)
             return None
 
-    def generate_id(self):
-        r = immobrain_search_query.session.post(endpoint + '/queries',
-                                                auth=(username, password),
-                                                data=json.dumps(self.to_query()),
-                                                headers=json_headers)
-        r.encoding = 'utf-8'
-        logging.debug(r.text)
-        self.meta_data = json.loads(r.text)
-        if r.status_code >= 400:
-            raise create_query_exception_from_response(r, self.meta_data["error"])
+    @profiling.phased('create query')
+    def generate_id(self, use_registry=True):
+        query = self.to_query()
+        key = self.get_query_hash()
+        if use_registry and self.load_from_registry(key):
+            return
+        (self.meta_data, self.details) = query_flight.do(key, create_registered_query, query, key)
         self.id = self.meta_data['queryId']
-        self.pull_details_for_query()
+        self.from_registry = False
+
+    def load_from_registry(self, key):
+        self.from_registry = False
+        entry = query_registry.get(key) if query_registry is not None else None
+        if entry is None:
+            return False
+        (self.meta_data, self.details) = (entry['meta_data'], entry['details'])
+        self.id = self.meta_data['queryId']
+        self.from_registry = True
+        logging.debug("Query-ID %s found in registry" % self.id)
+        return True
+
+    def details_missing(self):
+        return details_mode == DETAILS_LAZY and self.details is None and bool(self.id)
 
     def pull_details_for_query(self):
-        r = immobrain_search_query.session.get(endpoint + '/queries/%s' % (self.id,),
-                                               auth=(username, password),
-                                               headers=json_headers)
-        r.encoding = 'utf-8'
-        logging.debug(r.text)
-        self.details = json.loads(r.text)
-        if r.status_code >= 400:
-            raise create_query_exception_from_response(r, self.details["error"])
+        self.details = details_flight.do(self.id, pull_details, self.id)
+        self.register_details()
+
+    def register_details(self):
+        # Details pulled later are added to the registered query
+        if query_registry is not None and self.meta_data is not None:
+            query_registry.put(self.get_query_hash(), {'meta_data': self.meta_data, 'details': self.details})
+
+    def result_cache_key(self, type_):
+        try:
+            return '%s/%s' % (self.get_query_hash(), type_)
+        except Exception:
+            # Query-ID from the CSV without valid filters
+            return 'id:%s/%s' % (self.id, type_)
+
+    def load_cached_result(self, type_):
+        value = result_cache.get(self.result_cache_key(type_)) if result_cache is not None else None
+        if value is None:
+            return False
+        logging.debug("Result %s for %s found in cache" % (type_, self.id))
+        self.data[type_] = value
+        return True
 
+    def store_result(self, type_, text):
+        if 'value' not in json.loads(text):
+            logging.warning(f"There is no Reply-Value for {self.id}/{type_}")
+            return
+        self.data[type_] = json.loads(text)['value']
+        if result_cache is not None and self.data[type_] is not None:
+            result_cache.put(self.result_cache_key(type_), self.data[type_])
+
+    def id_outdated(self):
+        """Called when the API rejects the ID. Returns whether the registry may be asked for a new one,
+        or None if the ID must not be regenerated."""
+        if self.meta_data and not self.from_registry:
+            return None
+        logging.warning("QueryID invalid. CSV outdated? Regenerating ID %s .." %
+                        self.id)
+        # A registered ID has probably expired, the registry is only asked once
+        if self.from_registry:
+            query_registry.delete(self.get_query_hash())
+            return False
+        return True
+
+    @profiling.phased('collect')
     def collect(self, type_):
+        # With the query registry, a known query gets its ID without a request
         if not self.id:
             self.generate_id()
+        if self.load_cached_result(type_):
+            return
         logging.info("Querying: %s" % self.id)
-        r = immobrain_search_query.session.get(endpoint + '/results/%s/%s' % (self.id, type_),
-                                               auth=(username, password),
-                                               headers=json_headers)
-        r.encoding = 'utf-8'
+        r = api_request('results', 'GET', '/results/%s/%s' % (self.id, type_))
         if r.elapsed.seconds > 1:
             logging.warning(f"Query {self.id} ({r.url}) took too long: {r.elapsed.seconds} seconds")
         if r.status_code < 300:
-            if 'value' not in json.loads(r.text):
-                logging.warning(f"There is no Reply-Value for {self.id}/{type_}")
-                return
-            self.data[type_] = json.loads(r.text)['value']
+            self.store_result(type_, r.text)
         else:
-            if not self.meta_data:
-                logging.warning("QueryID invalid. CSV outdated? Regenerating ID %s .." %
-                                self.id)
-                self.generate_id()
+            check_results_status(r.status_code, self.id)
+            use_registry = self.id_outdated()
+            if use_registry is not None:
+                self.generate_id(use_registry=use_registry)
                 logging.info("New Query-ID = %s" % self.id)
                 self.collect(type_)
             # raise Exception(self.data)
 
     def to_query(self):
+        """The query document, built once and kept until a filter changes. It must not be modified."""
+        if self.cached_query is None:
+            self.cached_query = self.build_query()
+        return self.cached_query
+
+    def get_query_hash(self):
+        if self.cached_query_hash is None:
+            self.cached_query_hash = query_hash(self.to_query())
+        return self.cached_query_hash
+
+    def query_changed(self):
+        """Called by the filters of this query when one of their values is set"""
+        self.cached_query = None
+        self.cached_query_hash = None
+
+    def build_query(self):
         doc = {}
         # Single-Filter
         for filter_name in self.filter:
@@ -195,61 +338,347 @@ class immobrain_search_query:
                 "Column '%s' is not a valid Filtercolumn" % column)
 
         self.filter[column] = filter_(column)
+        self.filter[column].owner = self
+        self.query_changed()
 
     def add_column(self, column, value):
         logging.debug("##" + str(column))
-        coltype = column
-        bound = None
-
-        if '::' in column:
-            (coltype, bound) = column.split('::', 2)
-
         if value == '':
             return  # empty csv entry..
-
-        self.add_filter(coltype)
-        if bound:
-            if bound == 'bis':
-                self.filter[coltype].set_max(value)
-            elif bound == 'von':
-                self.filter[coltype].set_min(value)
-            elif self.filter[coltype].has_special_key(bound):
-                self.filter[coltype].set_special_key(bound, value)
-            else:
-                raise Exception("This i cannot understand %s for %s!" %
-                                (bound, coltype))
+        self.apply_column(compile_column(column), value)
+
+    def filter_for(self, step):
+        """The filter of a compiled column, created on first use"""
+        filter_ = self.filter.get(step.filter_column)
+        if filter_ is None:
+            filter_ = self.filter[step.filter_column] = step.filter_class(step.filter_column)
+            filter_.owner = self
+            self.query_changed()
+        return filter_
+
+    def apply_column(self, step, value):
+        """Set the value of a column compiled by compile_column"""
+        if value == '':
+            return  # empty csv entry..
+        filter_ = self.filter_for(step)
+        if step.setter == SET_MAX:
+            filter_.set_max(value)
+        elif step.setter == SET_MIN:
+            filter_.set_min(value)
+        elif step.setter == SET_SPECIAL_KEY:
+            filter_.set_special_key(step.special_key, value)
         else:
-            self.filter[coltype].set_value(value)
-
-
-def call_with_retries(max_retry_count, max_retry_time, delay, func, *args):
-    retry_count = 0
+            filter_.set_value(value)
+
+
+# What a column sets on its filter
+SET_VALUE = 'value'
+SET_MIN = 'min'
+SET_MAX = 'max'
+SET_SPECIAL_KEY = 'special_key'
+
+ColumnStep = namedtuple('ColumnStep', ['column', 'filter_column', 'filter_class', 'setter', 'special_key'])
+
+
+def compile_column(column):
+    """Resolve a CSV column to its filter once, returns a ColumnStep.
+
+    Raises an exception for columns that are no valid filter, e.g. unknown variables or bounds.
+    """
+    filter_column = column
+    bound = None
+
+    if '::' in column:
+        (filter_column, bound) = column.split('::', 2)
+
+    filter_class = immobrain_search_query.get_filter_for_column(filter_column)
+    if not filter_class:
+        raise Exception(
+            "Column '%s' is not a valid Filtercolumn" % filter_column)
+
+    if not bound:
+        return ColumnStep(column, filter_column, filter_class, SET_VALUE, None)
+    if bound == 'bis':
+        return ColumnStep(column, filter_column, filter_class, SET_MAX, None)
+    if bound == 'von':
+        return ColumnStep(column, filter_column, filter_class, SET_MIN, None)
+    special_key = filter_class(filter_column).special_key_name(bound)
+    if special_key is None:
+        raise Exception("This i cannot understand %s for %s!" %
+                        (bound, filter_column))
+    return ColumnStep(column, filter_column, filter_class, SET_SPECIAL_KEY, special_key)
+
+
+def api_request(name, method, path, **kwargs):
+    """Send a request to the API with the shared session. All requests go through here, name is one of
+    'vars', 'georef', 'queries', 'details' and 'results'."""
+    queued = time.monotonic()
+    if maintenance is not None:
+        maintenance.hold()
+    if rate_limiter is not None:
+        rate_limiter.acquire(name)
+    if circuit_breaker is not None:
+        circuit_breaker.acquire()
+    if concurrency_limit is not None:
+        concurrency_limit.acquire()
+    start = time.monotonic()
+    overloaded = False
+    failed = True
+    pool_wait = 0.0
+    try:
+        session = client.get_session()
+        with client.connections:
+            pool_wait = time.monotonic() - start
+            if progress is not None:
+                progress.request_started()
+            try:
+                r = session.request(method, client.endpoint + path,
+                                    auth=(client.username, client.password),
+                                    headers=kwargs.pop('headers', json_headers),
+                                    **kwargs)
+            finally:
+                if progress is not None:
+                    progress.request_finished()
+        overloaded = r.status_code in OVERLOAD_STATUS_CODES
+        failed = r.status_code >= 500
+        if overloaded and rate_limiter is not None:
+            rate_limiter.retry_after(name, r.headers.get('Retry-After'))
+        r.encoding = 'utf-8'
+        if metrics is not None:
+            metrics.observe_response(name, r.status_code, time.monotonic() - start - pool_wait,
+                                     body_size(kwargs.get('data')), len(r.content))
+        check_throttled(name, r.status_code, r.headers.get('Retry-After'))
+        return r
+    except requests.exceptions.RequestException as e:
+        overloaded = True
+        if metrics is not None:
+            metrics.observe_error(name, e, time.monotonic() - start - pool_wait)
+        raise
+    finally:
+        if concurrency_limit is not None:
+            concurrency_limit.release(time.monotonic() - start, overloaded)
+        if circuit_breaker is not None:
+            circuit_breaker.record(failed)
+        if metrics is not None:
+            metrics.observe_wait(name, start - queued)
+            metrics.observe_pool_wait(name, pool_wait)
+
+
+def check_throttled(name, status, retry_after_header):
+    """Raise AnalystApiThrottled for a 429 with Retry-After, so call_with_retries sends the request again.
+
+    A 429 without Retry-After is left to the caller, for /queries it is the yearly limit of the license. /vars is
+    not retried, an answer it could not give falls back to the cached documentation.
+    """
+    if status != 429 or name == 'vars':
+        return
+    retry_after = parse_retry_after(retry_after_header)
+    if retry_after is not None:
+        raise AnalystApiThrottled(f"Too many {name} requests, retry after {retry_after:.0f} seconds", retry_after)
+
+
+def body_size(data):
+    if data is None:
+        return 0
+    if isinstance(data, str):
+        return len(data.encode('utf-8'))
+    return len(data)
+
+
+def load_variable_documentation():
+    """Returns the variable documentation by key and sets the data vintage, use client.documentation()"""
+    (body, vintage_headers) = fetch_variable_documentation()
+    # Iterate over every possible variable
+    column_documentation = {}
+    for item in body['vars']:
+        column_documentation[item['key']] = item
+
+    vintage = data_vintage
+    if vintage is None:
+        vintage = next((str(body[key]) for key in VINTAGE_KEYS if key in body), None)
+    if vintage is None:
+        vintage = next((vintage_headers[key] for key in VINTAGE_KEYS if key in vintage_headers), None)
+    set_data_vintage(vintage)
+    return column_documentation
+
+
+def fetch_variable_documentation():
+    """Returns the body of /vars and its vintage headers.
+
+    A cached documentation younger than vars_max_age is used as it is. An older one is revalidated with its ETag and
+    Last-Modified date, and still used if the API cannot be reached. With `offline` only the cache is used.
+    """
+    key = '\n'.join([client.endpoint, client.username])
+    entry = vars_cache.get(key) if vars_cache is not None else None
+    if entry is not None and (offline or time.time() - entry['fetched'] < vars_max_age):
+        logging.info("Variable documentation found in cache")
+        return entry['body'], entry['vintage_headers']
+    if offline:
+        raise Exception(f'There is no cached variable documentation for {client.endpoint}, run once without --offline')
+
+    headers = dict(json_headers)
+    if entry is not None and entry['etag']:
+        headers['If-None-Match'] = entry['etag']
+    if entry is not None and entry['last_modified']:
+        headers['If-Modified-Since'] = entry['last_modified']
+    try:
+        r = api_request('vars', 'GET', '/vars/', headers=headers)
+    except requests.exceptions.RequestException as e:
+        if entry is None:
+            raise
+        logging.warning(f"Could not revalidate the variable documentation, using the cached one: {e}")
+        return entry['body'], entry['vintage_headers']
+
+    if r.status_code == 304 and entry is not None:
+        logging.info("Cached variable documentation is still valid")
+        entry['fetched'] = time.time()
+        vars_cache.put(key, entry)
+        return entry['body'], entry['vintage_headers']
+    if r.status_code >= 300:
+        if entry is not None:
+            logging.warning(f"Could not revalidate the variable documentation (status code {r.status_code}), "
+                            f"using the cached one")
+            return entry['body'], entry['vintage_headers']
+        try:
+            error = json.loads(r.text)['error']
+        except JSONDecodeError as jde:
+            raise Exception(f'Error loading variable documentation, status code: {r.status_code}\n'
+                            f'Invalid JSON received: "{r.text[:80]}\"...', jde)
+        raise Exception(f'Error loading variable documentation, error message from server was: {error}')
+
+    body = json.loads(r.text)
+    vintage_headers = {name: r.headers[name] for name in VINTAGE_KEYS if name in r.headers}
+    if vars_cache is not None:
+        vars_cache.put(key, {'body': body,
+                             'vintage_headers': vintage_headers,
+                             'etag': r.headers.get('ETag'),
+                             'last_modified': r.headers.get('Last-Modified'),
+                             'fetched': time.time()})
+    return body, vintage_headers
+
+
+def canonical_query(query):
+    return json.dumps(query, sort_keys=True, separators=(',', ':'))
+
+
+def query_hash(query):
+    # Query-IDs are only valid for the endpoint and user that created them
+    key = '\n'.join([client.endpoint, client.username, canonical_query(query)])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def check_results_status(status, query_id):
+    """Raise for answers of /results that are worth a retry (429 and 5xx). Only other errors reject the ID."""
+    if status in OVERLOAD_STATUS_CODES or status >= 500:
+        raise AnalystApiServerError(f"Results of query {query_id} are not available (status {status})")
+
+
+def create_registered_query(query, key):
+    (meta_data, details) = create_query(query)
+    if query_registry is not None:
+        query_registry.put(key, {'meta_data': meta_data, 'details': details})
+    return meta_data, details
+
+
+def create_query(query):
+    """POST the query document and pull its details (only with details_mode eager), returns (meta_data, details)"""
+    r = api_request('queries', 'POST', '/queries', data=json.dumps(query))
+    logging.debug(r.text)
+    meta_data = json.loads(r.text)
+    if r.status_code >= 400:
+        raise create_query_exception_from_response(r, meta_data["error"])
+    if details_mode != DETAILS_EAGER:
+        return meta_data, None
+    return meta_data, pull_details(meta_data['queryId'])
+
+
+@profiling.phased('details')
+def pull_details(query_id):
+    r = api_request('details', 'GET', '/queries/%s' % (query_id,))
+    logging.debug(r.text)
+    details = json.loads(r.text)
+    if r.status_code >= 400:
+        raise create_query_exception_from_response(r, details["error"])
+    return details
+
+
+def call_with_retries(func, *args, policy=None):
+    """Call func(*args) until it succeeds or the retry policy (default: retry_policy) gives up"""
+    policy = policy or retry_policy
+    attempt = 0
     start_time = time.time()
-    lasterror: Exception
     while True:
-        elapsed_time = time.time() - start_time
-        if retry_count >= max_retry_count or elapsed_time >= max_retry_time:
-            raise Exception(f'Failed to call "{func}" in {retry_count} tries in {elapsed_time} seconds. '
-                            f'Last error appended.', lasterror)
-        # if this is not the first try, sleep before next retry
-        if retry_count > 0:
-            logging.warning(f'Exception "{type(lasterror).__name__}" was raised in function "{func.__name__}", '
-                            f'retrying in {delay} secs, exception was {lasterror}')
-            time.sleep(delay)
-            logging.warning(f'Retrying call to function "{func.__name__}"')
         try:
             return func(*args)
-        # Pass on usage errors of the Analyst API, except a few
-        except AnalystApiError as e:
-            if e is GeorefOffline:
-                lasterror = e
-            else:
-                raise
-        # Retry for other errors like timeout, etc.
         except Exception as e:
-            lasterror = e
-        finally:
-            retry_count += 1
+            attempt += 1
+            elapsed_time = time.time() - start_time
+            delay = policy.next_delay(e, attempt, elapsed_time)
+            if delay is None:
+                raise give_up(policy, func, e, attempt, elapsed_time)
+            log_retry(func, e, delay)
+            if metrics is not None:
+                metrics.count_retry(func.__name__, policy.classify(e))
+            if progress is not None:
+                progress.count_retry(policy.classify(e))
+            time.sleep(delay)
+            logging.warning(f'Retrying call to function "{func.__name__}"')
+
+
+def set_data_vintage(vintage):
+    """Binds the result cache to the vintage. Without a vintage a new one would go unnoticed, the cache is closed."""
+    global result_cache
+    if vintage is not None:
+        logging.info(f"Data vintage is {vintage}")
+    if result_cache is None:
+        return
+    if vintage is None:
+        logging.warning("The API reports no data vintage, cached results are not used. "
+                        "Set it with --data-vintage or data_vintage in analystApi.login to use them")
+        result_cache.close()
+        result_cache = None
+        return
+    result_cache.check_vintage(vintage)
+
+
+def normalize_address(address):
+    return ' '.join(address.split()).lower()
+
+
+@profiling.phased('georef')
+def georef(address):
+    key = normalize_address(address)
+    if georef_cache is not None:
+        position = georef_cache.get(key)
+        if position is not None:
+            logging.debug("Position for %s found in cache" % (address,))
+            return position
+
+    return georef_flight.do(key, fetch_position, address, key)
+
+
+def fetch_position(address, key):
+    if georef_cache is not None:
+        # A flight that finished after the caller looked into the cache has stored the position already
+        position = georef_cache.get(key)
+        if position is not None:
+            return position
+    logging.debug("Pulling Position for %s" % (address,))
+    r = api_request('georef', 'GET', '/georef', params={"address": address})
+    position = position_from_georef(clean_response(r))
+    if georef_cache is not None:
+        georef_cache.put(key, position)
+    return position
+
+
+def position_from_georef(response):
+    return {
+        "lat": response["lat"],
+        "lon": response["lon"],
+        "precision": response["precision"],
+        "displayNameDE": response["displayNameDE"],
+        "biggerArea": response["biggerArea"],
+    }
 
 
 def clean_response(response):
@@ -277,7 +706,10 @@ def get_filter(filter_name):
 
 
 def create_georef_exception_from_response(response: requests.Response, message: str):
-    status = response.status_code
+    return create_georef_exception(response.status_code, message)
+
+
+def create_georef_exception(status: int, message: str):
     if status == 400:
         return GeorefAddressInvalid(message)
     elif status == 403:
@@ -288,12 +720,17 @@ def create_georef_exception_from_response(response: requests.Response, message:
         return GeorefMultipleFound(message)
     elif status == 503:
         return GeorefOffline(message)
+    elif status >= 500:
+        return AnalystApiServerError(message)
     else:
         return Exception(message)
 
 
 def create_query_exception_from_response(response: requests.Response, message: str):
-    status = response.status_code
+    return create_query_exception(response.status_code, message)
+
+
+def create_query_exception(status: int, message: str):
     if status == 400:
         return QueryMissingOrInvalidParameter(message)
     elif status == 403:
@@ -302,15 +739,29 @@ def create_query_exception_from_response(response: requests.Response, message: s
         return QuerySegmentNotFoundInLicense(message)
     elif status == 429:
         return QueryLimitReached(message)
+    elif status >= 500:
+        return AnalystApiServerError(message)
     else:
         return Exception(message)
 
 
 # noinspection PyPep8Naming
 class immobrain_filter:
+    """Base of the filters. The filters are created for every line, so they have __slots__ instead of a __dict__.
+
+    Values are changed with the set_... methods, which tell the owning immobrain_search_query to build its query
+    document again.
+    """
+    __slots__ = ('special_keys', 'owner')
+    known_special_keys = ()
+
     def __init__(self):
-        self.known_special_keys = []
         self.special_keys = {}
+        self.owner = None
+
+    def changed(self):
+        if self.owner is not None:
+            self.owner.query_changed()
 
     @staticmethod
     def get_sql_type():
@@ -320,24 +771,27 @@ class immobrain_filter:
         raise NotImplementedError("to_query Not Implemented")
 
     def has_special_key(self, key):
-        if any([key.lower() == known_attribute.lower() for known_attribute in self.known_special_keys]):
-            return True
-        return False
+        return self.special_key_name(key) is not None
+
+    def special_key_name(self, key):
+        """The correctly spelled special key, None if there is no such key"""
+        return next((correctly_spelled_key for correctly_spelled_key in self.known_special_keys
+                     if correctly_spelled_key.lower() == key.lower()), None)
 
     def set_special_key(self, key, value):
-        key = \
-            [correctly_spelled_key for correctly_spelled_key in self.known_special_keys if correctly_spelled_key.lower()
-             == key.lower()][0]
-        self.special_keys[key] = value
+        self.special_keys[self.special_key_name(key)] = value
+        self.changed()
 
 
 # noinspection PyPep8Naming
 class segmentFilter(immobrain_filter):
+    __slots__ = ('column_name', 'value')
+    name = 'segment'
+    unique = True
+
     def __init__(self, column_name):
         super().__init__()
         self.column_name = column_name
-        self.name = 'segment'
-        self.unique = True
         self.value = None
 
     @staticmethod
@@ -346,17 +800,20 @@ class segmentFilter(immobrain_filter):
 
     def set_value(self, value):
         self.value = value
+        self.changed()
 
     def to_query(self):
         return self.value
 
 
 class CategoryFilter(immobrain_filter):
+    __slots__ = ('column_name', 'value')
+    name = 'categoryFilters'
+    unique = False
+
     def __init__(self, column_name):
         super().__init__()
         self.column_name = column_name
-        self.name = 'categoryFilters'
-        self.unique = False
         self.value = None
 
     @staticmethod
@@ -367,6 +824,7 @@ class CategoryFilter(immobrain_filter):
         # Split by character is possibly the worst way to identify columns of arbitrary datatypes
         # that may or may not contain strings. Works fine for numerical lists though.
         self.value = value.split(' ')
+        self.changed()
 
     def to_query(self):
         return {"var": self.column_name,
@@ -374,6 +832,11 @@ class CategoryFilter(immobrain_filter):
 
 
 class BooleanFilter(immobrain_filter):
+    __slots__ = ('column_name', 'ternary_logic', 'value')
+    name = 'yesNoFilters'
+    unique = False
+    known_special_keys = ("includeTrue", "includeFalse", "includeUnknown")
+
     def __init__(self, column_name):
         super().__init__()
         self.column_name = column_name
@@ -381,10 +844,7 @@ class BooleanFilter(immobrain_filter):
         # if column_name[-1] == '3':
         #    self.ternary_logic = True
         #    logging.info("%s is ternary"%( self.column_name ) ) 
-        self.name = 'yesNoFilters'
-        self.unique = False
         self.value = None
-        self.known_special_keys = ["includeTrue", "includeFalse", "includeUnknown"]
         self.special_keys = {"includeUnknown": include_unknown_default}  # default
 
     @staticmethod
@@ -394,6 +854,9 @@ class BooleanFilter(immobrain_filter):
     @staticmethod
     def to_bool(value):
         """ Mimmic Java.lang.boolean """
+        if isinstance(value, bool):
+            # include_unknown_default
+            return value
         true = ['true', '1']
         false = ['false', '0']
         if value.lower() in true:
@@ -416,15 +879,17 @@ class BooleanFilter(immobrain_filter):
 
 # noinspection PyPep8Naming
 class rangeFilter(immobrain_filter):
+    __slots__ = ('filter_name', 'min', 'max')
+    name = 'rangeFilters'
+    # Is it possible to have multiple of these in an array of filters, or is it exactly one?
+    unique = False
+    known_special_keys = ("includeunknown",)
+
     def __init__(self, column_name):
         super().__init__()
         self.filter_name = column_name
-        self.name = 'rangeFilters'
         self.min = None
         self.max = None
-        # Is it possible to have multiple of these in an array of filters, or is it exactly one?
-        self.unique = False
-        self.known_special_keys = ["includeunknown"]
 
     @staticmethod
     def get_sql_type():
@@ -439,13 +904,16 @@ class rangeFilter(immobrain_filter):
 
     def set_min(self, min_):
         self.min = self.sanitize(min_)
+        self.changed()
 
     def set_max(self, max_):
         self.max = self.sanitize(max_)
+        self.changed()
 
     def set_value(self, value):
         self.min = float(value) - 2
         self.max = float(value) + 2
+        self.changed()
 
     def to_query(self):
         doc = {
@@ -464,14 +932,16 @@ class rangeFilter(immobrain_filter):
 
 # noinspection PyPep8Naming
 class rangeDateFilter(immobrain_filter):
+    __slots__ = ('filter_name', 'min', 'max')
+    name = 'rangeDateFilters'
+    # Is it possible to have multiple of these in an array of filters, or is it exactly one?
+    unique = False
+
     def __init__(self, column_name):
         super().__init__()
         self.filter_name = column_name
-        self.name = 'rangeDateFilters'
         self.min = None
         self.max = None
-        # Is it possible to have multiple of these in an array of filters, or is it exactly one?
-        self.unique = False
 
     @staticmethod
     def get_sql_type():
@@ -479,13 +949,16 @@ class rangeDateFilter(immobrain_filter):
 
     def set_min(self, min_):
         self.min = min_
+        self.changed()
 
     def set_max(self, max_):
         self.max = max_
+        self.changed()
 
     def set_value(self, value):
         self.min = float(value) - 2
         self.max = float(value) + 2
+        self.changed()
 
     def to_query(self):
         doc = {
@@ -501,14 +974,16 @@ class rangeDateFilter(immobrain_filter):
 
 # noinspection PyPep8Naming
 class timePeriodFilter(immobrain_filter):
+    __slots__ = ('filter_name', 'min', 'max')
+    name = 'timePeriodFilter'
+    # Is it possible to have multiple of these in an array of filters, or is it exactly one?
+    unique = True
+
     def __init__(self, column_name):
         super().__init__()
         self.filter_name = column_name
-        self.name = 'timePeriodFilter'
         self.min = None
         self.max = None
-        # Is it possible to have multiple of these in an array of filters, or is it exactly one?
-        self.unique = True
 
     @staticmethod
     def get_sql_type():
@@ -516,9 +991,11 @@ class timePeriodFilter(immobrain_filter):
 
     def set_min(self, min_):
         self.min = min_
+        self.changed()
 
     def set_max(self, max_):
         self.max = max_
+        self.changed()
 
     def to_query(self):
         doc = {}
@@ -532,11 +1009,14 @@ class timePeriodFilter(immobrain_filter):
 
 # noinspection PyPep8Naming
 class peripherySpatialFilter(immobrain_filter):
+    __slots__ = ('column_name', 'lat', 'lon', 'precision', 'displayName', 'biggerArea', 'known_error', 'adresse')
+    name = 'peripherySpatialFilter'
+    unique = True
+    known_special_keys = ("distance", "minCount", "maxDistance")
+
     def __init__(self, column_name):
         super().__init__()
         self.column_name = column_name
-        self.name = 'peripherySpatialFilter'
-        self.unique = True
 
         self.lat = None
         self.lon = None
@@ -544,7 +1024,6 @@ class peripherySpatialFilter(immobrain_filter):
         self.displayName = None
         self.biggerArea = None
 
-        self.known_special_keys = ["distance", "minCount", "maxDistance"]
         self.special_keys = {"distance": .2}  # default
         self.known_error = None
 
@@ -556,21 +1035,18 @@ class peripherySpatialFilter(immobrain_filter):
 
     def set_value(self, value):
         self.adresse = value
-        call_with_retries(MAX_RETRY_COUNT, MAX_RETRY_TIME, RETRY_DELAY, self.get_position)
+        call_with_retries(self.get_position)
 
     def get_position(self):
-        logging.debug("Pulling Position for %s" % (self.adresse,))
-        r = immobrain_search_query.session.get(endpoint + '/georef',
-                                               auth=(username, password),
-                                               params={"address": self.adresse},
-                                               headers=json_headers)
-        response = clean_response(r)
-
-        self.lat = response["lat"]
-        self.lon = response["lon"]
-        self.precision = response["precision"]
-        self.displayName = response["displayNameDE"]
-        self.biggerArea = response["biggerArea"]
+        self.set_position(georef(self.adresse))
+
+    def set_position(self, position):
+        self.lat = position["lat"]
+        self.lon = position["lon"]
+        self.precision = position["precision"]
+        self.displayName = position["displayNameDE"]
+        self.biggerArea = position["biggerArea"]
+        self.changed()
 
     def to_query(self):
         if not self.lon and not self.lat:
@@ -0,0 +1,340 @@
+# Python script to query REST-API from empirica-systeme, see
+# https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", see
+# http://creativecommons.org/licenses/by/4.0/
+#
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+# asyncio variant of the requests in api_basic. Filters, caches and the output lines are shared with the
+# thread pool engine, only the HTTP calls are awaited here.
+
+import asyncio
+import json
+import logging
+import time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from analystApi import api_basic, profiling
+from analystApi.csv_line import ExecutionResult, build_search_query, build_output_row, order_values, \
+    skip_remaining_values, log_line_done, handle_line_exception, error_class
+from analystApi.maintenance import MAX_SLEEP_SECONDS
+from analystApi.retry import give_up, log_retry
+from analystApi.singleflight import AsyncSingleFlight
+
+DEFAULT_MAX_IN_FLIGHT = 200
+
+georef_flight = AsyncSingleFlight()
+query_flight = AsyncSingleFlight()
+details_flight = AsyncSingleFlight()
+# Waiting for api_basic.concurrency_limit, created in the event loop
+limit_condition = None
+
+
+async def call_with_retries(func, *args, policy=None):
+    """Counterpart of api_basic.call_with_retries"""
+    policy = policy or api_basic.retry_policy
+    attempt = 0
+    start_time = time.time()
+    while True:
+        try:
+            return await func(*args)
+        except Exception as e:
+            attempt += 1
+            elapsed_time = time.time() - start_time
+            delay = policy.next_delay(e, attempt, elapsed_time)
+            if delay is None:
+                raise give_up(policy, func, e, attempt, elapsed_time)
+            log_retry(func, e, delay)
+            if api_basic.metrics is not None:
+                api_basic.metrics.count_retry(func.__name__, policy.classify(e))
+            if api_basic.progress is not None:
+                api_basic.progress.count_retry(policy.classify(e))
+            await asyncio.sleep(delay)
+            logging.warning(f'Retrying call to function "{func.__name__}"')
+
+
+async def request(session, name, method, path, **kwargs):
+    """Counterpart of api_basic.api_request, returns (status, text, url, elapsed seconds)"""
+    queued = time.monotonic()
+    await hold_maintenance()
+    if api_basic.rate_limiter is not None:
+        wait = api_basic.rate_limiter.reserve(name)
+        if wait > 0:
+            await asyncio.sleep(wait)
+    circuit_breaker = api_basic.circuit_breaker
+    if circuit_breaker is not None:
+        wait = circuit_breaker.check()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = circuit_breaker.check()
+    concurrency_limit = api_basic.concurrency_limit
+    if concurrency_limit is not None:
+        try:
+            async with limit_condition:
+                await limit_condition.wait_for(concurrency_limit.try_acquire)
+        except asyncio.CancelledError:
+            # This may be the probe of the circuit breaker, cancelled before it was sent
+            if circuit_breaker is not None:
+                circuit_breaker.cancelled()
+            raise
+    start = time.monotonic()
+    overloaded = False
+    failed = True
+    cancelled = False
+    metrics = api_basic.metrics
+    progress = api_basic.progress
+    if progress is not None:
+        progress.request_started()
+    try:
+        async with session.request(method, api_basic.client.endpoint + path, **kwargs) as r:
+            body = await r.read()
+        text = body.decode('utf-8')
+        overloaded = r.status in api_basic.OVERLOAD_STATUS_CODES
+        failed = r.status >= 500
+        if overloaded and api_basic.rate_limiter is not None:
+            api_basic.rate_limiter.retry_after(name, r.headers.get('Retry-After'))
+        if metrics is not None:
+            metrics.observe_response(name, r.status, time.monotonic() - start,
+                                     api_basic.body_size(kwargs.get('data')), len(body))
+        api_basic.check_throttled(name, r.status, r.headers.get('Retry-After'))
+        return r.status, text, str(r.url), time.monotonic() - start
+    except aiohttp.ClientError as e:
+        overloaded = True
+        if metrics is not None:
+            metrics.observe_error(name, e, time.monotonic() - start)
+        raise
+    except asyncio.CancelledError:
+        # Another value of the line failed, this is neither a sign of an outage nor of the API being back
+        cancelled = True
+        raise
+    finally:
+        if progress is not None:
+            progress.request_finished()
+        if concurrency_limit is not None:
+            concurrency_limit.release(time.monotonic() - start, overloaded)
+            async with limit_condition:
+                limit_condition.notify_all()
+        if circuit_breaker is not None:
+            if cancelled:
+                circuit_breaker.cancelled()
+            else:
+                circuit_breaker.record(failed)
+        if metrics is not None:
+            metrics.observe_wait(name, start - queued)
+
+
+async def hold_maintenance(lead=0.0):
+    """Counterpart of api_basic.maintenance.hold()"""
+    if api_basic.maintenance is None:
+        return
+    left = api_basic.maintenance.seconds_left(lead=lead)
+    while left > 0:
+        api_basic.maintenance.announce(left)
+        await asyncio.sleep(min(left, MAX_SLEEP_SECONDS))
+        left = api_basic.maintenance.seconds_left(lead=lead)
+
+
+async def get_position(session, address_filter):
+    address_filter.set_position(await georef(session, address_filter.adresse))
+
+
+@profiling.phased('georef')
+async def georef(session, address):
+    key = api_basic.normalize_address(address)
+    if api_basic.georef_cache is not None:
+        position = api_basic.georef_cache.get(key)
+        if position is not None:
+            logging.debug("Position for %s found in cache" % (address,))
+            return position
+
+    return await georef_flight.do(key, fetch_position, session, address, key)
+
+
+async def fetch_position(session, address, key):
+    if api_basic.georef_cache is not None:
+        # A flight that finished after the caller looked into the cache has stored the position already
+        position = api_basic.georef_cache.get(key)
+        if position is not None:
+            return position
+    logging.debug("Pulling Position for %s" % (address,))
+    (status, text, _, _) = await request(session, 'georef', 'GET', '/georef', params={"address": address})
+    body = json.loads(text)
+    if status >= 300:
+        raise api_basic.create_georef_exception(status, body['error'])
+    position = api_basic.position_from_georef(body)
+    if api_basic.georef_cache is not None:
+        api_basic.georef_cache.put(key, position)
+    return position
+
+
+@profiling.phased('create query')
+async def generate_id(session, isq, use_registry=True):
+    query = isq.to_query()
+    key = isq.get_query_hash()
+    if use_registry and isq.load_from_registry(key):
+        return
+    (isq.meta_data, isq.details) = await query_flight.do(key, create_registered_query, session, query, key)
+    isq.id = isq.meta_data['queryId']
+    isq.from_registry = False
+
+
+async def pull_details_for_query(session, isq):
+    isq.details = await details_flight.do(isq.id, pull_details, session, isq.id)
+    isq.register_details()
+
+
+async def pull_missing_details(session, isq, entry_id):
+    """Counterpart of csv_transform.pull_missing_details"""
+    if not isq.details_missing():
+        return
+    try:
+        await call_with_retries(pull_details_for_query, session, isq)
+    except Exception as e:
+        logging.warning(f"{entry_id}: Could not pull details of query {isq.id}: {str(e)}")
+
+
+async def create_registered_query(session, query, key):
+    (meta_data, details) = await create_query(session, query)
+    if api_basic.query_registry is not None:
+        api_basic.query_registry.put(key, {'meta_data': meta_data, 'details': details})
+    return meta_data, details
+
+
+async def create_query(session, query):
+    (status, text, _, _) = await request(session, 'queries', 'POST', '/queries', data=json.dumps(query))
+    logging.debug(text)
+    meta_data = json.loads(text)
+    if status >= 400:
+        raise api_basic.create_query_exception(status, meta_data["error"])
+    if api_basic.details_mode != api_basic.DETAILS_EAGER:
+        return meta_data, None
+    return meta_data, await pull_details(session, meta_data['queryId'])
+
+
+@profiling.phased('details')
+async def pull_details(session, query_id):
+    (status, text, _, _) = await request(session, 'details', 'GET', '/queries/%s' % (query_id,))
+    logging.debug(text)
+    details = json.loads(text)
+    if status >= 400:
+        raise api_basic.create_query_exception(status, details["error"])
+    return details
+
+
+@profiling.phased('collect')
+async def collect(session, isq, type_):
+    if not isq.id:
+        await generate_id(session, isq)
+    if isq.load_cached_result(type_):
+        return
+    logging.info("Querying: %s" % isq.id)
+    (status, text, url, elapsed) = await request(session, 'results', 'GET', '/results/%s/%s' % (isq.id, type_))
+    if int(elapsed) > 1:
+        logging.warning(f"Query {isq.id} ({url}) took too long: {int(elapsed)} seconds")
+    if status < 300:
+        isq.store_result(type_, text)
+    else:
+        api_basic.check_results_status(status, isq.id)
+        use_registry = isq.id_outdated()
+        if use_registry is not None:
+            await generate_id(session, isq, use_registry=use_registry)
+            logging.info("New Query-ID = %s" % isq.id)
+            await collect(session, isq, type_)
+
+
+async def collect_values(session, isq, entry_id, values_to_add, collected_errormessages, row_fanout):
+    """Counterpart of csv_transform.collect_values"""
+    values = order_values(values_to_add)
+    serial = values if row_fanout <= 1 else values[:1]
+    for value in serial:
+        if skip_remaining_values(isq, entry_id, value):
+            return
+        try:
+            await call_with_retries(collect, session, isq, value)
+        except Exception as e:
+            logging.warning(f"{entry_id}: {str(e)}")
+            collected_errormessages.append(e)
+            return
+
+    remaining = values[len(serial):]
+    if not remaining or skip_remaining_values(isq, entry_id, remaining[0]):
+        return
+
+    semaphore = asyncio.Semaphore(row_fanout)
+
+    async def collect_one(value):
+        async with semaphore:
+            await call_with_retries(collect, session, isq, value)
+
+    # Lazy details are pulled while the values are collected
+    details = asyncio.create_task(pull_missing_details(session, isq, entry_id)) if isq.details_missing() else None
+    tasks = [asyncio.create_task(collect_one(value)) for value in remaining]
+    (done, pending) = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    if details is not None:
+        await details
+    for task in tasks:
+        if task in done and task.exception() is not None:
+            logging.warning(f"{entry_id}: {str(task.exception())}")
+            collected_errormessages.append(task.exception())
+            return
+
+
+async def execute_query_per_csv_line(session, line, values_to_add, csv_writer, row_fanout=1):
+    start = time.monotonic()
+    try:
+        collected_errormessages = []
+        with profiling.phase('build query'):
+            (isq, entry_id, address_filters) = build_search_query(line, collected_errormessages, defer_georef=True)
+        for address_filter in address_filters:
+            try:
+                await call_with_retries(get_position, session, address_filter)
+            except Exception as e:
+                collected_errormessages.append(e)
+
+        # Execute Querys and collect values as required.
+        await collect_values(session, isq, entry_id, values_to_add, collected_errormessages, row_fanout)
+        await pull_missing_details(session, isq, entry_id)
+
+        csv_writer.writerow(build_output_row(line, isq))
+        log_line_done(line, isq, collected_errormessages)
+
+        return ExecutionResult(entry_id, isq.id, not collected_errormessages, time.monotonic() - start,
+                               error_class(collected_errormessages))
+
+    except Exception as e:
+        return handle_line_exception(e)
+
+
+def run(csv_entrys, values_to_add, csv_writer, max_in_flight, on_result, drain_seconds=0.0, row_fanout=1):
+    """Execute all lines with up to max_in_flight lines at the same time, on_result is called for every
+    ExecutionResult"""
+    if aiohttp is None:
+        raise Exception("The asyncio engine requires aiohttp, install it with 'pip install aiohttp'")
+    logging.info(f"Using asyncio with up to {max_in_flight} lines in flight")
+    asyncio.run(_run(csv_entrys, values_to_add, csv_writer, max_in_flight, on_result, drain_seconds, row_fanout))
+
+
+async def _run(csv_entrys, values_to_add, csv_writer, max_in_flight, on_result, drain_seconds, row_fanout):
+    global limit_condition
+    limit_condition = asyncio.Condition()
+    connector = aiohttp.TCPConnector(limit=max_in_flight)
+    async with aiohttp.ClientSession(connector=connector,
+                                     auth=aiohttp.BasicAuth(api_basic.client.username, api_basic.client.password),
+                                     headers=api_basic.json_headers,
+                                     timeout=aiohttp.ClientTimeout(total=None)) as session:
+        entries = iter(csv_entrys)
+
+        async def worker():
+            for line in entries:
+                # No new lines shortly before and within a maintenance window
+                await hold_maintenance(lead=drain_seconds)
+                on_result(await execute_query_per_csv_line(session, line, values_to_add, csv_writer, row_fanout))
+
+        await asyncio.gather(*(worker() for _ in range(max_in_flight)))
@@ -0,0 +1,170 @@
+import csv
+import io
+import logging
+import os
+import queue
+import threading
+import time
+
+from analystApi import profiling
+
+DEFAULT_FLUSH_INTERVAL = 1.0   # seconds
+DEFAULT_FLUSH_ROWS = 1000
+
+_HEADER = 'header'
+_ROW = 'row'
+_CHECKPOINT = 'checkpoint'
+_CLOSE = 'close'
+
+
+class BatchingDictWriter:
+    """csv.DictWriter whose rows are formatted and written by a thread of its own.
+
+    writerow only puts the row into a queue, so callers never wait for the disk. The writer thread collects the
+    formatted rows and writes them to the file in one call every flush_interval seconds or flush_rows rows.
+    Rows with fields not in fieldnames are refused by writerow already. If writing fails, the writer thread stops
+    and writerow, checkpoint and close raise the error instead.
+    """
+
+    def __init__(self, f, fieldnames, flush_interval=DEFAULT_FLUSH_INTERVAL, flush_rows=DEFAULT_FLUSH_ROWS,
+                 restval="", extrasaction="raise", dialect="excel", *args, **kwds):
+        self.f = f
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.fieldnames = fieldnames
+        self.extrasaction = extrasaction
+        self.error = None
+        self.queue = queue.SimpleQueue()
+        self.buffer = io.StringIO()
+        self.writer = csv.DictWriter(self.buffer, fieldnames, restval, extrasaction, dialect, *args, **kwds)
+        self.thread = threading.Thread(target=self.run, name='BatchingDictWriter', daemon=True)
+        self.thread.start()
+
+    def writeheader(self):
+        self.queue.put((_HEADER, None))
+
+    def writerow(self, rowdict):
+        self.check_error()
+        if self.extrasaction == 'raise':
+            # As csv.DictWriter would, but in the caller's thread, so the line fails
+            wrong_fields = rowdict.keys() - self.fieldnames
+            if wrong_fields:
+                raise ValueError("dict contains fields not in fieldnames: "
+                                 + ", ".join([repr(x) for x in wrong_fields]))
+        self.queue.put((_ROW, rowdict))
+
+    def writerows(self, rowdicts):
+        for rowdict in rowdicts:
+            self.writerow(rowdict)
+
+    def checkpoint(self):
+        """Write everything queued so far and flush it to disk, returns when done"""
+        done = threading.Event()
+        self.queue.put((_CHECKPOINT, done))
+        while not done.wait(1.0):
+            if not self.thread.is_alive():
+                # closed or failed in the meantime
+                break
+        self.check_error()
+
+    def close(self):
+        """Write all queued rows and stop the writer thread. The file itself is not closed."""
+        self.queue.put((_CLOSE, None))
+        self.thread.join()
+        self.check_error()
+
+    def check_error(self):
+        if self.error is not None:
+            raise Exception(f"Writing the output failed: {self.error}") from self.error
+
+    def run(self):
+        try:
+            self.write_queued()
+        except BaseException as e:
+            logging.exception("Writing the output failed, no more rows are written")
+            self.error = e
+
+    def write_queued(self):
+        pending_rows = 0
+        last_flush = time.monotonic()
+        while True:
+            try:
+                (kind, item) = self.queue.get(timeout=max(0.0, last_flush + self.flush_interval - time.monotonic()))
+            except queue.Empty:
+                (kind, item) = (None, None)
+
+            try:
+                if kind == _ROW:
+                    self.format_row(item)
+                    pending_rows += 1
+                elif kind == _HEADER:
+                    self.format_header()
+                    pending_rows += 1
+            except Exception:
+                logging.exception(f"Could not write row {item}")
+
+            if kind in (_CHECKPOINT, _CLOSE) or pending_rows >= self.flush_rows \
+                    or time.monotonic() - last_flush >= self.flush_interval:
+                self.flush()
+                pending_rows = 0
+                last_flush = time.monotonic()
+
+            if kind == _CHECKPOINT:
+                self.sync()
+                item.set()
+            elif kind == _CLOSE:
+                return
+
+    @profiling.phased('csv write')
+    def format_header(self):
+        self.writer.writeheader()
+
+    @profiling.phased('csv write')
+    def format_row(self, rowdict):
+        self.writer.writerow(rowdict)
+
+    def sync(self):
+        os.fsync(self.f.fileno())
+
+    @profiling.phased('csv write')
+    def flush(self):
+        data = self.buffer.getvalue()
+        if data:
+            self.f.write(data)
+            self.f.flush()
+            self.buffer.seek(0)
+            self.buffer.truncate()
+
+
+class MultiWriter:
+    """Passes the rows on to several writers, e.g. the output CSV and a database"""
+
+    def __init__(self, writers):
+        self.writers = writers
+
+    def writeheader(self):
+        for writer in self.writers:
+            writer.writeheader()
+
+    def writerow(self, rowdict):
+        for writer in self.writers:
+            writer.writerow(rowdict)
+
+    def writerows(self, rowdicts):
+        for rowdict in rowdicts:
+            self.writerow(rowdict)
+
+    def checkpoint(self):
+        for writer in self.writers:
+            writer.checkpoint()
+
+    def close(self):
+        # Every writer is closed, even if one of them failed
+        errors = []
+        for writer in self.writers:
+            try:
+                writer.close()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
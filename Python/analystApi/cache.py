@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+PRUNE_INTERVAL = 1000   # check the size limit every n puts
+BUSY_TIMEOUT = 30.0     # seconds to wait for other processes (e.g. shards) writing the same file
+
+
+class SqliteCache:
+    """Persistent key/value store in a sqlite file, values are stored as JSON.
+
+    Entries older than `ttl` seconds are treated as missing. If `max_entries` is set, the least recently used
+    entries are removed once the table grows beyond it. The connection is shared by all threads.
+    """
+
+    def __init__(self, filename, table='cache', ttl=None, max_entries=None):
+        self.filename = filename
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.puts_since_prune = 0
+
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(filename, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                                          isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(f'CREATE TABLE IF NOT EXISTS {table} ('
+                                f'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                                f'created REAL NOT NULL, accessed REAL NOT NULL)')
+        self.connection.execute(f'CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed)')
+        logging.info(f"Opened cache {filename} ({table}) with {len(self)} entries")
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(f'SELECT value, created FROM {self.table} WHERE key = ?',
+                                          (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl and now - row[1] > self.ttl:
+                self.connection.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+                return None
+            self.connection.execute(f'UPDATE {self.table} SET accessed = ? WHERE key = ?', (now, key))
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(f'INSERT INTO {self.table} (key, value, created, accessed) VALUES (?, ?, ?, ?) '
+                                    f'ON CONFLICT (key) DO UPDATE SET value = excluded.value, '
+                                    f'created = excluded.created, accessed = excluded.accessed',
+                                    (key, json.dumps(value), now, now))
+            self.puts_since_prune += 1
+            if self.puts_since_prune >= PRUNE_INTERVAL:
+                self._prune()
+
+    def delete(self, key):
+        with self.lock:
+            self.connection.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+
+    def purge(self):
+        with self.lock:
+            self.connection.execute(f'DELETE FROM {self.table}')
+        logging.info(f"Purged cache {self.filename} ({self.table})")
+
+    def prune(self):
+        with self.lock:
+            self._prune()
+
+    def _prune(self):
+        self.puts_since_prune = 0
+        if self.ttl:
+            self.connection.execute(f'DELETE FROM {self.table} WHERE created < ?', (time.time() - self.ttl,))
+        if self.max_entries:
+            # Keep the most recently used entries only
+            self.connection.execute(f'DELETE FROM {self.table} WHERE key IN ('
+                                    f'SELECT key FROM {self.table} ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                                    (self.max_entries,))
+
+    def close(self):
+        with self.lock:
+            self._prune()
+            self.connection.close()
+
+
+class ResultCache(SqliteCache):
+    """SqliteCache for query results, which are only valid for the data vintage they were fetched from.
+
+    The vintage is kept in a table of its own, so neither the size limit nor the TTL of the results removes it.
+    """
+
+    VINTAGE_KEY = '__vintage__'
+
+    def __init__(self, filename, table='results', ttl=None, max_entries=None):
+        super().__init__(filename, table=table, ttl=ttl, max_entries=max_entries)
+        self.meta_table = f'{table}_meta'
+        with self.lock:
+            self.connection.execute(f'CREATE TABLE IF NOT EXISTS {self.meta_table} ('
+                                    f'key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    def get_meta(self, key):
+        with self.lock:
+            row = self.connection.execute(f'SELECT value FROM {self.meta_table} WHERE key = ?', (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put_meta(self, key, value):
+        with self.lock:
+            self.connection.execute(f'INSERT INTO {self.meta_table} (key, value) VALUES (?, ?) '
+                                    f'ON CONFLICT (key) DO UPDATE SET value = excluded.value', (key, json.dumps(value)))
+
+    def check_vintage(self, vintage):
+        """Drop all results if the API reports another data vintage than the one they were fetched from"""
+        if vintage is None:
+            return
+        cached_vintage = self.get_meta(ResultCache.VINTAGE_KEY)
+        if cached_vintage == vintage:
+            return
+        if cached_vintage is not None:
+            logging.warning(f"Data vintage changed from {cached_vintage} to {vintage}, dropping cached results")
+            self.purge()
+        self.put_meta(ResultCache.VINTAGE_KEY, vintage)
@@ -0,0 +1,96 @@
+import logging
+import threading
+import time
+
+DEFAULT_FAILURE_THRESHOLD = 5       # consecutive failures
+DEFAULT_OPEN_SECONDS = 30.0
+DEFAULT_MAX_OPEN_SECONDS = 600.0
+PROBE_POLL_SECONDS = 0.5
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+    """Pauses all requests while the API seems to be down.
+
+    After `failure_threshold` failures (5xx, connection errors) in a row the breaker opens and no request is sent for
+    `open_seconds`. Then a single request is let through as a probe (half-open). If it succeeds, the breaker closes
+    and everybody continues, otherwise it opens again for twice as long, up to `max_open_seconds`. A probe that
+    reports nothing within `max_open_seconds` is taken as lost, the next caller probes instead.
+    """
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, open_seconds=DEFAULT_OPEN_SECONDS,
+                 max_open_seconds=DEFAULT_MAX_OPEN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.current_open_seconds = open_seconds
+        self.open_until = 0.0
+        self.probe_started = 0.0
+        self.lock = threading.Lock()
+
+    def check(self):
+        """Returns the seconds to wait before asking again, 0 if the request may be sent now.
+
+        In the half-open state only the first caller gets 0 and has to report the outcome of its request as probe.
+        """
+        with self.lock:
+            if self.state == CLOSED:
+                return 0.0
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now < self.open_until:
+                    return self.open_until - now
+                self.state = HALF_OPEN
+                self.probe_started = now
+                logging.warning("Probing whether the Analyst API is available again")
+                return 0.0
+            if now - self.probe_started >= self.max_open_seconds:
+                self.probe_started = now
+                logging.warning("The probe of the Analyst API did not report back, probing again")
+                return 0.0
+            # A probe is in flight
+            return PROBE_POLL_SECONDS
+
+    def acquire(self):
+        while True:
+            wait = self.check()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def record(self, failed):
+        """Report the outcome of a request sent after check() or acquire()"""
+        with self.lock:
+            if not failed:
+                if self.state != CLOSED:
+                    logging.warning("Analyst API is available again, resuming")
+                self.state = CLOSED
+                self.failures = 0
+                self.current_open_seconds = self.open_seconds
+                return
+
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self.current_open_seconds = min(self.max_open_seconds, self.current_open_seconds * 2)
+                self._open()
+            elif self.state == CLOSED and self.failures >= self.failure_threshold:
+                self._open()
+
+    def cancelled(self):
+        """Report a request sent after check() or acquire() that was cancelled before it got an answer. It is no
+        success nor failure, but if it was the probe, the next caller probes instead."""
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.state = OPEN
+                self.open_until = time.monotonic()
+
+    def _open(self):
+        self.state = OPEN
+        self.open_until = time.monotonic() + self.current_open_seconds
+        logging.warning(f"Analyst API seems to be down after {self.failures} failed requests, "
+                        f"pausing all requests for {self.current_open_seconds:.0f} seconds")
@@ -0,0 +1,86 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+DEFAULT_LATENCY_WINDOW = 100        # requests per latency sample
+DEFAULT_LATENCY_TOLERANCE = 2.0     # p95 may grow up to this factor of the baseline
+DEFAULT_DECREASE_FACTOR = 0.5
+DEFAULT_DECREASE_COOLDOWN = 5.0     # seconds between two decreases
+BASELINE_DRIFT = 1.1
+
+
+class AdaptiveConcurrencyLimit:
+    """Limit for the requests in flight, adapted by additive increase / multiplicative decrease (AIMD).
+
+    While the limit is used and latency stays flat, the limit grows by about one per `limit` completed requests.
+    It is multiplied by `decrease_factor` if a request was overloaded (429, 503, connection errors) or the p95 latency
+    of the last `latency_window` requests exceeds `latency_tolerance` times the baseline, the best p95 seen so far.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=39, latency_window=DEFAULT_LATENCY_WINDOW,
+                 latency_tolerance=DEFAULT_LATENCY_TOLERANCE, decrease_factor=DEFAULT_DECREASE_FACTOR,
+                 decrease_cooldown=DEFAULT_DECREASE_COOLDOWN):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self.latencies = deque(maxlen=latency_window)
+        self.baseline_p95 = None
+        self.last_decrease = 0.0
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    @property
+    def current_limit(self):
+        return int(self.limit)
+
+    def try_acquire(self):
+        with self.condition:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, overloaded=False):
+        with self.condition:
+            self.in_flight -= 1
+            if overloaded:
+                self._decrease('overload')
+            else:
+                self._observe(latency)
+            self.condition.notify_all()
+
+    def _observe(self, latency):
+        self.latencies.append(latency)
+        if len(self.latencies) == self.latencies.maxlen:
+            p95 = sorted(self.latencies)[math.ceil(0.95 * len(self.latencies)) - 1]
+            self.latencies.clear()
+            if self.baseline_p95 is None or p95 < self.baseline_p95:
+                self.baseline_p95 = p95
+            elif p95 > self.latency_tolerance * self.baseline_p95:
+                self._decrease(f'p95 latency {p95:.3f}s, baseline {self.baseline_p95:.3f}s')
+                # A lasting change of the latency becomes the new baseline after a while
+                self.baseline_p95 = min(p95, self.baseline_p95 * BASELINE_DRIFT)
+                return
+
+        # Only grow while the limit is actually used
+        if self.in_flight + 1 >= int(self.limit):
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def _decrease(self, reason):
+        now = time.monotonic()
+        if now - self.last_decrease < self.decrease_cooldown:
+            return
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit * self.decrease_factor)
+        logging.info(f"Concurrency limit decreased to {self.current_limit} ({reason})")
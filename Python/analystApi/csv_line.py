@@ -0,0 +1,181 @@
+# Python script to query REST-API from empirica-systeme, see
+# https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", see
+# http://creativecommons.org/licenses/by/4.0/
+#
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+# Turning a CSV line into a query and the query into an output line. Shared by all execution engines,
+# so that they produce the same output.
+
+import json
+import logging
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+
+from analystApi import api_basic, profiling
+
+brokenColumns = []
+
+
+class ExecutionResult:
+    def __init__(self, object_id: str, query_id: int, successful: bool, seconds: float = None, error: str = None):
+        self.object_id = object_id
+        self.query_id = query_id
+        self.successful = successful
+        # Time the line took, None if it failed unexpectedly
+        self.seconds = seconds
+        # Exception class of the first error of a failed line
+        self.error = error
+
+
+# What a column of the input is used for
+ID_COLUMN = 'id'
+ADDRESS_COLUMN = 'address'
+FILTER_COLUMN = 'filter'
+
+PlannedColumn = namedtuple('PlannedColumn', ['column', 'kind', 'step'])
+
+compiled_headers = {}
+compiled_headers_lock = threading.Lock()
+
+
+def compile_header(fieldnames):
+    """Resolve the columns of a header once, returns a tuple of PlannedColumn.
+
+    Columns that are no valid filter are reported here and left out of the plan. If the variable documentation
+    cannot be loaded, the error is raised and no plan is compiled, as every filter column would seem invalid.
+    """
+    api_basic.client.documentation()
+    plan = []
+    for column_name in fieldnames:
+        if column_name is None:
+            # Surplus values of a line
+            continue
+        if column_name.lower() == 'id':
+            plan.append(PlannedColumn(column_name, ID_COLUMN, None))
+            continue
+        if column_name.lower() in ['kommentar', 'comment']:
+            # Let's not complain about comments and ID being invalid filters.
+            continue
+        try:
+            step = api_basic.compile_column(column_name)
+        except Exception as e:
+            brokenColumns.append(column_name)
+            logging.warning(f"Could not add column {column_name}")
+            logging.warning(str(e))
+            continue
+        plan.append(PlannedColumn(column_name, ADDRESS_COLUMN if column_name.lower() == 'adresse' else FILTER_COLUMN,
+                                  step))
+    return tuple(plan)
+
+
+def header_plan(fieldnames):
+    """The compiled plan for a header, compiled on first use"""
+    key = tuple(fieldnames)
+    with compiled_headers_lock:
+        plan = compiled_headers.get(key)
+        if plan is None:
+            plan = compiled_headers[key] = compile_header(fieldnames)
+    return plan
+
+
+def build_search_query(line: OrderedDict, collected_errormessages: list, defer_georef=False):
+    """Create the query for a CSV line, returns (isq, entry_id, address_filters).
+
+    With defer_georef the addresses are not georeferenced, their filters are returned in address_filters instead.
+    """
+    entry_id: str = 'NONE'
+    address_filters = []
+
+    # Each Input-Line is a Query. Instanciate accordingly
+    isq = api_basic.immobrain_search_query()
+
+    # Add the Columns from CSV, as resolved once for the header.
+    # Columns are quite likely to contain filter-variables.
+    # If a value does not fit its filter complain but continue.
+    for planned in header_plan(line.keys()):
+        value = (line[planned.column] or '').strip()
+        if planned.kind == ID_COLUMN:
+            entry_id = value
+            continue
+        try:
+            if defer_georef and planned.kind == ADDRESS_COLUMN:
+                if value != '':
+                    address_filter = isq.filter_for(planned.step)
+                    address_filter.adresse = value
+                    address_filters.append(address_filter)
+                continue
+            isq.apply_column(planned.step, value)
+        except Exception as e:
+            collected_errormessages.append(e)
+
+            if planned.kind == ADDRESS_COLUMN:
+                continue
+
+            logging.warning(f"{entry_id}: Could not add column {planned.column}")
+            logging.warning(f"{entry_id}: {str(e)}")
+
+    return isq, entry_id, address_filters
+
+
+def build_output_row(line: OrderedDict, isq: api_basic.immobrain_search_query):
+    query_pretty = ''
+    try:
+        with profiling.phase('json encode'):
+            query_pretty = json.dumps(isq.to_query(), indent=4, sort_keys=True)
+    except Exception:
+        # If an error prevents a query from coming into play ( e.g. missing adress )
+        # skip
+        pass
+    # Pythonic "merge dicts"
+
+    # Output-Row should contain "old"-Value and whatever is new.
+    output_row = OrderedDict()
+    output_row.update(line)
+    output_row.update({'distance_used': isq.get_distance_used(),
+                       'precision': isq.get_precision(),
+                       'query': query_pretty})
+    output_row.update(isq.data)
+    output_row['QUERY-ID'] = isq.id
+
+    logging.debug(output_row)
+    return output_row
+
+
+def order_values(values_to_add):
+    """'count' first, so that the other values can be skipped if the query has no results"""
+    values = list(values_to_add)
+    if 'count' in values:
+        values.remove('count')
+        values.insert(0, 'count')
+    return values
+
+
+def skip_remaining_values(isq, entry_id, value):
+    # Wenn schon COUNT=0 rauskam, dann nichts weiter probieren...
+    if "count" in isq.data and isq.data['count'] <= 0:
+        logging.debug(f"count is 0, überspring {value} für Eintrag {entry_id}")
+        return True
+    return False
+
+
+def log_line_done(line, isq, collected_errormessages):
+    # Regardless of logging, this is expected output:
+    logging.debug(" %s, %s => %s %s " % (line['ID'], line['Adresse'], isq.id,
+                  'OK' if not collected_errormessages else '/'.join(map(str, collected_errormessages))))
+
+
+def error_class(collected_errormessages):
+    """Class name of the first error of a line, None if there was none"""
+    return type(collected_errormessages[0]).__name__ if collected_errormessages else None
+
+
+def handle_line_exception(e):
+    if str(e) == str("User must be in the role rest"):
+        logging.critical("Check your API user: must be in the role 'rest'")
+        sys.exit()
+
+    logging.exception("Unexpected Exception", e)
+    return ExecutionResult('', 0, False, error=type(e).__name__)
@@ -8,133 +8,144 @@
 import argparse
 import configparser
 import csv
-import datetime
-import json
 import logging
 import math
 import os
-import random
 import sys
+import threading
 import time
-from collections import OrderedDict
-from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from os.path import expanduser
 
-from analystApi import api_basic, psql_writer
-from analystApi.api_basic import call_with_retries, MAX_RETRY_COUNT, MAX_RETRY_TIME, RETRY_DELAY
-from analystApi.locking_dictwriter import LockingDictWriter
-from analystApi.utils import RepeatingTimer
+from analystApi import api_basic, async_engine, profiling, psql_writer
+from analystApi.api_basic import call_with_retries
+from analystApi.cache import SqliteCache, ResultCache
+from analystApi.circuit_breaker import CircuitBreaker, DEFAULT_FAILURE_THRESHOLD, DEFAULT_OPEN_SECONDS, \
+    DEFAULT_MAX_OPEN_SECONDS
+from analystApi.concurrency import AdaptiveConcurrencyLimit
+from analystApi.csv_line import ExecutionResult, build_search_query, build_output_row, order_values, \
+    skip_remaining_values, log_line_done, handle_line_exception, error_class
+from analystApi.batching_dictwriter import BatchingDictWriter, MultiWriter, DEFAULT_FLUSH_INTERVAL, DEFAULT_FLUSH_ROWS
+from analystApi.parquet_writer import ParquetWriter, DEFAULT_ROW_GROUP_ROWS
+from analystApi.postgres_writer import PostgresWriter
+from analystApi.maintenance import MaintenanceSchedule, DEFAULT_MAINTENANCE_WINDOWS, DEFAULT_DRAIN_SECONDS
+from analystApi.metrics import Metrics, MetricsExport, DEFAULT_METRICS_INTERVAL
+from analystApi.progress import Progress, ProgressReport, DEFAULT_PROGRESS_INTERVAL, describe
+from analystApi.sharding import shard_of, shard_output_file, find_id_column, run_local_shards, merge_shards
+from analystApi.rate_limit import RateLimiter, BUDGETS, DEFAULT_BURST_SECONDS
+from analystApi.retry import RetryPolicy, RetryBudget, DEFAULT_MAX_ATTEMPTS, DEFAULT_MAX_ELAPSED, DEFAULT_DELAYS
+from analystApi.utils import RepeatingTimer, reservoir_sample
 
-brokenColumns = []
 DEFAULT_CLIENT_WORKERS = 4
-
-progress_num_total: int = 0
-progress_num_success: int = 0
-progress_num_fail: int = 0
-
-
-class ExecutionResult:
-    def __init__(self, object_id: str, query_id: int, successful: bool):
-        self.object_id = object_id
-        self.query_id = query_id
-        self.successful = successful
+DEFAULT_MAX_CLIENT_WORKERS = 39
+DEFAULT_CACHE_DIR = '.analystApi'
+DEFAULT_CHECKPOINT_INTERVAL = 5.0     # seconds
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+DEFAULT_GEOREF_CACHE_TTL_DAYS = 90
+DEFAULT_GEOREF_CACHE_MAX_ENTRIES = 1000000
+DEFAULT_QUERY_REGISTRY_TTL_DAYS = 30
+DEFAULT_QUERY_REGISTRY_MAX_ENTRIES = 1000000
+DEFAULT_RESULT_CACHE_TTL_DAYS = 7
+DEFAULT_RESULT_CACHE_MAX_ENTRIES = 5000000
+DEFAULT_VARS_CACHE_TTL_DAYS = 365        # also used offline or if the API is down, until then
+DEFAULT_VARS_CACHE_MAX_ENTRIES = 100
+DEFAULT_ROW_FANOUT = 4
+DEFAULT_PARQUET_FLUSH_INTERVAL = 60.0   # seconds, at most one row group per interval
+
+# Values of a line collected at the same time, by fanout_executor (None: one after another)
+row_fanout: int = DEFAULT_ROW_FANOUT
+fanout_executor = None
 
 
 def execute_query_per_csv_line(args):
-    if datetime.time.hour == 23 and datetime.time.min >= 50:
-        # Pause um Mittnernacht da die Analyst neustarten
-        time.sleep(60 * 15)
-
+    start = time.monotonic()
     try:
         line: OrderedDict = args[0]
         values_to_add: OrderedDict = args[1]
-        csv_writer: LockingDictWriter = args[2]
+        csv_writer: BatchingDictWriter = args[2]
 
         collected_errormessages = []
-        entry_id: str = 'NONE'
-
-        # Each Input-Line is a Query. Instanciate accordingly
-        isq = api_basic.immobrain_search_query()
-
-        # Add the Columns from CSV.
-        # Columns are quite likely to contain filter-variables.
-        # Add all variables as filters.
-        # If a column doesnt look like a valid filter complain but continue.
-        for column_name in line.copy():
-            if column_name in brokenColumns:
-                continue
-
-            if column_name.lower() == 'id':
-                entry_id = line[column_name].strip()
-
-            if column_name.lower() in ['id', 'kommentar', 'comment']:
-                # Let's not complain about comments and ID being invalid filters.
-                continue
-            try:
-                isq.add_column(column_name, line[column_name].strip())
-            except Exception as e:
-                collected_errormessages.append(str(e))
-
-                if column_name.lower() in ['adresse', 'adresse']:
-                    continue
-
-                brokenColumns.append(column_name)
-                logging.warning(f"{entry_id}: Could not add column {column_name}")
-                logging.warning(f"{entry_id}: {str(e)}")
+        with profiling.phase('build query'):
+            (isq, entry_id, _) = build_search_query(line, collected_errormessages)
 
         # Execute Querys and collect values as required.
-        for value in values_to_add:
-            try:
-                # Wenn schon COUNT=0 rauskam, dann nichts weiter probieren...
-                if "count" in isq.data and isq.data['count'] <= 0:
-                    logging.debug(f"count is 0, überspring {value} für Eintrag {entry_id}")
-                    continue
-
-                call_with_retries(MAX_RETRY_COUNT, MAX_RETRY_TIME, RETRY_DELAY, isq.collect, value)
-            except Exception as e:
-                logging.warning(f"{entry_id}: {str(e)}")
-                collected_errormessages.append(str(e))
+        collect_values(isq, entry_id, values_to_add, collected_errormessages)
+        pull_missing_details(isq, entry_id)
 
-                # There is little reason to continue. It _might_ yield results
-                # but realistically speaking a retry will happen anyway.
-                # Die quickly so we don't bloat with errors
-                break
+        csv_writer.writerow(build_output_row(line, isq))
+        log_line_done(line, isq, collected_errormessages)
 
-        query_pretty = ''
-        try:
-            query_pretty = json.dumps(isq.to_query(), indent=4, sort_keys=True)
-        except Exception:
-            # If an error prevents a query from coming into play ( e.g. missing adress )
-            # skip
-            pass
-        # Pythonic "merge dicts"
-
-        # Output-Row should contain "old"-Value and whatever is new.
-        output_row = OrderedDict()
-        output_row.update(line)
-        output_row.update({'distance_used': isq.get_distance_used(),
-                           'precision': isq.get_precision(),
-                           'query': query_pretty})
-        output_row.update(isq.data)
-        output_row['QUERY-ID'] = isq.id
-
-        logging.debug(output_row)
-        csv_writer.writerow(output_row)
-
-        # Regardless of logging, this is expected output:
-        logging.debug(" %s, %s => %s %s " % (line['ID'], line['Adresse'], isq.id,
-                      'OK' if not collected_errormessages else '/'.join(collected_errormessages)))
-
-        return ExecutionResult(entry_id, isq.id, not collected_errormessages)
+        return ExecutionResult(entry_id, isq.id, not collected_errormessages, time.monotonic() - start,
+                               error_class(collected_errormessages))
 
     except Exception as e:
+        return handle_line_exception(e)
 
-        if str(e) == str("User must be in the role rest"):
-            logging.critical("Check your API user: must be in the role 'rest'")
-            sys.exit()
 
-        logging.exception("Unexpected Exception", e)
-        return ExecutionResult('', 0, False)
+def collect_values(isq, entry_id, values_to_add, collected_errormessages):
+    """Collect the first value (which creates the query), then up to row_fanout of the others at the same time"""
+    values = order_values(values_to_add)
+    serial = values if fanout_executor is None else values[:1]
+    for value in serial:
+        if skip_remaining_values(isq, entry_id, value):
+            return
+        try:
+            call_with_retries(isq.collect, value)
+        except Exception as e:
+            logging.warning(f"{entry_id}: {str(e)}")
+            collected_errormessages.append(e)
+
+            # There is little reason to continue. It _might_ yield results
+            # but realistically speaking a retry will happen anyway.
+            # Die quickly so we don't bloat with errors
+            return
+
+    remaining = values[len(serial):]
+    if not remaining or skip_remaining_values(isq, entry_id, remaining[0]):
+        return
+    # Lazy details are pulled while the values are collected
+    details = fanout_executor.submit(pull_missing_details, isq, entry_id) if isq.details_missing() else None
+    try:
+        fan_out(isq, entry_id, remaining, collected_errormessages)
+    finally:
+        if details is not None:
+            wait([details])
+
+
+def fan_out(isq, entry_id, values, collected_errormessages):
+    remaining = iter(values)
+    pending = set()
+    failed = False
+    while True:
+        while not failed and len(pending) < row_fanout:
+            value = next(remaining, None)
+            if value is None:
+                break
+            pending.add(fanout_executor.submit(call_with_retries, isq.collect, value))
+        if not pending:
+            return
+        (done, pending) = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if not future.cancelled() and future.exception() is not None and not failed:
+                failed = True
+                logging.warning(f"{entry_id}: {str(future.exception())}")
+                collected_errormessages.append(future.exception())
+        if failed:
+            # Die quickly, but the values already being collected still end up in isq.data
+            for future in pending:
+                future.cancel()
+
+
+def pull_missing_details(isq, entry_id):
+    """Pull the details if details_mode is lazy and they are not known yet. They only fill distance_used, so failing
+    to get them is no error of the line."""
+    if not isq.details_missing():
+        return
+    try:
+        call_with_retries(isq.pull_details_for_query)
+    except Exception as e:
+        logging.warning(f"{entry_id}: Could not pull details of query {isq.id}: {str(e)}")
 
 
 def main():
@@ -151,6 +162,56 @@ def main():
         '--testonepercent',
         help='Test one percent of the entrys only. Helps validating the job itself.',
         action='store_true')
+    parser.add_argument('--resume', help='Continue an interrupted run, lines with a QUERY-ID in the existing '
+                                         'output are not executed again', action='store_true')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='Split the input by a hash of the ID into this many shards. Without --shard-index '
+                             'all shards are run in processes on this machine and merged afterwards')
+    parser.add_argument('--shard-index', type=int,
+                        help='Only execute this shard (0 to shards - 1), e.g. on one of several hosts')
+    parser.add_argument('--merge', action='store_true',
+                        help='Only merge the outputs of all shards into one output in input order')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads',
+                        help='Send the requests from a thread pool (default) or from asyncio (requires aiohttp)')
+    parser.add_argument('--postgres', metavar='DSN',
+                        help='Also write the output to PostgreSQL, e.g. "dbname=analyst" (requires psycopg2)')
+    parser.add_argument('--parquet', action='store_true',
+                        help='Also write the output to a Parquet file with typed columns (requires pyarrow)')
+    parser.add_argument('--details', choices=api_basic.DETAILS_MODES,
+                        help='When to pull the query details for distance_used: right after creating the query '
+                             '(eager), while collecting the values (lazy, default) or never (skip)')
+    parser.add_argument('--metrics-file',
+                        help='Write latencies, status codes, retries and bytes per endpoint to this file in the '
+                             'Prometheus text format while the run is progressing')
+    parser.add_argument('--metrics-port', type=int,
+                        help='Serve the metrics at http://localhost:<port>/metrics while the run is progressing')
+    parser.add_argument('--progress-file',
+                        help='Append the progress as JSON line to this file every progress_interval seconds')
+    parser.add_argument('--progress-port', type=int,
+                        help='Answer every connection to localhost:<port> with the latest progress as JSON line')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time the phases of the lines and sample the stacks of all threads, writes '
+                             '<output>_profile.folded for flame graphs and a summary table at the end')
+    parser.add_argument('--no-georef-cache', help='Do not use the georef cache, always ask the API',
+                        action='store_true')
+    parser.add_argument('--purge-georef-cache', help='Remove all entries from the georef cache before starting',
+                        action='store_true')
+    parser.add_argument('--no-query-registry', help='Always create new queries instead of reusing known Query-IDs',
+                        action='store_true')
+    parser.add_argument('--purge-query-registry', help='Forget all known Query-IDs before starting',
+                        action='store_true')
+    parser.add_argument('--no-result-cache', help='Always fetch results from the API', action='store_true')
+    parser.add_argument('--purge-result-cache', help='Remove all cached results before starting',
+                        action='store_true')
+    parser.add_argument('--data-vintage', help='Data vintage of the results, if the API does not report it. '
+                                               'Without a vintage results are not cached')
+    parser.add_argument('--no-vars-cache', help='Always load the variable documentation from the API',
+                        action='store_true')
+    parser.add_argument('--purge-vars-cache', help='Remove the cached variable documentation before starting',
+                        action='store_true')
+    parser.add_argument('--offline', action='store_true',
+                        help='Do not contact the API, only write the .psql script using the cached variable '
+                             'documentation')
     args = parser.parse_args()
 
     home = expanduser("~")
@@ -169,6 +230,15 @@ def main():
                         level=target_loglevel)
 
     logging.info("Starting.. ")
+
+    if args.shard_index is not None and not 0 <= args.shard_index < args.shards:
+        parser.error('--shard-index must be between 0 and --shards - 1')
+    if args.shards > 1 and args.shard_index is None:
+        output_csv_file = os.path.splitext(args.csvfile)[0] + '_executed.csv'
+        if not args.merge:
+            run_local_shards(args.shards, sys.argv[1:])
+        merge_shards(args.csvfile, output_csv_file, args.shards)
+        return
     # Load our configuation-file. Complain and exit if this fails.
     try:
         config = configparser.ConfigParser()
@@ -208,15 +278,9 @@ An empty template has been created.
 
         raise e
 
-    # Push credentials and endpoints into the api_basic module.
-    # Refactoring might move there variables into one of the contained classes
-    # but for now it seems more appropriate to provide a 'global' configuration in
-    # the context of a scripts execution.
+    # Credentials and endpoint go to the client of the api_basic module, the poolsize follows below
     global_config = config['global']
-    api_basic.username = global_config.get('username')
-    api_basic.password = global_config.get('password')
     csv_file = args.csvfile
-    api_basic.endpoint = global_config.get('endpoint')
     client_workers = global_config.getint('client_workers', fallback=DEFAULT_CLIENT_WORKERS)
 
     if client_workers > 39:
@@ -224,16 +288,97 @@ An empty template has been created.
     if client_workers > 1:
         logging.info("Using %s clients..." % client_workers)
 
-    api_basic.poolsize = client_workers
-    logging.info(f"Set poolsize to {api_basic.poolsize}")
-
-    logging.info("Using API at " + api_basic.endpoint)
+    # With adaptive concurrency, client_workers is only the initial limit for requests in flight
+    max_client_workers = client_workers
+    if global_config.getboolean('adaptive_concurrency', fallback=False):
+        max_client_workers = global_config.getint('max_client_workers', fallback=DEFAULT_MAX_CLIENT_WORKERS)
+        if args.engine == 'asyncio':
+            max_client_workers = global_config.getint('async_max_in_flight',
+                                                      fallback=async_engine.DEFAULT_MAX_IN_FLIGHT)
+        api_basic.concurrency_limit = AdaptiveConcurrencyLimit(client_workers, maximum=max_client_workers)
+        logging.info(f"Adaptive concurrency between 1 and {max_client_workers} requests")
+
+    api_basic.client.configure(endpoint=global_config.get('endpoint'),
+                               username=global_config.get('username'),
+                               password=global_config.get('password'),
+                               poolsize=max_client_workers)
+
+    # Requests per second for each budget, unlimited if not set. Retry-After is honoured anyway.
+    api_basic.rate_limiter = RateLimiter(
+        {budget: global_config.getfloat(f'rate_limit_{budget}', fallback=0) for budget in set(BUDGETS.values())},
+        burst_seconds=global_config.getfloat('rate_limit_burst_seconds', fallback=DEFAULT_BURST_SECONDS))
+
+    # Retries per call, per run (0 = unlimited) and the delays per kind of error, see analystApi.retry
+    retry_budget = global_config.getint('retry_budget', fallback=0)
+    api_basic.retry_policy = RetryPolicy(
+        max_attempts=global_config.getint('retry_max_attempts', fallback=DEFAULT_MAX_ATTEMPTS),
+        max_elapsed=global_config.getfloat('retry_max_seconds', fallback=DEFAULT_MAX_ELAPSED),
+        delays={kind: (global_config.getfloat(f'retry_{kind}_base_delay', fallback=base),
+                       global_config.getfloat(f'retry_{kind}_max_delay', fallback=cap))
+                for (kind, (base, cap)) in DEFAULT_DELAYS.items()},
+        budget=RetryBudget(retry_budget) if retry_budget > 0 else None)
+
+    # Pause everything while the API is down, and around its nightly restart
+    api_basic.circuit_breaker = CircuitBreaker(
+        failure_threshold=global_config.getint('circuit_breaker_failures', fallback=DEFAULT_FAILURE_THRESHOLD),
+        open_seconds=global_config.getfloat('circuit_breaker_open_seconds', fallback=DEFAULT_OPEN_SECONDS),
+        max_open_seconds=global_config.getfloat('circuit_breaker_max_open_seconds',
+                                                fallback=DEFAULT_MAX_OPEN_SECONDS))
+    maintenance_windows = global_config.get('maintenance_windows', fallback=DEFAULT_MAINTENANCE_WINDOWS)
+    api_basic.maintenance = MaintenanceSchedule(maintenance_windows) if maintenance_windows.strip() else None
+    drain_seconds = global_config.getfloat('maintenance_drain_seconds', fallback=DEFAULT_DRAIN_SECONDS)
+
+    global row_fanout
+    row_fanout = max(1, global_config.getint('row_fanout', fallback=DEFAULT_ROW_FANOUT))
+
+    api_basic.details_mode = args.details or global_config.get('details_mode', fallback=api_basic.DETAILS_LAZY)
+    if api_basic.details_mode not in api_basic.DETAILS_MODES:
+        raise Exception(f"Invalid details_mode {api_basic.details_mode}, "
+                        f"use one of {', '.join(api_basic.DETAILS_MODES)}")
+    logging.info(f"Query details mode: {api_basic.details_mode}")
+    logging.info(f"Set poolsize to {api_basic.client.poolsize}")
+
+    logging.info("Using API at " + api_basic.client.endpoint)
+
+    # Metrics of the requests, shards write files of their own and serve on the following ports
+    metrics_file = args.metrics_file or global_config.get('metrics_file', fallback=None)
+    metrics_port = args.metrics_port or global_config.getint('metrics_port', fallback=None)
+    if args.shard_index is not None:
+        if metrics_file:
+            metrics_file = shard_output_file(metrics_file, args.shard_index, args.shards)
+        if metrics_port:
+            metrics_port += args.shard_index
+    if metrics_file or metrics_port is not None:
+        api_basic.metrics = Metrics()
+    metrics_export = MetricsExport(api_basic.metrics, metrics_file, metrics_port,
+                                   global_config.getfloat('metrics_interval', fallback=DEFAULT_METRICS_INTERVAL))
 
     api_basic.include_unknown_default = False
     if global_config.get('include_unknown'):
         logging.info("Default_Value for Unknown-Values Set")
         api_basic.include_unknown_default = global_config.getboolean('include_unknown')
 
+    cache_dir = global_config.get('cache_dir', fallback=os.path.join(home, DEFAULT_CACHE_DIR))
+    api_basic.georef_cache = open_cache(global_config, 'georef_cache', os.path.join(cache_dir, 'georef.sqlite'),
+                                        'georef', DEFAULT_GEOREF_CACHE_TTL_DAYS, DEFAULT_GEOREF_CACHE_MAX_ENTRIES,
+                                        args.no_georef_cache, args.purge_georef_cache)
+    api_basic.query_registry = open_cache(global_config, 'query_registry', os.path.join(cache_dir, 'queries.sqlite'),
+                                          'queries', DEFAULT_QUERY_REGISTRY_TTL_DAYS,
+                                          DEFAULT_QUERY_REGISTRY_MAX_ENTRIES,
+                                          args.no_query_registry, args.purge_query_registry)
+    api_basic.result_cache = open_cache(global_config, 'result_cache', os.path.join(cache_dir, 'results.sqlite'),
+                                        'results', DEFAULT_RESULT_CACHE_TTL_DAYS, DEFAULT_RESULT_CACHE_MAX_ENTRIES,
+                                        args.no_result_cache, args.purge_result_cache, cache_class=ResultCache)
+    api_basic.data_vintage = args.data_vintage or global_config.get('data_vintage', fallback=None)
+    api_basic.vars_cache = open_cache(global_config, 'vars_cache', os.path.join(cache_dir, 'vars.sqlite'),
+                                      'vars', DEFAULT_VARS_CACHE_TTL_DAYS, DEFAULT_VARS_CACHE_MAX_ENTRIES,
+                                      args.no_vars_cache, args.purge_vars_cache)
+    api_basic.vars_max_age = global_config.getfloat('vars_cache_max_age_hours',
+                                                    fallback=api_basic.DEFAULT_VARS_MAX_AGE / 3600) * 3600
+    api_basic.offline = args.offline
+    if args.offline and api_basic.vars_cache is None:
+        parser.error('--offline requires the variable documentation cache')
+
     values_to_add = config.get('global', 'values_to_add').split(' ')
 
     if "count" not in values_to_add:
@@ -252,54 +397,295 @@ An empty template has been created.
         output_csv_file = csv_file_base + '_executed.csv'
 
         psql_writer.write_to_file(output_csv_file, csv_reader.fieldnames, values_to_add)
-
-        csv_writer = LockingDictWriter(
-            open(output_csv_file, 'w'),
+        if args.offline:
+            logging.info("Offline, only the .psql script was written")
+            metrics_export.close()
+            close_caches()
+            return
+
+        id_column = next((name for name in csv_reader.fieldnames if name.lower() == 'id'), None)
+        if args.shard_index is not None:
+            id_column = find_id_column(csv_reader.fieldnames)
+            output_csv_file = shard_output_file(output_csv_file, args.shard_index, args.shards)
+            logging.info(f"Executing shard {args.shard_index} of {args.shards} into {output_csv_file}")
+
+        # Types of the output columns for the database and Parquet writers
+        column_types = psql_writer.column_types(csv_reader.fieldnames, values_to_add)
+
+        # Stream the rows into PostgreSQL as well, connect before touching the output
+        postgres_writer = None
+        postgres_dsn = args.postgres or global_config.get('postgres_dsn', fallback=None)
+        if postgres_dsn:
+            postgres_writer = PostgresWriter(
+                postgres_dsn,
+                global_config.get('postgres_table', fallback=os.path.basename(csv_file_base) + '_executed'),
+                column_types,
+                fieldnames_out,
+                flush_interval=global_config.getfloat('writer_flush_interval', fallback=DEFAULT_FLUSH_INTERVAL),
+                flush_rows=global_config.getint('writer_flush_rows', fallback=DEFAULT_FLUSH_ROWS))
+
+        completed_lines = Counter()
+        resuming = args.resume and os.path.exists(output_csv_file)
+        if resuming:
+            completed_lines = load_completed_lines(output_csv_file, fieldnames_out, csv_reader.fieldnames)
+            output_file = open(output_csv_file, 'a', buffering=OUTPUT_BUFFER_SIZE)
+        else:
+            output_file = open(output_csv_file, 'w', buffering=OUTPUT_BUFFER_SIZE)
+        # Rows are formatted and written in batches by a writer thread of their own
+        csv_writer = BatchingDictWriter(
+            output_file,
             delimiter=',',
-            fieldnames=fieldnames_out)
-        csv_writer.writeheader()
-
-        # Fetch all lines early. CSVs in here should not span many megabytes
-        # and it helps us detect parsing-errors early.
-        csv_entrys = [line for line in csv_reader]
+            fieldnames=fieldnames_out,
+            flush_interval=global_config.getfloat('writer_flush_interval', fallback=DEFAULT_FLUSH_INTERVAL),
+            flush_rows=global_config.getint('writer_flush_rows', fallback=DEFAULT_FLUSH_ROWS))
+        writers = [csv_writer]
+        if postgres_writer is not None:
+            writers.append(postgres_writer)
+
+        # Typed columns for analytics, next to the CSV
+        if args.parquet or global_config.getboolean('parquet_output', fallback=False):
+            parquet_writer = ParquetWriter(
+                os.path.splitext(output_csv_file)[0] + '.parquet',
+                column_types,
+                fieldnames_out,
+                flush_interval=global_config.getfloat('parquet_flush_interval',
+                                                      fallback=DEFAULT_PARQUET_FLUSH_INTERVAL),
+                flush_rows=global_config.getint('parquet_row_group_rows', fallback=DEFAULT_ROW_GROUP_ROWS))
+            if resuming:
+                # Parquet files cannot be appended to, the new file starts with the lines kept in the CSV
+                with open(output_csv_file, newline='') as existing:
+                    parquet_writer.writerows(csv.DictReader(existing, delimiter=','))
+            writers.append(parquet_writer)
+
+        if len(writers) > 1:
+            csv_writer = MultiWriter(writers)
+
+        if not resuming:
+            csv_writer.writeheader()
+
+        # Lines are read lazily, only a bounded number of them is in flight at any time.
+        # The total is counted in a separate pass for the progress output.
+        selected = select_lines(id_column, csv_reader.fieldnames, completed_lines, args.shard_index, args.shards)
+        csv_entrys = csv_reader if selected is None else filter(selected, csv_reader)
+        num_lines = count_csv_lines(csv_file, select_lines(id_column, csv_reader.fieldnames, completed_lines,
+                                                           args.shard_index, args.shards))
 
         # In test-mode - reduce list to one percent of itself.
         # Rounding should be ceil'd, otherwise we might just pull nothing.
         if args.testonepercent:
-            csv_entrys = random.sample(
-                csv_entrys, math.ceil(len(csv_entrys) * 0.01))
-
-        global progress_num_total
-        global progress_num_success
-        global progress_num_fail
-        progress_num_total = len(csv_entrys)
-
-        t = RepeatingTimer(60.0, print_progress, daemon=True)
-        t.start()
-
-        with ThreadPoolExecutor(max_workers=client_workers) as executor:
-            tasks = [(line, values_to_add, csv_writer) for line in csv_entrys]
-            executor_map = executor.map(execute_query_per_csv_line, tasks)
-            for item in executor_map:
-                if item.successful:
-                    progress_num_success += 1
-                else:
-                    progress_num_fail += 1
-                # print(f'{num_fail + num_success}/{num_total} - success: {num_success}, failed: {num_fail}')
-                # print(f'{item.query_id}, {item.object_id}, {item.successful}')
+            csv_entrys = reservoir_sample(csv_entrys, math.ceil(num_lines * 0.01))
+            num_lines = len(csv_entrys)
+
+        if args.profile:
+            profiling.profile = profiling.Profile(
+                global_config.getfloat('profile_interval', fallback=profiling.DEFAULT_PROFILE_INTERVAL)).start()
+            csv_entrys = profiling.timed(csv_entrys, 'csv parse')
+
+        # Flush the output to disk regularly, a crash loses only the lines since the last checkpoint
+        checkpoint_timer = RepeatingTimer(global_config.getfloat('checkpoint_interval',
+                                                                 fallback=DEFAULT_CHECKPOINT_INTERVAL),
+                                          csv_writer.checkpoint, daemon=True)
+        checkpoint_timer.start()
+
+        # Progress in the log every minute, and as JSON lines for schedulers
+        progress_file = args.progress_file or global_config.get('progress_file', fallback=None)
+        progress_port = args.progress_port or global_config.getint('progress_port', fallback=None)
+        if args.shard_index is not None:
+            if progress_file:
+                progress_file = shard_output_file(progress_file, args.shard_index, args.shards)
+            if progress_port:
+                progress_port += args.shard_index
+        api_basic.progress = Progress(num_lines, api_basic.concurrency_limit)
+        progress_report = ProgressReport(api_basic.progress, progress_file, progress_port,
+                                         global_config.getfloat('progress_interval',
+                                                                fallback=DEFAULT_PROGRESS_INTERVAL),
+                                         log=print_progress)
+
+        if args.engine == 'asyncio':
+            async_engine.run(csv_entrys, values_to_add, csv_writer,
+                             global_config.getint('async_max_in_flight',
+                                                  fallback=async_engine.DEFAULT_MAX_IN_FLIGHT),
+                             count_result, drain_seconds, row_fanout)
+        else:
+            max_pending_lines = global_config.getint('max_pending_lines', fallback=max_client_workers * 4)
+            # The values of a line are collected by a pool of their own, the line workers wait for them.
+            # The HTTP pool (poolsize) still bounds the requests of all lines together.
+            global fanout_executor
+            if row_fanout > 1 and len(values_to_add) > 1:
+                fanout_executor = ThreadPoolExecutor(max_workers=max_client_workers * row_fanout,
+                                                     thread_name_prefix='fanout')
+            try:
+                with ThreadPoolExecutor(max_workers=max_client_workers) as executor:
+                    execute_streaming(executor, csv_entrys, values_to_add, csv_writer, max_pending_lines,
+                                      drain_seconds)
+            finally:
+                if fanout_executor is not None:
+                    fanout_executor.shutdown(cancel_futures=True)
+                    fanout_executor = None
 
         # actually collect things
-        t.cancel()
-        t.call_function()
-        executor.shutdown(wait=True)
+        progress_report.close()
+        checkpoint_timer.cancel()
+        csv_writer.close()
+        output_file.close()
+
+        if profiling.profile is not None:
+            write_profile(profiling.profile, os.path.splitext(output_csv_file)[0] + '_profile')
+            profiling.profile = None
+
+    metrics_export.close()
+    close_caches()
 
     logging.info("Done")
     logging.info('Script completed, see output/log for any errors')
 
 
-def print_progress():
-    logging.info(f'Processed {progress_num_fail + progress_num_success} of {progress_num_total} entries '
-                 f'- success: {progress_num_success}, failed: {progress_num_fail}')
+def write_profile(profile, file_base):
+    profile.stop()
+    profile.write_folded(file_base + '.folded')
+    summary = profile.summary()
+    with open(file_base + '.txt', 'w') as f:
+        f.write(summary + '\n')
+    logging.info(f"Profile written to {file_base}.folded and {file_base}.txt\n{summary}")
+
+
+def close_caches():
+    for cache in (api_basic.georef_cache, api_basic.query_registry, api_basic.result_cache, api_basic.vars_cache):
+        if cache is not None:
+            cache.close()
+
+
+def open_cache(global_config, name, default_file, table, default_ttl_days, default_max_entries, bypass, purge,
+               cache_class=SqliteCache):
+    """Open the cache configured by '<name>_file', '<name>_ttl_days' and '<name>_max_entries',
+    returns None if it is bypassed"""
+    if bypass and not purge:
+        return None
+    cache = cache_class(global_config.get(f'{name}_file', fallback=default_file),
+                        table=table,
+                        ttl=global_config.getfloat(f'{name}_ttl_days', fallback=default_ttl_days) * 86400,
+                        max_entries=global_config.getint(f'{name}_max_entries', fallback=default_max_entries))
+    if purge:
+        cache.purge()
+    if bypass:
+        cache.close()
+        return None
+    return cache
+
+
+def execute_streaming(executor, csv_entrys, values_to_add, csv_writer, max_pending_lines, drain_seconds=0.0):
+    """Submit the lines to the executor as they are read, blocking while max_pending_lines are not done yet"""
+    pending = threading.BoundedSemaphore(max_pending_lines)
+    errors = []
+
+    def done(future):
+        # Released last, the main thread checks the errors after acquiring
+        try:
+            if future.exception() is not None:
+                # e.g. SystemExit, raised in the main thread below
+                errors.append(future.exception())
+            else:
+                count_result(future.result())
+        finally:
+            pending.release()
+
+    for line in csv_entrys:
+        # No new lines shortly before and within a maintenance window
+        if api_basic.maintenance is not None:
+            api_basic.maintenance.hold(lead=drain_seconds)
+        pending.acquire()
+        if errors:
+            raise errors[0]
+        executor.submit(execute_query_per_csv_line, (line, values_to_add, csv_writer)).add_done_callback(done)
+
+    # Wait for the last lines
+    for _ in range(max_pending_lines):
+        pending.acquire()
+    if errors:
+        raise errors[0]
+
+
+def select_lines(id_column, fieldnames, completed_lines, shard_index=None, shards=1):
+    """Returns whether to execute a line as function, None to execute all lines.
+
+    A line is skipped as often as it is among the completed_lines (see load_completed_lines), so of several lines
+    with the same ID only the ones not completed yet are executed. The function counts the lines it skipped, use a
+    new one for every pass over the input.
+    """
+    if not completed_lines and shard_index is None:
+        return None
+    remaining = Counter(completed_lines)
+
+    def selected(line):
+        if shard_index is not None and shard_of(line[id_column], shards) != shard_index:
+            return False
+        key = line_key(line, fieldnames)
+        if remaining[key] > 0:
+            remaining[key] -= 1
+            return False
+        return True
+    return selected
+
+
+def line_key(line, fieldnames):
+    """The values of the input columns, as written to the output (missing values are empty)"""
+    return tuple('' if line.get(name) is None else line[name] for name in fieldnames)
+
+
+def count_csv_lines(csv_file, selected=None):
+    with open(csv_file) as filehandle:
+        return sum(1 for line in csv.DictReader(filehandle, delimiter=',') if selected is None or selected(line))
+
+
+def load_completed_lines(output_csv_file, fieldnames_out, fieldnames):
+    """Returns how often each input line (by the values of the input columns `fieldnames`) has a QUERY-ID in an
+    existing output file. Lines are matched by all their values, not only the ID, as IDs may be repeated.
+
+    All other lines, including a line cut off by a crash, are removed from the file so they can be appended again.
+    """
+    with open(output_csv_file, 'rb') as existing:
+        existing.seek(0, os.SEEK_END)
+        if existing.tell() > 0:
+            existing.seek(-1, os.SEEK_END)
+        # Every row ends with a line break, without one the last row was cut off, possibly within its last field
+        truncated = existing.read(1) not in (b'', b'\n')
+    completed_lines = Counter()
+    temp_file = output_csv_file + '.resume'
+    with open(output_csv_file, newline='') as existing:
+        csv_reader = csv.DictReader(existing, delimiter=',')
+        if csv_reader.fieldnames != fieldnames_out:
+            raise Exception(f'Cannot resume, the columns of {output_csv_file} do not match the input and values_to_add')
+        with open(temp_file, 'w') as kept:
+            csv_writer = csv.DictWriter(kept, delimiter=',', fieldnames=fieldnames_out)
+            csv_writer.writeheader()
+            lines = all_but_last(csv_reader) if truncated else csv_reader
+            for line in lines:
+                # Missing fields are None, surplus fields are stored under the key None
+                if None in line or None in line.values() or not line['QUERY-ID']:
+                    continue
+                completed_lines[line_key(line, fieldnames)] += 1
+                csv_writer.writerow(line)
+            kept.flush()
+            os.fsync(kept.fileno())
+    os.replace(temp_file, output_csv_file)
+    logging.info(f"Resuming, {sum(completed_lines.values())} lines already completed in {output_csv_file}")
+    return completed_lines
+
+
+def all_but_last(iterable):
+    iterator = iter(iterable)
+    previous = next(iterator, None)
+    for item in iterator:
+        yield previous
+        previous = item
+
+
+def count_result(item: ExecutionResult):
+    api_basic.progress.line_done(item)
+
+
+def print_progress(snapshot):
+    logging.info(describe(snapshot))
 
 
 def chained(sequences):
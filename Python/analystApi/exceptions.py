@@ -54,3 +54,16 @@ class QuerySegmentNotFoundInLicense(AnalystApiQueryError):
 class QueryLimitReached(AnalystApiQueryError):
     """The yearly limit of submitted queries for the license is reached (Status Code: 429)"""
     pass
+
+
+class AnalystApiServerError(AnalystApiError):
+    """The API failed to answer the request (Status Code: 5xx, or 429 for results)"""
+    pass
+
+
+class AnalystApiThrottled(AnalystApiServerError):
+    """The API asks to send the request again after retry_after seconds (Status Code: 429 with Retry-After)"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
@@ -0,0 +1,63 @@
+import datetime
+import logging
+import time
+
+# The Analyst API restarts around midnight
+DEFAULT_MAINTENANCE_WINDOWS = '23:50-00:05'
+DEFAULT_DRAIN_SECONDS = 60.0
+MAX_SLEEP_SECONDS = 60.0
+
+
+class MaintenanceSchedule:
+    """Daily windows (local time) in which no requests are sent, e.g. '23:50-00:05, 03:00-03:10'.
+
+    Windows may span midnight. hold() blocks until the current window is over, with `lead` seconds the window
+    starts earlier, so new lines are held back while the running ones finish.
+    """
+
+    def __init__(self, windows):
+        self.windows = parse_windows(windows)
+        self.announced_until = 0.0
+
+    def seconds_left(self, now=None, lead=0.0):
+        """Seconds until the window `now` is in ends, 0 if it is not in a window"""
+        now = now or datetime.datetime.now()
+        left = 0.0
+        for (start, end) in self.windows:
+            for days in (-1, 0, 1):
+                day = now.date() + datetime.timedelta(days=days)
+                begin = datetime.datetime.combine(day, start)
+                finish = datetime.datetime.combine(day, end)
+                if finish <= begin:
+                    finish += datetime.timedelta(days=1)
+                if begin - datetime.timedelta(seconds=lead) <= now < finish:
+                    left = max(left, (finish - now).total_seconds())
+        return left
+
+    def hold(self, lead=0.0):
+        left = self.seconds_left(lead=lead)
+        while left > 0:
+            self.announce(left)
+            time.sleep(min(left, MAX_SLEEP_SECONDS))
+            left = self.seconds_left(lead=lead)
+
+    def announce(self, left):
+        """Log a window once, not for every waiting request"""
+        until = time.time() + left
+        if abs(until - self.announced_until) > 1:
+            self.announced_until = until
+            logging.warning(f"Maintenance window of the Analyst API, holding requests for {left:.0f} seconds")
+
+
+def parse_windows(windows):
+    result = []
+    for window in windows.split(','):
+        window = window.strip()
+        if not window:
+            continue
+        try:
+            (start, end) = window.split('-')
+            result.append((datetime.time.fromisoformat(start.strip()), datetime.time.fromisoformat(end.strip())))
+        except ValueError:
+            raise Exception(f'Invalid maintenance window "{window}", expected e.g. "23:50-00:05"')
+    return result
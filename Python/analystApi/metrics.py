@@ -0,0 +1,198 @@
+import bisect
+import logging
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from analystApi.utils import RepeatingTimer
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DEFAULT_METRICS_INTERVAL = 15.0   # seconds between writes of the metrics file
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def cumulative(self):
+        """[(upper bound, count of values <= bound)], the last bound is '+Inf'"""
+        total = 0
+        result = []
+        for (bound, count) in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics:
+    """Counters and latency histograms of the requests per endpoint ('vars', 'georef', 'queries', 'details' and
+    'results'), rendered in the Prometheus text format. Safe to use from all threads and the event loop."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}            # endpoint -> Histogram
+        self.responses = {}          # (endpoint, status) -> count
+        self.errors = {}             # (endpoint, exception class) -> count
+        self.retries = {}            # (function, retry kind) -> count
+        self.wait_seconds = {}       # endpoint -> seconds waited for maintenance and the client side limits
+        self.pool_wait_seconds = {}  # endpoint -> seconds waited for a connection of the HTTP pool
+        self.sent_bytes = {}         # endpoint -> bytes
+        self.received_bytes = {}     # endpoint -> bytes
+
+    def observe_response(self, endpoint, status, seconds, sent_bytes, received_bytes):
+        with self.lock:
+            self._latency(endpoint).observe(seconds)
+            add(self.responses, (endpoint, str(status)), 1)
+            add(self.sent_bytes, endpoint, sent_bytes)
+            add(self.received_bytes, endpoint, received_bytes)
+
+    def observe_error(self, endpoint, error, seconds):
+        with self.lock:
+            self._latency(endpoint).observe(seconds)
+            add(self.errors, (endpoint, type(error).__name__), 1)
+
+    def observe_wait(self, endpoint, seconds):
+        with self.lock:
+            add(self.wait_seconds, endpoint, seconds)
+
+    def observe_pool_wait(self, endpoint, seconds):
+        with self.lock:
+            add(self.pool_wait_seconds, endpoint, seconds)
+
+    def count_retry(self, function, kind):
+        with self.lock:
+            add(self.retries, (function, kind), 1)
+
+    def _latency(self, endpoint):
+        histogram = self.latency.get(endpoint)
+        if histogram is None:
+            histogram = self.latency[endpoint] = Histogram()
+        return histogram
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            lines.append('# HELP analyst_api_request_duration_seconds Duration of the requests to the Analyst API')
+            lines.append('# TYPE analyst_api_request_duration_seconds histogram')
+            for (endpoint, histogram) in sorted(self.latency.items()):
+                for (bound, count) in histogram.cumulative():
+                    lines.append(sample('analyst_api_request_duration_seconds_bucket',
+                                        {'endpoint': endpoint, 'le': bound}, count))
+                lines.append(sample('analyst_api_request_duration_seconds_sum', {'endpoint': endpoint},
+                                    histogram.sum))
+                lines.append(sample('analyst_api_request_duration_seconds_count', {'endpoint': endpoint},
+                                    sum(histogram.counts)))
+            counter(lines, 'analyst_api_responses_total', 'Responses by status code', self.responses,
+                    ('endpoint', 'status'))
+            counter(lines, 'analyst_api_request_errors_total', 'Requests that failed without a response',
+                    self.errors, ('endpoint', 'error'))
+            counter(lines, 'analyst_api_retries_total', 'Retried calls by retry kind', self.retries,
+                    ('function', 'kind'))
+            counter(lines, 'analyst_api_wait_seconds_total',
+                    'Time waited for maintenance windows, rate limits, the circuit breaker and the concurrency limit',
+                    self.wait_seconds, ('endpoint',))
+            counter(lines, 'analyst_api_pool_wait_seconds_total', 'Time waited for a connection of the HTTP pool',
+                    self.pool_wait_seconds, ('endpoint',))
+            counter(lines, 'analyst_api_sent_bytes_total', 'Bytes of the request bodies', self.sent_bytes,
+                    ('endpoint',))
+            counter(lines, 'analyst_api_received_bytes_total', 'Bytes of the response bodies', self.received_bytes,
+                    ('endpoint',))
+        return '\n'.join(lines) + '\n'
+
+    def write_file(self, filename):
+        """Replace filename atomically, e.g. for the textfile collector of the node exporter"""
+        directory = os.path.dirname(os.path.abspath(filename))
+        (handle, temporary) = tempfile.mkstemp(prefix='.metrics', dir=directory)
+        with os.fdopen(handle, 'w') as f:
+            f.write(self.render())
+        os.replace(temporary, filename)
+
+
+class MetricsExport:
+    """Writes the metrics to `filename` every `interval` seconds and serves them at http://localhost:`port`/metrics
+    while the run is progressing, either may be None"""
+
+    def __init__(self, metrics, filename=None, port=None, interval=DEFAULT_METRICS_INTERVAL):
+        self.metrics = metrics
+        self.filename = filename
+        self.timer = None
+        self.server = None
+        if filename:
+            self.timer = RepeatingTimer(interval, self.write, daemon=True)
+            self.timer.start()
+            logging.info(f"Writing metrics to {filename} every {interval:.0f} seconds")
+        if port is not None:
+            self.server = ThreadingHTTPServer(('localhost', port), handler_for(metrics))
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True).start()
+            logging.info(f"Serving metrics at http://localhost:{port}/metrics")
+
+    def write(self):
+        try:
+            self.metrics.write_file(self.filename)
+        except OSError as e:
+            logging.warning(f"Could not write the metrics to {self.filename}: {e}")
+
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.write()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def handler_for(metrics):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug("Metrics request: " + format % args)
+
+    return MetricsHandler
+
+
+def add(values, key, amount):
+    values[key] = values.get(key, 0) + amount
+
+
+def counter(lines, name, help_text, values, label_names):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} counter')
+    for (key, value) in sorted(values.items()):
+        key = key if isinstance(key, tuple) else (key,)
+        lines.append(sample(name, dict(zip(label_names, key)), value))
+
+
+def sample(name, labels, value):
+    label_text = ','.join(f'{label}="{escape(label_value)}"' for (label, label_value) in labels.items())
+    return f'{name}{{{label_text}}} {format_value(value)}'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
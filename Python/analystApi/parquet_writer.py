@@ -0,0 +1,133 @@
+import datetime
+import json
+import logging
+
+from analystApi.batching_dictwriter import BatchingDictWriter
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+DEFAULT_ROW_GROUP_ROWS = 10000
+
+TRUE_VALUES = ('1', 'true', 't', 'yes', 'y')
+FALSE_VALUES = ('0', 'false', 'f', 'no', 'n')
+
+
+class ParquetWriter(BatchingDictWriter):
+    """Writes the output rows to a Parquet file with typed columns, one row group per batch.
+
+    The column types follow the SQL types of psql_writer.column_types, the query is stored as compact JSON. Values
+    that do not fit the type of their column are stored as null. The file is only complete after close().
+    """
+
+    def __init__(self, filename, column_types, fieldnames, flush_interval=60.0, flush_rows=DEFAULT_ROW_GROUP_ROWS):
+        if pyarrow is None:
+            raise Exception("Writing Parquet requires pyarrow, install it with 'pip install pyarrow'")
+        if len(column_types) != len(fieldnames):
+            raise Exception(f'{len(fieldnames)} output columns do not match {len(column_types)} table columns')
+        self.fieldnames = fieldnames
+        self.converters = [converter_for(name, sql_type) for (name, (_, sql_type)) in zip(fieldnames, column_types)]
+        self.schema = pyarrow.schema([pyarrow.field(name, arrow_type(sql_type))
+                                      for (name, (_, sql_type)) in zip(fieldnames, column_types)])
+        self.rows = []
+        self.invalid_columns = set()
+        self.parquet = pyarrow.parquet.ParquetWriter(filename, self.schema, compression='zstd')
+        logging.info(f"Writing the output to {filename}")
+        super().__init__(None, fieldnames, flush_interval, flush_rows)
+
+    def format_header(self):
+        # The schema has the columns already
+        pass
+
+    def format_row(self, rowdict):
+        row = []
+        for (name, convert) in zip(self.fieldnames, self.converters):
+            value = rowdict.get(name)
+            try:
+                row.append(convert(value))
+            except (TypeError, ValueError):
+                if name not in self.invalid_columns:
+                    self.invalid_columns.add(name)
+                    logging.warning(f"Column {name} has values like {value!r} that do not fit its type, "
+                                    f"they are stored as null")
+                row.append(None)
+        self.rows.append(row)
+
+    def sync(self):
+        # A Parquet file cannot be read before it is closed
+        pass
+
+    def close(self):
+        super().close()
+        self.parquet.close()
+
+    def flush(self):
+        if not self.rows:
+            return
+        columns = list(zip(*self.rows))
+        self.rows = []
+        self.parquet.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(column, type=field.type) for (column, field) in zip(columns, self.schema)],
+            schema=self.schema))
+
+
+def arrow_type(sql_type):
+    sql_type = sql_type.split()[0].lower()
+    if sql_type == 'numeric':
+        return pyarrow.float64()
+    if sql_type in ('integer', 'bigint'):
+        return pyarrow.int64()
+    if sql_type == 'boolean':
+        return pyarrow.bool_()
+    if sql_type == 'date':
+        return pyarrow.date32()
+    return pyarrow.string()
+
+
+def converter_for(name, sql_type):
+    if name == 'query':
+        return to_compact_json
+    sql_type = sql_type.split()[0].lower()
+    if sql_type == 'numeric':
+        return lambda value: None if is_empty(value) else float(value)
+    if sql_type in ('integer', 'bigint'):
+        return lambda value: None if is_empty(value) else int(float(value))
+    if sql_type == 'boolean':
+        return to_bool
+    if sql_type == 'date':
+        return to_date
+    return lambda value: None if value is None else str(value)
+
+
+def is_empty(value):
+    return value is None or value == ''
+
+
+def to_bool(value):
+    if is_empty(value):
+        return None
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(value)
+
+
+def to_date(value):
+    if is_empty(value):
+        return None
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value).strip()[:10])
+
+
+def to_compact_json(value):
+    if is_empty(value):
+        return None
+    return json.dumps(json.loads(value), separators=(',', ':'), sort_keys=True, ensure_ascii=False)
@@ -0,0 +1,137 @@
+import csv
+import io
+import logging
+
+from analystApi.batching_dictwriter import BatchingDictWriter, DEFAULT_FLUSH_INTERVAL, DEFAULT_FLUSH_ROWS
+from analystApi.psql_writer import PRIMARY_KEY
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+# Same as the last step of the .psql script, only done if there is a georef table
+GEOREF_STATEMENT = """
+INSERT INTO georef (id, adresse, oadr_koord_epsg31467)
+SELECT id, adresse,
+    ST_Transform(ST_SetSRID(ST_Point(
+        (query::json->'peripherySpatialFilter'->'coordinate'->'lon')::text::numeric,
+        (query::json->'peripherySpatialFilter'->'coordinate'->'lat')::text::numeric), 4326), 31467)
+FROM {table} WHERE precision = 'HOUSE'
+ON CONFLICT DO NOTHING
+"""
+
+
+class PostgresWriter(BatchingDictWriter):
+    """Streams the output rows into a PostgreSQL table while the run is progressing.
+
+    Every batch of rows is copied (COPY FROM STDIN) into a temporary staging table and upserted into `table` by id,
+    so lines executed again, e.g. with --resume, replace their earlier rows. The table is created if it does not
+    exist yet, with the columns of psql_writer.column_types. A batch with invalid rows is written row by row without
+    them, any other database error stops the writer.
+    """
+
+    def __init__(self, dsn, table, column_types, fieldnames, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 flush_rows=DEFAULT_FLUSH_ROWS):
+        if psycopg2 is None:
+            raise Exception("Writing to PostgreSQL requires psycopg2, install it with 'pip install psycopg2-binary'")
+        if len(column_types) != len(fieldnames):
+            raise Exception(f'{len(fieldnames)} output columns do not match {len(column_types)} table columns')
+        self.table = table
+        self.connection = psycopg2.connect(dsn)
+        with self.connection.cursor() as cursor:
+            cursor.execute(create_table_statement(table, column_types))
+            cursor.execute(create_staging_statement(table))
+        self.connection.commit()
+        self.copy_statement = copy_statement(table, [name for (name, _) in column_types])
+        self.upsert_statement = upsert_statement(table, [name for (name, _) in column_types])
+        logging.info(f"Writing the output to PostgreSQL table {table}")
+        super().__init__(None, fieldnames, flush_interval, flush_rows, delimiter=',')
+
+    def writeheader(self):
+        # The table has the columns already
+        pass
+
+    def sync(self):
+        # Every batch is committed
+        pass
+
+    def close(self):
+        try:
+            super().close()
+            try:
+                with self.connection.cursor() as cursor:
+                    cursor.execute("SELECT to_regclass('georef')")
+                    if cursor.fetchone()[0] is not None:
+                        cursor.execute(GEOREF_STATEMENT.format(table=quote_identifier(self.table)))
+                self.connection.commit()
+            except psycopg2.Error as e:
+                self.connection.rollback()
+                logging.error(f"Could not add the coordinates of {self.table} to table georef: {e}")
+        finally:
+            self.connection.close()
+
+    def flush(self):
+        data = self.buffer.getvalue()
+        if not data:
+            return
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        try:
+            self.copy(data)
+        except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+            # A single invalid row fails the whole batch, so the rows are tried one by one. Other errors, e.g. a lost
+            # connection, would fail every row as well and stop the writer instead.
+            logging.warning(f"Could not copy a batch into table {self.table}, retrying row by row: {e}")
+            for row in csv.reader(io.StringIO(data), delimiter=','):
+                line = io.StringIO()
+                csv.writer(line, delimiter=',').writerow(row)
+                try:
+                    self.copy(line.getvalue())
+                except (psycopg2.DataError, psycopg2.IntegrityError) as row_error:
+                    logging.error(f"Could not write line {row[:1]} to table {self.table}: {row_error}")
+
+    def copy(self, data):
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.copy_expert(self.copy_statement, io.StringIO(data))
+                cursor.execute(self.upsert_statement)
+            self.connection.commit()
+        except psycopg2.Error:
+            self.connection.rollback()
+            raise
+
+
+def quote_identifier(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def staging_table(table):
+    return table + '_staging'
+
+
+def create_table_statement(table, column_types):
+    columns = ',\n'.join(f'    {quote_identifier(name)} {col_type}' for (name, col_type) in column_types)
+    return f'CREATE TABLE IF NOT EXISTS {quote_identifier(table)} (\n{columns},\n' \
+           f'    PRIMARY KEY ({quote_identifier(PRIMARY_KEY)})\n)'
+
+
+def create_staging_statement(table):
+    return f'CREATE TEMPORARY TABLE {quote_identifier(staging_table(table))} ' \
+           f'(LIKE {quote_identifier(table)} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS'
+
+
+def copy_statement(table, columns):
+    return f'COPY {quote_identifier(staging_table(table))} ({", ".join(map(quote_identifier, columns))}) ' \
+           f'FROM STDIN WITH (FORMAT csv)'
+
+
+def upsert_statement(table, columns):
+    quoted = ', '.join(map(quote_identifier, columns))
+    updates = ', '.join(f'{quote_identifier(name)} = EXCLUDED.{quote_identifier(name)}'
+                        for name in columns if name != PRIMARY_KEY)
+    # A line may occur more than once in a batch, the upsert can only take one of them
+    return f'INSERT INTO {quote_identifier(table)} ({quoted}) ' \
+           f'SELECT DISTINCT ON ({quote_identifier(PRIMARY_KEY)}) {quoted} ' \
+           f'FROM {quote_identifier(staging_table(table))} ' \
+           f'ON CONFLICT ({quote_identifier(PRIMARY_KEY)}) DO UPDATE SET {updates}'
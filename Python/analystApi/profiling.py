@@ -0,0 +1,261 @@
+import contextlib
+import contextvars
+import functools
+import inspect
+import os
+import re
+import sys
+import threading
+import time
+
+# Phases of a line in the order of the summary, the requests are timed with the functions sending them
+PHASES = ('csv parse', 'build query', 'georef', 'create query', 'details', 'collect', 'json encode', 'csv write')
+DEFAULT_PROFILE_INTERVAL = 0.01   # seconds between two samples of the stacks
+TOP_FUNCTIONS = 20
+
+# The Profile of the run, None unless profiling. The phases cost a global lookup when it is None.
+profile = None
+
+_current_phase = contextvars.ContextVar('analystApi_phase', default=None)
+_no_phase = contextlib.nullcontext()
+_end = object()
+
+
+class Phase:
+    """Times one call of a phase. Time spent in nested phases is only counted for them, so the phases add up.
+
+    The open phase is kept in a context variable, which is separate per thread and per asyncio task. Within a task
+    other tasks run while it awaits, so phases of coroutines only measure the wall clock (cpu=False).
+    """
+    __slots__ = ('profile', 'name', 'cpu', 'parent', 'token', 'start', 'start_cpu', 'child_seconds', 'child_cpu')
+
+    def __init__(self, profile_, name, cpu=True):
+        self.profile = profile_
+        self.name = name
+        self.cpu = cpu
+
+    def __enter__(self):
+        self.parent = _current_phase.get()
+        self.token = _current_phase.set(self)
+        self.child_seconds = 0.0
+        self.child_cpu = 0.0
+        self.start_cpu = time.thread_time() if self.cpu else 0.0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        cpu = time.thread_time() - self.start_cpu if self.cpu else 0.0
+        _current_phase.reset(self.token)
+        if self.parent is not None:
+            self.parent.child_seconds += seconds
+            if self.parent.cpu:
+                self.parent.child_cpu += cpu
+        self.profile.add(self.name, seconds - self.child_seconds, cpu - self.child_cpu if self.cpu else None)
+        return False
+
+
+def phase(name, cpu=True):
+    """Context manager timing a phase of the current profile, does nothing unless profiling"""
+    if profile is None:
+        return _no_phase
+    return Phase(profile, name, cpu)
+
+
+def phased(name):
+    """Decorator timing every call of a function or coroutine function as phase `name`"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def timed_coroutine(*args, **kwargs):
+                if profile is None:
+                    return await func(*args, **kwargs)
+                with Phase(profile, name, cpu=False):
+                    return await func(*args, **kwargs)
+            return timed_coroutine
+
+        @functools.wraps(func)
+        def timed_function(*args, **kwargs):
+            if profile is None:
+                return func(*args, **kwargs)
+            with Phase(profile, name):
+                return func(*args, **kwargs)
+        return timed_function
+    return decorator
+
+
+def timed(iterable, name):
+    """Iterate over iterable, timing every step as phase `name` (e.g. reading and parsing the next CSV line)"""
+    iterator = iter(iterable)
+    while True:
+        with phase(name):
+            item = next(iterator, _end)
+        if item is _end:
+            return
+        yield item
+
+
+class PhaseStats:
+    __slots__ = ('calls', 'seconds', 'cpu_seconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.cpu_seconds = None
+
+
+class Profile:
+    """Times of the phases and samples of the stacks of all threads, see start() and summary()"""
+
+    def __init__(self, interval=DEFAULT_PROFILE_INTERVAL):
+        self.lock = threading.Lock()
+        self.phases = {}   # name -> PhaseStats
+        self.sampler = StackSampler(interval)
+        self.started = None
+        self.seconds = None
+        self.cpu_seconds = None
+
+    def add(self, name, seconds, cpu_seconds):
+        with self.lock:
+            stats = self.phases.get(name)
+            if stats is None:
+                stats = self.phases[name] = PhaseStats()
+            stats.calls += 1
+            stats.seconds += seconds
+            if cpu_seconds is not None:
+                stats.cpu_seconds = (stats.cpu_seconds or 0.0) + cpu_seconds
+
+    def start(self):
+        self.started = (time.perf_counter(), time.process_time())
+        self.sampler.start()
+        return self
+
+    def stop(self):
+        self.sampler.stop()
+        self.seconds = time.perf_counter() - self.started[0]
+        self.cpu_seconds = time.process_time() - self.started[1]
+
+    def write_folded(self, filename):
+        """Write the sampled stacks in the collapsed format of flamegraph.pl, speedscope and inferno"""
+        with open(filename, 'w') as f:
+            for (stack, weight) in sorted(self.sampler.stacks.items()):
+                weight = round(weight)
+                if weight > 0:
+                    f.write(';'.join(stack) + ' ' + str(weight) + '\n')
+
+    def summary(self):
+        lines = [f'Profile of {self.seconds:.1f} s, {self.cpu_seconds:.1f} s CPU of the process. '
+                 f'Wall seconds are summed over all threads and tasks, nested phases are not included.',
+                 f'{"phase":<14} {"calls":>9} {"wall s":>10} {"CPU s":>9} {"CPU ms/call":>12} {"CPU %":>6}']
+        with self.lock:
+            phases = dict(self.phases)
+        names = [name for name in PHASES if name in phases] + sorted(set(phases) - set(PHASES))
+        phase_cpu = 0.0
+        for name in names:
+            stats = phases[name]
+            if stats.cpu_seconds is None:
+                cpu = per_call = share = '-'
+            else:
+                phase_cpu += stats.cpu_seconds
+                cpu = f'{stats.cpu_seconds:.2f}'
+                per_call = f'{stats.cpu_seconds * 1000 / stats.calls:.3f}'
+                share = f'{percent(stats.cpu_seconds, self.cpu_seconds):.1f}'
+            lines.append(f'{name:<14} {stats.calls:>9} {stats.seconds:>10.2f} {cpu:>9} {per_call:>12} {share:>6}')
+        other = max(0.0, self.cpu_seconds - phase_cpu)
+        lines.append(f'{"other":<14} {"":>9} {"":>10} {other:>9.2f} {"":>12} '
+                     f'{percent(other, self.cpu_seconds):>6.1f}')
+
+        leaves = {}
+        for (stack, weight) in self.sampler.stacks.items():
+            leaves[stack[-1]] = leaves.get(stack[-1], 0.0) + weight
+        total = sum(leaves.values())
+        lines.append(f'Top functions by {self.sampler.unit} of their own ({self.sampler.samples} samples):')
+        for (function, weight) in sorted(leaves.items(), key=lambda item: -item[1])[:TOP_FUNCTIONS]:
+            lines.append(f'{percent(weight, total):>6.1f} %  {function}')
+        return '\n'.join(lines)
+
+
+def percent(part, total):
+    return 100.0 * part / total if total else 0.0
+
+
+class StackSampler:
+    """Samples the stacks of all threads every interval seconds.
+
+    On Linux the CPU time a thread used since the last sample is added to its stack (in microseconds), threads
+    waiting for the network or a lock do not show up. Elsewhere every sample of a thread counts one.
+    """
+
+    def __init__(self, interval=DEFAULT_PROFILE_INTERVAL):
+        self.interval = interval
+        self.cpu_clocks = sys.platform.startswith('linux')
+        self.unit = 'CPU time' if self.cpu_clocks else 'samples'
+        self.stacks = {}       # (thread, outermost frame, ..., innermost frame) -> weight
+        self.samples = 0
+        self.cpu_times = {}    # native thread id -> CPU seconds at the last sample
+        self.labels = {}       # code object -> frame label
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+
+    def start(self):
+        if self.cpu_clocks:
+            # Only the CPU time from now on, threads started later begin at 0
+            for thread in threading.enumerate():
+                cpu = thread_cpu_time(thread.native_id)
+                if cpu is not None:
+                    self.cpu_times[thread.native_id] = cpu
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        frames = sys._current_frames()
+        self.samples += 1
+        for thread in threading.enumerate():
+            frame = frames.get(thread.ident)
+            if frame is None or thread is self.thread:
+                continue
+            weight = 1.0
+            if self.cpu_clocks:
+                cpu = thread_cpu_time(thread.native_id)
+                if cpu is None:
+                    continue
+                weight = (cpu - self.cpu_times.get(thread.native_id, 0.0)) * 1e6
+                self.cpu_times[thread.native_id] = cpu
+                if weight <= 0:
+                    continue
+            stack = []
+            while frame is not None:
+                label = self.labels.get(frame.f_code)
+                if label is None:
+                    label = self.labels[frame.f_code] = frame_label(frame.f_code)
+                stack.append(label)
+                frame = frame.f_back
+            stack.append(thread_group(thread.name))
+            stack = tuple(reversed(stack))
+            self.stacks[stack] = self.stacks.get(stack, 0.0) + weight
+
+
+def thread_cpu_time(native_id):
+    """CPU seconds of a thread of this process (Linux), None if it has ended"""
+    try:
+        # The clock id of a thread as built by the kernel: CPUCLOCK_SCHED of a thread
+        return time.clock_gettime((~native_id << 3) | 6)
+    except OSError:
+        return None
+
+
+def frame_label(code):
+    path = os.path.join(os.path.basename(os.path.dirname(code.co_filename)), os.path.basename(code.co_filename))
+    return f'{code.co_name} ({path}:{code.co_firstlineno})'.replace(';', ':')
+
+
+def thread_group(name):
+    """Threads of a pool share one root in the flame graph, e.g. ThreadPoolExecutor-0_3 -> ThreadPoolExecutor"""
+    return re.sub(r'[-_\d]+', '', name.split(' (')[0]).strip() or name
@@ -0,0 +1,178 @@
+import datetime
+import json
+import logging
+import math
+import socketserver
+import threading
+import time
+
+from analystApi.utils import RepeatingTimer
+
+DEFAULT_PROGRESS_INTERVAL = 10.0   # seconds between two progress lines of the file and the port
+PROGRESS_LOG_INTERVAL = 60.0       # seconds between two progress lines of the log
+RATE_WINDOW = 60.0                 # seconds, time constant of the moving average of the rows per second
+
+
+class Progress:
+    """Counters of a run, updated when a line completes. Safe to use from all threads and the event loop."""
+
+    def __init__(self, total=0, concurrency_limit=None):
+        self.lock = threading.Lock()
+        self.total = total
+        # Optional analystApi.concurrency.AdaptiveConcurrencyLimit, its current limit is part of the snapshot
+        self.concurrency_limit = concurrency_limit
+        self.success = 0
+        self.failed = 0
+        self.errors = {}       # exception class of the first error of a failed line -> count
+        self.retries = {}      # retry kind -> count
+        self.in_flight = 0     # requests sent and not answered yet
+        self.started = time.monotonic()
+        # State of the rates, advanced by snapshot()
+        self.last_time = self.started
+        self.last_done = 0
+        self.rate = 0.0
+        self.average_rate = None
+
+    def line_done(self, result):
+        with self.lock:
+            if result.successful:
+                self.success += 1
+            else:
+                self.failed += 1
+                error = result.error or 'unknown'
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def count_retry(self, kind):
+        with self.lock:
+            self.retries[kind] = self.retries.get(kind, 0) + 1
+
+    def request_started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def request_finished(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def snapshot(self, final=False):
+        """The progress as dict, the instantaneous rate is measured since the previous snapshot"""
+        now = time.monotonic()
+        with self.lock:
+            done = self.success + self.failed
+            seconds = now - self.last_time
+            if seconds > 0:
+                self.rate = (done - self.last_done) / seconds
+                if now - self.started < RATE_WINDOW or self.average_rate is None:
+                    # The average since the start, until there is enough history for the moving average
+                    self.average_rate = done / (now - self.started)
+                else:
+                    # Exponential moving average over unevenly spaced snapshots
+                    weight = 1.0 - math.exp(-seconds / RATE_WINDOW)
+                    self.average_rate += weight * (self.rate - self.average_rate)
+                (self.last_time, self.last_done) = (now, done)
+            remaining = max(0, self.total - done)
+            eta = None
+            if remaining == 0:
+                eta = 0.0
+            elif self.average_rate:
+                eta = remaining / self.average_rate
+            return {
+                'time': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                'elapsed_seconds': round(now - self.started, 3),
+                'total': self.total,
+                'done': done,
+                'success': self.success,
+                'failed': self.failed,
+                'rows_per_second': round(self.rate, 3),
+                'rows_per_second_average': round(self.average_rate or 0.0, 3),
+                'eta_seconds': None if eta is None else round(eta, 1),
+                'in_flight_requests': self.in_flight,
+                'concurrency_limit': None if self.concurrency_limit is None else self.concurrency_limit.current_limit,
+                'retries': dict(self.retries),
+                'errors': dict(self.errors),
+                'final': final,
+            }
+
+
+class ProgressReport:
+    """Takes a snapshot of the progress every `interval` seconds. Appends it as JSON line to `filename` and serves
+    the latest line to every connection to localhost:`port`, either may be None. log is called with a snapshot
+    every log_interval seconds."""
+
+    def __init__(self, progress, filename=None, port=None, interval=DEFAULT_PROGRESS_INTERVAL, log=None,
+                 log_interval=PROGRESS_LOG_INTERVAL):
+        self.progress = progress
+        self.filename = filename
+        self.log = log
+        self.log_interval = log_interval
+        self.last_log = time.monotonic()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.latest = json.dumps(progress.snapshot())
+        self.server = None
+        self.port = None
+        if filename:
+            logging.info(f"Writing the progress to {filename} every {interval:.0f} seconds")
+        if port is not None:
+            self.server = ProgressServer(('localhost', port), handler_for(self))
+            self.port = self.server.server_address[1]
+            threading.Thread(target=self.server.serve_forever, name='progress', daemon=True).start()
+            logging.info(f"Serving the progress at localhost:{self.port}")
+        self.timer = RepeatingTimer(min(interval, log_interval), self.report, daemon=True)
+        self.timer.start()
+
+    def report(self, final=False):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = final
+            snapshot = self.progress.snapshot(final)
+            self.latest = json.dumps(snapshot)
+            if self.filename:
+                with open(self.filename, 'a') as f:
+                    f.write(self.latest + '\n')
+            if self.log is not None and (final or time.monotonic() - self.last_log >= self.log_interval):
+                self.last_log = time.monotonic()
+                self.log(snapshot)
+
+    def close(self):
+        """Report the final progress and stop"""
+        self.timer.cancel()
+        self.report(final=True)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class ProgressServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def handler_for(report):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            self.wfile.write((report.latest + '\n').encode('utf-8'))
+
+    return Handler
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return 'unknown'
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+def describe(snapshot):
+    """One line for the log"""
+    text = (f"Processed {snapshot['done']} of {snapshot['total']} entries - success: {snapshot['success']}, "
+            f"failed: {snapshot['failed']}, {snapshot['rows_per_second']:.1f} rows/s "
+            f"(average {snapshot['rows_per_second_average']:.1f}), ETA {format_duration(snapshot['eta_seconds'])}, "
+            f"{snapshot['in_flight_requests']} requests in flight")
+    if snapshot['concurrency_limit'] is not None:
+        text += f", concurrency limit: {snapshot['concurrency_limit']}"
+    if snapshot['retries']:
+        text += ', retries: ' + ', '.join(f'{kind} {count}' for (kind, count) in sorted(snapshot['retries'].items()))
+    if snapshot['errors']:
+        text += ', errors: ' + ', '.join(f'{name} {count}' for (name, count) in sorted(snapshot['errors'].items()))
+    return text
@@ -41,14 +41,52 @@ psql -c "INSERT INTO georef (id,adresse,oadr_koord_epsg31467)
     return lines
 
 
+# Columns between the input columns and values_to_add, as in the output CSV
+RESULT_COLUMNS = [
+    ('results_start_here', 'text'),
+    ('queryid', 'bigint'),
+    ('distance_used', 'numeric'),
+    ('precision', 'text'),
+    ('query', 'json'),
+]
+PRIMARY_KEY = 'id'
+
+
 def construct_column_definitions(columns, values_to_add):
-    if not analystApi.api_basic.column_documentation:
-        immobrain_search_query.load_variable_documentation()
+    types = column_types(columns, values_to_add)
+    input_types = types[:len(columns)]
+    value_types = types[len(columns) + len(RESULT_COLUMNS):]
+
+    lines = []
+    for (col, col_type) in input_types:
+        append_col(lines, col, col_type)
+
+    lines.append('')
+    lines.append('results_start_here text,')
+    lines.append('')
+    for (col, col_type) in RESULT_COLUMNS[1:]:
+        lines.append(f'{col} {col_type},')
+    lines.append('')
+
+    for (v, col_type) in value_types:
+        append_col(lines, v, col_type)
+
+    lines.append('')
+    lines.append(f'PRIMARY KEY ("{PRIMARY_KEY}")')
+
+    lines_string = '\n'.join([f'    {line}' for line in lines])
+    # remove last comma
+    return lines_string
+
+
+def column_types(columns, values_to_add):
+    """Returns the table columns as [(name, sql type)], in the order of the columns of the output CSV"""
+    analystApi.api_basic.client.documentation()
 
     # lowercase copy of columns
     cols = [x.lower() for x in columns]
 
-    col_id = 'id'
+    col_id = PRIMARY_KEY
     basic_cols = {
         col_id: 'text NOT NULL',
         'adresse': 'text NOT NULL',
@@ -61,7 +99,7 @@ def construct_column_definitions(columns, values_to_add):
     if not contains(col_id, cols):
         raise Exception(f'Must contain {col_id} column')
 
-    lines = []
+    types = []
 
     # Handle all columns
     while cols:
@@ -69,7 +107,7 @@ def construct_column_definitions(columns, values_to_add):
         if col in [k.lower() for k in basic_cols]:
             for col_name, col_type in basic_cols.items():
                 if col == col_name.lower():
-                    append_col(lines, col_name, col_type)
+                    types.append((col_name, col_type))
                     break
         else:
             col_filter = immobrain_search_query.get_filter_for_column(col)
@@ -81,26 +119,11 @@ def construct_column_definitions(columns, values_to_add):
                 else:
                     col_type = col_filter.get_sql_type()
 
-            append_col(lines, col, col_type)
+            types.append((col, col_type))
 
-    lines.append('')
-    lines.append('results_start_here text,')
-    lines.append('')
-    lines.append('queryid bigint,')
-    lines.append('distance_used numeric,'),
-    lines.append('precision text,'),
-    lines.append('query json,'),
-    lines.append('')
-
-    for v in values_to_add:
-        lines.append(f'"{v}" numeric,')
-
-    lines.append('')
-    lines.append(f'PRIMARY KEY ("{col_id}")')
-
-    lines_string = '\n'.join([f'    {line}' for line in lines])
-    # remove last comma
-    return lines_string
+    types.extend(RESULT_COLUMNS)
+    types.extend((v, 'numeric') for v in values_to_add)
+    return types
 
 
 def append_col(lines, name, col_type):
@@ -0,0 +1,98 @@
+import email.utils
+import logging
+import threading
+import time
+
+DEFAULT_BURST_SECONDS = 1.0
+
+# Requests sharing one budget, GET /queries/{id} counts against /queries
+BUDGETS = {
+    'georef': 'georef',
+    'queries': 'queries',
+    'details': 'queries',
+    'results': 'results',
+}
+
+
+class TokenBucket:
+    """Token bucket with `rate` tokens per second and room for `capacity` tokens.
+
+    reserve() always takes a token and returns how long the caller has to wait for it, so waiting callers are
+    served in order. The bucket can be blocked for a while, e.g. for a Retry-After header.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            if now > self.updated:
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+            self.tokens -= 1
+            # updated is in the future while the bucket is blocked
+            return max(0.0, self.updated - now) + max(0.0, -self.tokens) / self.rate
+
+    def block(self, seconds):
+        with self.lock:
+            until = time.monotonic() + seconds
+            if until > self.updated:
+                self.tokens = min(self.tokens, 0)
+                self.updated = until
+
+
+class RateLimiter:
+    """Client side rate limits per budget (see BUDGETS), shared by all sessions and threads.
+
+    Budgets without a configured rate are unlimited, but still honour Retry-After.
+    """
+
+    def __init__(self, rates, burst_seconds=DEFAULT_BURST_SECONDS):
+        self.buckets = {}
+        for budget in set(BUDGETS.values()):
+            rate = rates.get(budget)
+            if rate:
+                self.buckets[budget] = TokenBucket(rate, max(1.0, rate * burst_seconds))
+            else:
+                # Unlimited, only used for blocking
+                self.buckets[budget] = TokenBucket(float('inf'), float('inf'))
+
+    def reserve(self, name):
+        """Returns the seconds to wait before a request `name` may be sent"""
+        bucket = self.buckets.get(BUDGETS.get(name))
+        if bucket is None:
+            return 0.0
+        return bucket.reserve()
+
+    def acquire(self, name):
+        wait = self.reserve(name)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def retry_after(self, name, header):
+        """Block the budget of `name` as requested by a Retry-After header (seconds or HTTP date)"""
+        bucket = self.buckets.get(BUDGETS.get(name))
+        seconds = parse_retry_after(header)
+        if bucket is None or seconds is None:
+            return
+        logging.warning(f"Server asked to retry {name} after {seconds:.1f} seconds")
+        bucket.block(seconds)
+
+
+def parse_retry_after(header):
+    if not header:
+        return None
+    try:
+        return max(0.0, float(header))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(header).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
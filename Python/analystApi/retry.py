@@ -0,0 +1,110 @@
+import logging
+import random
+import threading
+
+import requests
+
+from analystApi.exceptions import AnalystApiError, AnalystApiServerError, AnalystApiThrottled, GeorefOffline
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+DEFAULT_MAX_ATTEMPTS = 100
+DEFAULT_MAX_ELAPSED = 3600      # 1 hour
+
+# What to do after an exception
+FAST = 'fast'               # connection dropped, try again soon
+SLOW = 'slow'               # service is down or in maintenance, wait long
+THROTTLED = 'throttled'     # too many requests (429), wait at least as long as the API asked for
+DEFAULT = 'default'         # timeouts and other unexpected errors
+NEVER = 'never'             # usage errors, retrying does not help
+
+# (base delay, max delay) in seconds, the n-th retry waits up to min(max delay, base delay * 2 ** (n - 1))
+DEFAULT_DELAYS = {
+    FAST: (0.5, 10.0),
+    SLOW: (30.0, 300.0),
+    THROTTLED: (1.0, 60.0),
+    DEFAULT: (2.0, 60.0),
+}
+
+# The first matching exception class decides
+DEFAULT_RULES = [
+    # Before AnalystApiError, only a 429 without Retry-After (the yearly limit of the license) is never retried
+    (AnalystApiThrottled, THROTTLED),
+    (GeorefOffline, SLOW),
+    (AnalystApiServerError, SLOW),
+    (AnalystApiError, NEVER),
+    # A bug, e.g. a call repeating itself, retrying would only repeat it
+    (RecursionError, NEVER),
+    (requests.exceptions.ConnectionError, FAST),
+    (ConnectionError, FAST),
+]
+if aiohttp is not None:
+    DEFAULT_RULES.append((aiohttp.ClientConnectionError, FAST))
+
+
+class RetryBudget:
+    """Number of retries all calls of one run may spend together"""
+
+    def __init__(self, retries):
+        self.remaining = retries
+        self.lock = threading.Lock()
+
+    def try_spend(self):
+        with self.lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+class RetryPolicy:
+    """Decides whether and how long to wait before calling again after an exception.
+
+    Delays grow exponentially per attempt and are drawn uniformly from [0, delay] (full jitter), so lines failing
+    together do not retry together. The kind of delay is chosen by the first rule whose exception class matches.
+    A delay is never shorter than the retry_after of the exception (the Retry-After of a 429).
+    """
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, max_elapsed=DEFAULT_MAX_ELAPSED, delays=None, rules=None,
+                 budget=None, rng=random):
+        self.max_attempts = max_attempts
+        self.max_elapsed = max_elapsed
+        self.delays = dict(DEFAULT_DELAYS, **(delays or {}))
+        self.rules = DEFAULT_RULES if rules is None else rules
+        self.budget = budget
+        self.rng = rng
+
+    def classify(self, error):
+        for (exception_class, kind) in self.rules:
+            if isinstance(error, exception_class):
+                return kind
+        return DEFAULT
+
+    def next_delay(self, error, attempt, elapsed):
+        """Seconds to wait before attempt + 1, or None to give up. attempt counts the failed calls so far."""
+        kind = self.classify(error)
+        if kind == NEVER or attempt >= self.max_attempts or elapsed >= self.max_elapsed:
+            return None
+        if self.budget is not None and not self.budget.try_spend():
+            logging.warning("Retry budget of this run is exhausted")
+            return None
+        (base, cap) = self.delays[kind]
+        delay = self.rng.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+        delay = max(delay, getattr(error, 'retry_after', None) or 0.0)
+        return min(delay, self.max_elapsed - elapsed)
+
+
+def give_up(policy, func, error, attempt, elapsed):
+    """The exception to raise when policy does not retry error anymore"""
+    if policy.classify(error) == NEVER:
+        return error
+    return Exception(f'Failed to call "{func.__name__}" in {attempt} tries in {elapsed:.0f} seconds. '
+                     f'Last error appended.', error)
+
+
+def log_retry(func, error, delay):
+    logging.warning(f'Exception "{type(error).__name__}" was raised in function "{func.__name__}", '
+                    f'retrying in {delay:.1f} secs, exception was {error}')
@@ -0,0 +1,106 @@
+import csv
+import json
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import zlib
+
+
+def shard_of(entry_id, shards):
+    """The shard of a line, the same for every process and host"""
+    return zlib.crc32(entry_id.strip().encode('utf-8')) % shards
+
+
+def shard_output_file(output_csv_file, shard_index, shards):
+    (base, ext) = os.path.splitext(output_csv_file)
+    return f'{base}.shard-{shard_index}-of-{shards}{ext}'
+
+
+def find_id_column(fieldnames):
+    id_column = next((name for name in fieldnames if name.lower() == 'id'), None)
+    if id_column is None:
+        raise Exception('Sharding requires an ID column')
+    return id_column
+
+
+def run_local_shards(shards, argv):
+    """Run every shard in a process of its own on this machine, argv are the arguments of this process"""
+    processes = []
+    for shard_index in range(shards):
+        command = [sys.executable, '-m', 'analystApi.csv_transform'] + argv + ['--shard-index', str(shard_index)]
+        logging.info(f"Starting shard {shard_index} of {shards}")
+        processes.append(subprocess.Popen(command))
+    failed = [shard_index for (shard_index, process) in enumerate(processes) if process.wait() != 0]
+    if failed:
+        raise Exception(f"Shards {', '.join(map(str, failed))} failed, run them again with --resume")
+
+
+def merge_shards(csv_file, output_csv_file, shards):
+    """Merge the shard outputs into output_csv_file, in the order of the lines in csv_file.
+
+    The shard rows are indexed by ID in a temporary sqlite database and taken from there in the order of the input,
+    a row for every occurrence of its ID, so neither the input nor the output has to fit into memory.
+    """
+    shard_files = [shard_output_file(output_csv_file, shard_index, shards) for shard_index in range(shards)]
+    missing = [f for f in shard_files if not os.path.exists(f)]
+    if missing:
+        raise Exception(f"Cannot merge, missing shard outputs: {', '.join(missing)}")
+
+    (index_handle, index_file) = tempfile.mkstemp(suffix='.sqlite',
+                                                  dir=os.path.dirname(os.path.abspath(output_csv_file)))
+    os.close(index_handle)
+    connection = sqlite3.connect(index_file, isolation_level=None)
+    try:
+        connection.execute('PRAGMA journal_mode=OFF')
+        connection.execute('PRAGMA synchronous=OFF')
+        # The rowid keeps the order of the rows with the same ID
+        connection.execute('CREATE TABLE rows (id TEXT, row TEXT)')
+
+        fieldnames = None
+        id_position = None
+        for shard_file in shard_files:
+            with open(shard_file, newline='') as filehandle:
+                reader = csv.reader(filehandle, delimiter=',')
+                header = next(reader)
+                if fieldnames is None:
+                    fieldnames = header
+                    id_position = fieldnames.index(find_id_column(fieldnames))
+                elif header != fieldnames:
+                    raise Exception(f"Cannot merge, the columns of {shard_file} differ")
+                connection.execute('BEGIN')
+                for row in reader:
+                    connection.execute('INSERT INTO rows (id, row) VALUES (?, ?)',
+                                       (row[id_position].strip(), json.dumps(row)))
+                connection.execute('COMMIT')
+        connection.execute('CREATE INDEX rows_id ON rows (id)')
+
+        merged = 0
+        not_executed = 0
+        with open(csv_file) as input_handle, open(output_csv_file, 'w') as output_handle:
+            input_reader = csv.DictReader(input_handle, delimiter=',')
+            input_id_column = find_id_column(input_reader.fieldnames)
+            writer = csv.writer(output_handle, delimiter=',')
+            writer.writerow(fieldnames)
+            connection.execute('BEGIN')
+            for line in input_reader:
+                # The first row left for the ID, it is removed for the next occurrence of the ID
+                found = connection.execute('SELECT rowid, row FROM rows WHERE id = ? ORDER BY rowid LIMIT 1',
+                                           (line[input_id_column].strip(),)).fetchone()
+                if found is None:
+                    not_executed += 1
+                    continue
+                connection.execute('DELETE FROM rows WHERE rowid = ?', (found[0],))
+                writer.writerow(json.loads(found[1]))
+                merged += 1
+            connection.execute('COMMIT')
+    finally:
+        connection.close()
+        os.remove(index_file)
+
+    logging.info(f"Merged {merged} lines of {shards} shards into {output_csv_file}")
+    if not_executed:
+        logging.warning(f"{not_executed} lines of {csv_file} are missing in the shard outputs")
+    return merged
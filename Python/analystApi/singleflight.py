@@ -0,0 +1,74 @@
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Suppress duplicate calls: while a call for a key is in flight, other callers with the same key wait for
+    it and get its result (or its exception) instead of calling the function again.
+
+            flight = SingleFlight()
+            position = flight.do(address, fetch_position, address)
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, func, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines, all callers must run in the same event loop.
+
+    The call runs as a task of its own. A caller that is cancelled stops waiting for it, but the call goes on for
+    the other callers.
+    """
+
+    def __init__(self):
+        self.calls = {}
+
+    async def do(self, key, func, *args):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args))
+            self.calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            # Waiters get the exception as well, nobody has to retrieve it
+            task.exception()
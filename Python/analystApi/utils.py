@@ -1,3 +1,4 @@
+import random
 from threading import Thread, Event
 
 
@@ -29,3 +30,16 @@ class RepeatingTimer(Thread):
 
     def call_function(self):
         self.function(*self.args, **self.kwargs)
+
+
+def reservoir_sample(iterable, k, rng=random):
+    """Uniform random sample of k items from an iterable of unknown length, keeps only k items in memory"""
+    sample = []
+    for n, item in enumerate(iterable):
+        if n < k:
+            sample.append(item)
+        else:
+            j = rng.randrange(n + 1)
+            if j < k:
+                sample[j] = item
+    return sample
@@ -0,0 +1,255 @@
+# Python script to query REST-API from empirica-systeme, see
+# https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", see
+# http://creativecommons.org/licenses/by/4.0/
+
+# Local stand-in for the Analyst API, for load tests without credentials or network:
+#
+#   python -m benchmarks.mock_api --port 8765 --latency lognormal:0.02:0.5 --latency results=0.05 --throttle-rate 0.01
+#
+# Answers are derived from hashes of the requests, so repeated runs get the same results.
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+ENDPOINTS = ('vars', 'georef', 'queries', 'details', 'results')
+
+VARS = {'vars': [
+    {'key': 'fl_wohnen', 'filterModelName': 'rangeFilter'},
+    {'key': 'baujahr', 'filterModelName': 'rangeFilter'},
+    {'key': 'fl_gewerbe', 'filterModelName': 'rangeFilter'},
+    {'key': 'objekttyp_fein', 'filterModelName': 'categoryFilter'},
+    {'key': 'oeig_vermietet_janein', 'filterModelName': 'booleanFilter'},
+], 'dataVintage': 'mock'}
+VARS_ETAG = '"%s"' % hashlib.md5(json.dumps(VARS, sort_keys=True).encode('utf-8')).hexdigest()
+
+# Addresses containing this are not found, like addresses the API cannot georeference
+UNKNOWN_ADDRESS = 'Pfeffer'
+
+
+def parse_latency(spec):
+    """A function returning random latencies in seconds, spec is one of '0.01' (constant), 'uniform:low:high',
+    'exponential:mean' or 'lognormal:median:sigma'"""
+    (kind, _, parameters) = spec.partition(':')
+    try:
+        if not parameters:
+            value = float(kind)
+            return lambda rng: value
+        values = [float(v) for v in parameters.split(':')]
+        if kind == 'uniform':
+            (low, high) = values
+            return lambda rng: rng.uniform(low, high)
+        if kind == 'exponential':
+            (mean,) = values
+            return lambda rng: rng.expovariate(1 / mean)
+        if kind == 'lognormal':
+            (median, sigma) = values
+            return lambda rng: rng.lognormvariate(math.log(median), sigma)
+    except ValueError:
+        pass
+    raise ValueError(f'Invalid latency "{spec}", use e.g. 0.01, uniform:0.005:0.02, exponential:0.01 or '
+                     f'lognormal:0.01:0.5')
+
+
+class MockApi:
+    """The server, `latencies` maps endpoints (None = all others) to latency functions of parse_latency.
+
+    Every request fails with probability error_rate (500), throttle_rate (429 with Retry-After) or
+    unavailable_rate (503, the API answers it for georef while the georeferencing is offline).
+    """
+
+    def __init__(self, port=0, latencies=None, error_rate=0.0, throttle_rate=0.0, unavailable_rate=0.0,
+                 retry_after=1, seed=None):
+        self.latencies = latencies or {None: parse_latency('0')}
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.unavailable_rate = unavailable_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        # queryId -> hash of the query document, the documents themselves would not fit for a million rows
+        self.queries = {}
+        self.distances = {}
+        self.counts = {}
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), handler_for(self))
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.url = f'http://127.0.0.1:{self.port}'
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='mock-api', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def delay(self, endpoint):
+        latency = self.latencies.get(endpoint, self.latencies.get(None))
+        with self.lock:
+            seconds = latency(self.rng) if latency else 0.0
+            draw = self.rng.random()
+        if seconds > 0:
+            time.sleep(seconds)
+        if draw < self.error_rate:
+            return 500, {'error': 'Injected server error'}
+        draw -= self.error_rate
+        if draw < self.throttle_rate:
+            return 429, {'error': 'Injected rate limit'}
+        draw -= self.throttle_rate
+        if draw < self.unavailable_rate:
+            return 503, {'error': 'Injected outage'}
+        return None
+
+    def create_query(self, document):
+        key = hashlib.md5(json.dumps(document, sort_keys=True).encode('utf-8')).hexdigest()
+        distance = (document.get('peripherySpatialFilter') or {}).get('distance', 0.2)
+        with self.lock:
+            query_id = 7000000 + len(self.queries)
+            self.queries[query_id] = key
+            self.distances[query_id] = distance
+        return query_id
+
+    def result(self, query_id, type_):
+        with self.lock:
+            key = self.queries.get(query_id)
+        if key is None:
+            return None
+        return float(int(hashlib.md5((key + type_).encode('utf-8')).hexdigest()[:6], 16) % 50)
+
+
+def handler_for(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body are sent separately, with Nagle every answer would wait for a delayed ACK
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def send(self, status, body, headers=None):
+            data = json.dumps(body).encode('utf-8') if body is not None else b''
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for (name, value) in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def answer(self, endpoint, respond):
+            api.count(endpoint)
+            failure = api.delay(endpoint)
+            if failure is not None:
+                (status, body) = failure
+                api.count(f'{endpoint}_{status}')
+                headers = {'Retry-After': str(api.retry_after)} if status in (429, 503) else None
+                return self.send(status, body, headers)
+            return respond()
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            path = url.path
+            if path == '/stats':
+                return self.send(200, api.stats())
+            if path == '/vars/':
+                return self.answer('vars', self.get_vars)
+            if path == '/georef':
+                return self.answer('georef', lambda: self.georef(parse_qs(url.query).get('address', [''])[0]))
+            parts = path.strip('/').split('/')
+            if len(parts) == 2 and parts[0] == 'queries':
+                return self.answer('details', lambda: self.details(parts[1]))
+            if len(parts) >= 3 and parts[0] == 'results':
+                return self.answer('results', lambda: self.results(parts[1], '/'.join(parts[2:])))
+            self.send(404, {'error': f'Unknown path {path}'})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length)
+            if urlparse(self.path).path != '/queries':
+                return self.send(404, {'error': f'Unknown path {self.path}'})
+            self.answer('queries', lambda: self.send(201, {'queryId': api.create_query(json.loads(body))}))
+
+        def get_vars(self):
+            if self.headers.get('If-None-Match') == VARS_ETAG:
+                return self.send(304, None, {'ETag': VARS_ETAG})
+            self.send(200, VARS, {'ETag': VARS_ETAG})
+
+        def georef(self, address):
+            if UNKNOWN_ADDRESS in address:
+                return self.send(404, {'error': f'Address not found: {address}'})
+            h = int(hashlib.md5(address.encode('utf-8')).hexdigest()[:6], 16)
+            self.send(200, {'lat': 50 + h % 1000 / 1000, 'lon': 8 + h % 777 / 1000, 'precision': 'HOUSE',
+                            'displayNameDE': address, 'biggerArea': 'Mock'})
+
+        def details(self, query_id):
+            with api.lock:
+                distance = api.distances.get(int(query_id)) if query_id.isdigit() else None
+            if distance is None:
+                return self.send(404, {'error': f'Unknown query {query_id}'})
+            self.send(200, {'peripherySpatialFilter': {'distance': distance}})
+
+        def results(self, query_id, type_):
+            value = api.result(int(query_id), type_) if query_id.isdigit() else None
+            if value is None:
+                return self.send(404, {'error': f'Unknown query {query_id}'})
+            self.send(200, {'value': value})
+
+    return Handler
+
+
+def parse_latencies(specs):
+    latencies = {None: parse_latency('0')}
+    for spec in specs or []:
+        (endpoint, _, latency) = spec.rpartition('=')
+        if endpoint and endpoint not in ENDPOINTS:
+            raise ValueError(f'Unknown endpoint {endpoint}, use one of {", ".join(ENDPOINTS)}')
+        latencies[endpoint or None] = parse_latency(latency)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Analyst API')
+    parser.add_argument('--port', type=int, default=0, help='Port to listen on, 0 picks a free one')
+    parser.add_argument('--latency', action='append',
+                        help='[endpoint=]distribution, e.g. 0.01, results=lognormal:0.05:0.5 (repeatable)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of requests answered with 429')
+    parser.add_argument('--unavailable-rate', type=float, default=0.0,
+                        help='Fraction of requests answered with 503')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After of 429 and 503 answers in seconds')
+    parser.add_argument('--seed', type=int, help='Seed of the latencies and injected errors')
+    args = parser.parse_args()
+
+    api = MockApi(args.port, parse_latencies(args.latency), args.error_rate, args.throttle_rate,
+                  args.unavailable_rate, args.retry_after, args.seed)
+    # The benchmark runner reads the URL from the first line
+    print(api.url, flush=True)
+    try:
+        api.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(api.stats()), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
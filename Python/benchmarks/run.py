@@ -0,0 +1,198 @@
+# Python script to query REST-API from empirica-systeme, see
+# https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", see
+# http://creativecommons.org/licenses/by/4.0/
+
+# Load test of csv_transform against the local mock API (benchmarks.mock_api), e.g.
+#
+#   python -m benchmarks.run --rows 1000 100000 1000000 --latency lognormal:0.02:0.5 --engine asyncio
+#
+# Every size is executed with empty caches in a temporary home directory. Reported are the lines per second,
+# the 50th and 99th percentile of the time a line took and the peak RSS of the csv_transform process.
+
+import argparse
+import array
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+DEFAULT_ROWS = [1000, 100000, 1000000]
+DEFAULT_VALUES_TO_ADD = 'count /aggregated/kosten_je_flaeche/MEDIAN /aggregated/kosten/AVG'
+PACKAGE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEADER = ['ID', 'Adresse', 'Segment', 'fl_wohnen::von', 'fl_wohnen::bis', 'fl_wohnen::includeUNKNOWN', 'baujahr',
+          'objekttyp_fein', 'kommentar']
+SEGMENTS = ['WHG_K', 'WHG_M', 'EFH_K', 'EFH_M']
+
+
+def generate_input(filename, rows, addresses=None):
+    """A CSV with `rows` lines, every line has its own address unless `addresses` limits the distinct ones"""
+    addresses = addresses or rows
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter=',')
+        writer.writerow(HEADER)
+        for i in range(rows):
+            address = i % addresses
+            writer.writerow([f'R{i}', f'Musterstr. {address % 200 + 1}, {10000 + address // 200} Berlin',
+                             SEGMENTS[i % len(SEGMENTS)], 40 + i % 50, 120 + i % 80, 't' if i % 3 else 'f',
+                             1900 + i % 120, '7 8' if i % 5 == 0 else '', 'benchmark'])
+
+
+def write_login(home, url, workers, values_to_add, settings):
+    lines = ['[global]', 'username = benchmark', 'password = benchmark', f'endpoint = {url}',
+             f'values_to_add = {values_to_add}', 'include_unknown = False', f'client_workers = {workers}',
+             # No pause around midnight during a benchmark
+             'maintenance_windows =']
+    lines.extend(f'{key.strip()} = {value.strip()}' for (key, _, value) in (s.partition('=') for s in settings))
+    with open(os.path.join(home, 'analystApi.login'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def start_mock_api(mock_arguments):
+    process = subprocess.Popen([sys.executable, '-m', 'benchmarks.mock_api', '--port', '0'] + mock_arguments,
+                               cwd=PACKAGE_DIRECTORY, stdout=subprocess.PIPE, text=True)
+    url = process.stdout.readline().strip()
+    if not url:
+        process.kill()
+        raise Exception('The mock API did not start')
+    return process, url
+
+
+def mock_stats(url):
+    with urllib.request.urlopen(url + '/stats') as response:
+        return json.loads(response.read())
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+def run_once(work_directory, url, rows, args):
+    home = os.path.join(work_directory, f'home-{rows}')
+    os.makedirs(home)
+    input_file = os.path.join(work_directory, f'input-{rows}.csv')
+    seconds_file = os.path.join(work_directory, f'seconds-{rows}.bin')
+    log_file = os.path.join(work_directory, f'csv_transform-{rows}.log')
+    generate_input(input_file, rows, args.addresses)
+    write_login(home, url, args.workers, args.values_to_add, args.setting or [])
+
+    before = mock_stats(url)
+    command = [sys.executable, '-m', 'benchmarks.transform_child', seconds_file, '--engine', args.engine, input_file]
+    environment = dict(os.environ, HOME=home, PYTHONPATH=PACKAGE_DIRECTORY)
+    start = time.monotonic()
+    with open(log_file, 'w') as log:
+        process = subprocess.Popen(command, cwd=PACKAGE_DIRECTORY, env=environment, stdout=log, stderr=log)
+        (_, status, usage) = os.wait4(process.pid, 0)
+    elapsed = time.monotonic() - start
+    if os.waitstatus_to_exitcode(status) != 0:
+        with open(log_file) as log:
+            raise Exception(f'csv_transform failed for {rows} rows:\n' + ''.join(log.readlines()[-20:]))
+    after = mock_stats(url)
+
+    seconds = array.array('d')
+    with open(seconds_file, 'rb') as f:
+        seconds.frombytes(f.read())
+    seconds = sorted(seconds)
+    with open(os.path.splitext(input_file)[0] + '_executed.csv', newline='') as f:
+        with_query_id = sum(1 for row in csv.DictReader(f) if row['QUERY-ID'])
+    requests = {key: after.get(key, 0) - before.get(key, 0) for key in after}
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return {
+        'rows': rows,
+        'lines_done': len(seconds),
+        # Lines that failed for good, e.g. after errors that were not retried
+        'lines_without_query_id': rows - with_query_id,
+        'seconds': elapsed,
+        'rows_per_second': rows / elapsed if elapsed > 0 else None,
+        'p50_seconds': percentile(seconds, 0.5),
+        'p99_seconds': percentile(seconds, 0.99),
+        'peak_rss_bytes': peak_rss,
+        # The mock API counts injected errors as '<endpoint>_<status>'
+        'requests': sum(count for (key, count) in requests.items() if '_' not in key),
+        'injected_errors': sum(count for (key, count) in requests.items() if '_' in key),
+    }
+
+
+def print_report(results, out=sys.stdout):
+    print(f'{"rows":>9} {"seconds":>9} {"rows/s":>9} {"p50 ms":>9} {"p99 ms":>9} {"RSS MB":>8} {"requests":>9} '
+          f'{"errors":>7} {"no ID":>7}', file=out)
+    for r in results:
+        print(f'{r["rows"]:>9} {r["seconds"]:>9.1f} {r["rows_per_second"]:>9.1f} {milliseconds(r["p50_seconds"]):>9} '
+              f'{milliseconds(r["p99_seconds"]):>9} {r["peak_rss_bytes"] / 2 ** 20:>8.1f} {r["requests"]:>9} '
+              f'{r["injected_errors"]:>7} {r["lines_without_query_id"]:>7}', file=out)
+
+
+def milliseconds(seconds):
+    return '-' if seconds is None else f'{seconds * 1000:.1f}'
+
+
+def mock_arguments(args):
+    arguments = []
+    for latency in args.latency or []:
+        arguments += ['--latency', latency]
+    arguments += ['--error-rate', str(args.error_rate), '--throttle-rate', str(args.throttle_rate),
+                  '--unavailable-rate', str(args.unavailable_rate), '--retry-after', str(args.retry_after)]
+    if args.seed is not None:
+        arguments += ['--seed', str(args.seed)]
+    return arguments
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load test of csv_transform against a local mock API')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help='Sizes of the input to run')
+    parser.add_argument('--addresses', type=int, help='Number of distinct addresses (default: one per row)')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads')
+    parser.add_argument('--workers', type=int, default=39, help='client_workers of csv_transform')
+    parser.add_argument('--values-to-add', default=DEFAULT_VALUES_TO_ADD)
+    parser.add_argument('--setting', action='append',
+                        help='Further key=value for analystApi.login, e.g. row_fanout=1 (repeatable)')
+    parser.add_argument('--latency', action='append',
+                        help='[endpoint=]distribution of the mock API, e.g. 0.01, results=lognormal:0.05:0.5')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of 500 answers')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of 429 answers')
+    parser.add_argument('--unavailable-rate', type=float, default=0.0, help='Fraction of 503 answers')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='Also write the results to this file')
+    parser.add_argument('--keep', action='store_true', help='Keep the inputs, outputs and logs')
+    return parser.parse_args(argv)
+
+
+def run(args):
+    (mock, url) = start_mock_api(mock_arguments(args))
+    work_directory = tempfile.mkdtemp(prefix='analystApi-benchmark-')
+    results = []
+    try:
+        for rows in args.rows:
+            results.append(run_once(work_directory, url, rows, args))
+            print_report(results[-1:], out=sys.stderr)
+    finally:
+        mock.terminate()
+        mock.wait()
+        if args.keep:
+            print(f'Files are kept in {work_directory}', file=sys.stderr)
+        else:
+            shutil.rmtree(work_directory, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args)
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+# Python script to query REST-API from empirica-systeme, see
+# https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", see
+# http://creativecommons.org/licenses/by/4.0/
+
+# Runs csv_transform and writes the seconds every line took to a file (array of doubles), used by benchmarks.run:
+#
+#   python -m benchmarks.transform_child <seconds file> <arguments of csv_transform>
+
+import array
+import sys
+
+from analystApi import csv_transform
+
+
+def main():
+    seconds_file = sys.argv[1]
+    seconds = array.array('d')
+    count_result = csv_transform.count_result
+
+    def count_and_time_result(item):
+        count_result(item)
+        if item.seconds is not None:
+            seconds.append(item.seconds)
+
+    csv_transform.count_result = count_and_time_result
+    sys.argv = ['csv_transform'] + sys.argv[2:]
+    try:
+        csv_transform.main()
+    finally:
+        with open(seconds_file, 'wb') as f:
+            seconds.tofile(f)
+
+
+if __name__ == '__main__':
+    main()
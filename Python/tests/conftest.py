@@ -4,8 +4,10 @@
 
 import pytest
 import configparser
+import os
 from os.path import expanduser
 from analystApi import api_basic
+from analystApi.cache import SqliteCache
 
 
 @pytest.fixture(scope='session')
@@ -14,7 +16,11 @@ def test_client():
     home = expanduser("~")
     config.read_file(open(home + '/analystApi.login'))
 
-    api_basic.username = config.get('global', 'username')
-    api_basic.password = config.get('global', 'password')
-    api_basic.endpoint = config.get('global', 'endpoint')
+    api_basic.client.configure(endpoint=config.get('global', 'endpoint'),
+                               username=config.get('global', 'username'),
+                               password=config.get('global', 'password'))
+    # The variable documentation is loaded once, not for every test run
+    api_basic.vars_cache = SqliteCache(os.path.join(home, '.analystApi', 'vars.sqlite'), table='vars')
     yield 1
+    api_basic.vars_cache.close()
+    api_basic.vars_cache = None
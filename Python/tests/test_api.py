@@ -6,10 +6,10 @@ from analystApi import api_basic
 
 
 def test_connect(test_client):
-    print(api_basic.username)
+    print(api_basic.client.username)
     api_basic.immobrain_search_query()
 
-    assert 1 == 1
+    assert 'fl_wohnen' in api_basic.client.documentation()
 
 
 def test_count():
@@ -0,0 +1,69 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import csv
+import errno
+import io
+
+import pytest
+
+from analystApi.batching_dictwriter import BatchingDictWriter
+
+FIELDNAMES = ['ID', 'Adresse', 'query', 'count']
+ROWS = [{'ID': str(i), 'Adresse': 'Brunsstr. 31, 72074 Tübingen', 'query': '{\n    "segment": "WHG_M"\n}',
+         'count': float(i)} for i in range(25)]
+
+
+def test_output_matches_dictwriter(tmp_path):
+    expected = io.StringIO()
+    writer = csv.DictWriter(expected, fieldnames=FIELDNAMES, delimiter=',')
+    writer.writeheader()
+    writer.writerows(ROWS)
+
+    with open(tmp_path / 'out.csv', 'w') as f:
+        writer = BatchingDictWriter(f, fieldnames=FIELDNAMES, delimiter=',', flush_rows=10)
+        writer.writeheader()
+        writer.writerows(ROWS)
+        writer.close()
+
+    with open(tmp_path / 'out.csv', newline='') as f:
+        assert f.read() == expected.getvalue()
+
+
+def test_checkpoint_writes_queued_rows(tmp_path):
+    with open(tmp_path / 'out.csv', 'w') as f:
+        writer = BatchingDictWriter(f, fieldnames=FIELDNAMES, flush_interval=60, flush_rows=1000)
+        writer.writerow(ROWS[0])
+        writer.checkpoint()
+        with open(tmp_path / 'out.csv') as check:
+            assert check.read().startswith('0,')
+        writer.close()
+
+
+def test_surplus_fields_fail_the_row(tmp_path):
+    with open(tmp_path / 'out.csv', 'w') as f:
+        writer = BatchingDictWriter(f, fieldnames=FIELDNAMES)
+        with pytest.raises(ValueError, match='price'):
+            writer.writerow(dict(ROWS[0], price=1.0))
+        writer.writerow(ROWS[1])
+        writer.close()
+    with open(tmp_path / 'out.csv', newline='') as f:
+        assert [row['ID'] for row in csv.DictReader(f, fieldnames=FIELDNAMES)] == ['1']
+
+
+class FullDisk(io.StringIO):
+    def write(self, data):
+        raise OSError(errno.ENOSPC, 'No space left on device')
+
+
+def test_failed_write_is_raised(tmp_path):
+    writer = BatchingDictWriter(FullDisk(), fieldnames=FIELDNAMES, flush_interval=60, flush_rows=1)
+    writer.writerow(ROWS[0])
+    with pytest.raises(Exception, match='No space left on device'):
+        writer.checkpoint()
+    # The writer thread is gone, later rows and close fail instead of waiting
+    with pytest.raises(Exception, match='No space left on device'):
+        writer.writerow(ROWS[1])
+    with pytest.raises(Exception, match='No space left on device'):
+        writer.close()
@@ -0,0 +1,45 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from benchmarks import run
+from benchmarks.mock_api import MockApi, parse_latencies
+
+
+def test_mock_api_injects_errors():
+    api = MockApi(latencies=parse_latencies(['georef=uniform:0:0.001']), throttle_rate=1.0, retry_after=7).start()
+    try:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(api.url + '/georef?address=Musterstr.%201')
+        assert error.value.code == 429
+        assert error.value.headers['Retry-After'] == '7'
+        with urllib.request.urlopen(api.url + '/stats') as response:
+            assert json.loads(response.read()) == {'georef': 1, 'georef_429': 1}
+    finally:
+        api.stop()
+
+
+def test_benchmark_smoke():
+    (result,) = run.run(run.parse_args(['--rows', '20', '--workers', '4']))
+    assert result['lines_done'] == 20
+    assert result['rows_per_second'] > 0
+    assert result['p50_seconds'] <= result['p99_seconds']
+    # vars, georef, queries and 3 results per line, the details are pulled lazily
+    assert result['requests'] >= 1 + 20 * 5
+    assert result['peak_rss_bytes'] > 0
+
+
+@pytest.mark.parametrize('engine', ['threads', 'asyncio'])
+def test_throttled_lines_get_a_query_id(engine):
+    if engine == 'asyncio':
+        pytest.importorskip('aiohttp')
+    (result,) = run.run(run.parse_args(['--rows', '40', '--workers', '4', '--engine', engine,
+                                        '--throttle-rate', '0.1', '--retry-after', '0']))
+    assert result['injected_errors'] > 0
+    assert result['lines_without_query_id'] == 0
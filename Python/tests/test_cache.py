@@ -0,0 +1,81 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import time
+
+from analystApi import api_basic
+from analystApi.cache import SqliteCache, ResultCache
+
+
+def test_cache_roundtrip(tmp_path):
+    cache = SqliteCache(str(tmp_path / 'cache.sqlite'), table='georef')
+    position = {"lat": 52.5, "lon": 13.3, "precision": "HOUSE", "displayNameDE": "Berlin", "biggerArea": "Berlin"}
+    cache.put('einsteinufer 63a, 10587 berlin', position)
+    assert cache.get('einsteinufer 63a, 10587 berlin') == position
+    assert cache.get('unknown') is None
+    cache.close()
+
+    # Entries survive a restart
+    cache = SqliteCache(str(tmp_path / 'cache.sqlite'), table='georef')
+    assert cache.get('einsteinufer 63a, 10587 berlin') == position
+    cache.purge()
+    assert cache.get('einsteinufer 63a, 10587 berlin') is None
+
+
+def test_cache_ttl(tmp_path):
+    cache = SqliteCache(str(tmp_path / 'cache.sqlite'), ttl=0.01)
+    cache.put('a', 1)
+    time.sleep(0.05)
+    assert cache.get('a') is None
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = SqliteCache(str(tmp_path / 'cache.sqlite'), max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    cache.prune()
+    assert len(cache) == 2
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+
+
+def test_normalize_address():
+    assert api_basic.normalize_address('  Einsteinufer 63a,\n10587   Berlin ') == 'einsteinufer 63a, 10587 berlin'
+
+
+def test_result_cache_is_dropped_on_new_vintage(tmp_path):
+    cache = ResultCache(str(tmp_path / 'results.sqlite'), table='results')
+    cache.check_vintage('2024-03')
+    cache.put('abc/count', 12.0)
+    cache.check_vintage('2024-03')
+    assert cache.get('abc/count') == 12.0
+    cache.check_vintage('2024-04')
+    assert cache.get('abc/count') is None
+
+
+def test_result_cache_keeps_the_vintage_when_full(tmp_path):
+    cache = ResultCache(str(tmp_path / 'results.sqlite'), table='results', ttl=3600, max_entries=2)
+    cache.check_vintage('2024-03')
+    for key in ('a/count', 'b/count', 'c/count'):
+        cache.put(key, 1.0)
+    cache.prune()
+    assert len(cache) == 2
+    cache.close()
+
+    cache = ResultCache(str(tmp_path / 'results.sqlite'), table='results', ttl=3600, max_entries=2)
+    assert cache.get_meta(ResultCache.VINTAGE_KEY) == '2024-03'
+    cache.check_vintage('2024-04')
+    assert len(cache) == 0
+    assert cache.get('c/count') is None
+
+
+def test_result_cache_is_not_used_without_vintage(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path / 'results.sqlite'), table='results')
+    monkeypatch.setattr(api_basic, 'result_cache', cache)
+    api_basic.set_data_vintage('2024-03')
+    assert api_basic.result_cache is cache
+    api_basic.set_data_vintage(None)
+    assert api_basic.result_cache is None
@@ -0,0 +1,79 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import datetime
+import time
+
+from analystApi.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from analystApi.maintenance import MaintenanceSchedule
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, open_seconds=0.05)
+    breaker.record(True)
+    breaker.record(True)
+    breaker.record(False)
+    breaker.record(True)
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    breaker.record(True)
+    assert breaker.state == OPEN
+    assert breaker.check() > 0
+
+
+def test_single_probe_when_half_open():
+    breaker = CircuitBreaker(failure_threshold=1, open_seconds=0.05)
+    breaker.record(True)
+    time.sleep(0.06)
+    assert breaker.check() == 0
+    assert breaker.state == HALF_OPEN
+    assert breaker.check() > 0
+
+    # A failed probe opens the breaker for twice as long
+    breaker.record(True)
+    assert breaker.state == OPEN
+    assert breaker.current_open_seconds == 0.1
+
+    time.sleep(0.11)
+    assert breaker.check() == 0
+    breaker.record(False)
+    assert breaker.state == CLOSED
+    assert breaker.check() == 0
+
+
+def test_cancelled_probe_lets_the_next_caller_probe():
+    breaker = CircuitBreaker(failure_threshold=1, open_seconds=0.05)
+    breaker.record(True)
+    time.sleep(0.06)
+    assert breaker.check() == 0
+    breaker.cancelled()
+    assert breaker.state == OPEN
+    assert breaker.current_open_seconds == 0.05
+    assert breaker.check() == 0
+    assert breaker.state == HALF_OPEN
+
+
+def test_lost_probe_is_replaced():
+    breaker = CircuitBreaker(failure_threshold=1, open_seconds=0.01, max_open_seconds=0.05)
+    breaker.record(True)
+    time.sleep(0.02)
+    # The probe never reports back, e.g. its request was dropped before it was sent
+    assert breaker.check() == 0
+    assert breaker.check() > 0
+    time.sleep(0.06)
+    assert breaker.check() == 0
+    assert breaker.check() > 0
+    breaker.record(False)
+    assert breaker.state == CLOSED
+
+
+def test_maintenance_windows():
+    schedule = MaintenanceSchedule('23:50-00:05, 03:00-03:10')
+    day = datetime.date(2024, 5, 1)
+    assert schedule.seconds_left(datetime.datetime.combine(day, datetime.time(12, 0))) == 0
+    assert schedule.seconds_left(datetime.datetime.combine(day, datetime.time(23, 55))) == 600
+    assert schedule.seconds_left(datetime.datetime.combine(day, datetime.time(0, 4))) == 60
+    assert schedule.seconds_left(datetime.datetime.combine(day, datetime.time(3, 5))) == 300
+    assert schedule.seconds_left(datetime.datetime.combine(day, datetime.time(2, 59)), lead=120) == 660
+    assert MaintenanceSchedule('').windows == []
@@ -0,0 +1,73 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+from collections import OrderedDict
+
+import pytest
+
+from analystApi import api_basic, csv_line
+from analystApi.exceptions import AnalystApiServerError
+
+VARS = {
+    'fl_wohnen': {'key': 'fl_wohnen', 'filterModelName': 'rangeFilter'},
+    'balkon': {'key': 'balkon', 'filterModelName': 'booleanFilter'},
+}
+HEADER = ['ID', 'Adresse', 'Adresse::distance', 'Segment', 'fl_wohnen::von', 'fl_wohnen::bis',
+          'fl_wohnen::includeUNKNOWN', 'balkon::includeTRUE', 'balkon::includeUNKNOWN', 'bogus', 'fl_wohnen::vonbis', 'kommentar']
+
+
+@pytest.fixture
+def documentation(monkeypatch):
+    monkeypatch.setattr(api_basic.client, 'column_documentation', dict(VARS))
+    monkeypatch.setattr(csv_line, 'compiled_headers', {})
+    monkeypatch.setattr(csv_line, 'brokenColumns', [])
+
+
+def test_broken_columns_are_found_in_the_header(documentation):
+    plan = csv_line.compile_header(HEADER)
+    assert [planned.column for planned in plan] == HEADER[:9]
+    assert csv_line.brokenColumns == ['bogus', 'fl_wohnen::vonbis']
+    steps = {planned.column: planned.step for planned in plan}
+    assert steps['fl_wohnen::von'].setter == api_basic.SET_MIN
+    assert steps['fl_wohnen::includeUNKNOWN'].special_key == 'includeunknown'
+    assert steps['balkon::includeTRUE'].special_key == 'includeTrue'
+    assert steps['Adresse::distance'].filter_class is api_basic.peripherySpatialFilter
+
+
+def test_plan_builds_the_same_query_as_add_column(documentation):
+    line = OrderedDict(zip(HEADER, ['4711', 'Brunsstr. 31, 72074 Tübingen', '0.5', 'WHG_K', '60', '120,5', 'f', '1',
+                                    '0', 'x', '', 'Kommentar']))
+    errors = []
+    (isq, entry_id, address_filters) = csv_line.build_search_query(line, errors, defer_georef=True)
+    assert entry_id == '4711'
+    assert errors == []
+    assert address_filters == [isq.filter['Adresse']]
+    address_filters[0].set_position({'lat': 48.5, 'lon': 9.05, 'precision': 'HOUSE', 'displayNameDE': 'Brunsstr. 31',
+                                     'biggerArea': 'Tübingen'})
+
+    expected = api_basic.immobrain_search_query()
+    for column in ['Adresse::distance', 'Segment', 'fl_wohnen::von', 'fl_wohnen::bis', 'fl_wohnen::includeUNKNOWN',
+                   'balkon::includeTRUE', 'balkon::includeUNKNOWN']:
+        expected.add_column(column, line[column])
+    expected.add_filter('Adresse')
+    expected.filter['Adresse'].set_position({'lat': 48.5, 'lon': 9.05, 'precision': 'HOUSE',
+                                             'displayNameDE': 'Brunsstr. 31', 'biggerArea': 'Tübingen'})
+    assert isq.to_query() == expected.to_query()
+    assert csv_line.header_plan(line.keys()) is csv_line.header_plan(HEADER)
+
+
+def test_no_plan_without_documentation(documentation, monkeypatch):
+    monkeypatch.setattr(api_basic.client, 'column_documentation', None)
+
+    def unavailable():
+        raise AnalystApiServerError('/vars is not available')
+
+    monkeypatch.setattr(api_basic, 'load_variable_documentation', unavailable)
+    with pytest.raises(AnalystApiServerError):
+        csv_line.header_plan(HEADER)
+
+    monkeypatch.setattr(api_basic, 'load_variable_documentation', lambda: dict(VARS))
+    plan = csv_line.header_plan(HEADER)
+    assert 'fl_wohnen::von' in [planned.column for planned in plan]
+    assert csv_line.brokenColumns == ['bogus', 'fl_wohnen::vonbis']
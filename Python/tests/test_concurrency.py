@@ -0,0 +1,36 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+from analystApi.concurrency import AdaptiveConcurrencyLimit
+
+
+def saturate(limit, latency, requests):
+    for _ in range(requests):
+        while limit.try_acquire():
+            pass
+        limit.release(latency)
+
+
+def test_limit_grows_while_latency_is_flat():
+    limit = AdaptiveConcurrencyLimit(4, maximum=10, latency_window=10)
+    saturate(limit, 0.1, 200)
+    assert limit.current_limit == 10
+
+
+def test_limit_decreases_on_overload():
+    limit = AdaptiveConcurrencyLimit(8, maximum=10)
+    assert limit.try_acquire()
+    limit.release(0.1, overloaded=True)
+    assert limit.current_limit == 4
+    # only once per cooldown
+    assert limit.try_acquire()
+    limit.release(0.1, overloaded=True)
+    assert limit.current_limit == 4
+
+
+def test_limit_decreases_on_rising_latency():
+    limit = AdaptiveConcurrencyLimit(8, maximum=8, latency_window=10)
+    saturate(limit, 0.1, 10)
+    saturate(limit, 1.0, 10)
+    assert limit.current_limit == 4
@@ -0,0 +1,80 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import asyncio
+import csv
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from analystApi import api_basic, async_engine
+from analystApi.circuit_breaker import CircuitBreaker, HALF_OPEN
+from analystApi.concurrency import AdaptiveConcurrencyLimit
+from benchmarks import run
+from benchmarks.mock_api import MockApi, parse_latencies
+
+pytest.importorskip('aiohttp')
+
+
+def execute(tmp_path, url, engine):
+    """Run csv_transform with empty caches, returns the output rows without the QUERY-ID sorted by ID"""
+    directory = tmp_path / engine
+    home = directory / 'home'
+    os.makedirs(home)
+    input_file = str(directory / 'input.csv')
+    run.generate_input(input_file, 40, addresses=25)
+    # A line whose address cannot be georeferenced
+    with open(input_file, 'a', newline='') as f:
+        csv.writer(f).writerow(['R-unknown', 'Pfefferweg 1, 10000 Berlin', 'WHG_K', '', '', '', '', '', ''])
+    run.write_login(str(home), url, 4, run.DEFAULT_VALUES_TO_ADD, [])
+    environment = dict(os.environ, HOME=str(home), PYTHONPATH=run.PACKAGE_DIRECTORY)
+    subprocess.run([sys.executable, '-m', 'analystApi.csv_transform', '--engine', engine, input_file],
+                   cwd=run.PACKAGE_DIRECTORY, env=environment, check=True, capture_output=True)
+    with open(str(directory / 'input_executed.csv'), newline='') as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        # IDs are handed out by the mock API in the order the queries arrive
+        del row['QUERY-ID']
+    return sorted(rows, key=lambda row: row['ID'])
+
+
+def test_threads_and_asyncio_write_the_same_rows(tmp_path):
+    api = MockApi(latencies=parse_latencies(['uniform:0:0.005']), seed=1).start()
+    try:
+        threads = execute(tmp_path, api.url, 'threads')
+        asyncio_rows = execute(tmp_path, api.url, 'asyncio')
+    finally:
+        api.stop()
+    assert len(threads) == 41
+    assert asyncio_rows == threads
+    assert all(row['count'] for row in threads if row['ID'] != 'R-unknown')
+
+
+def test_probe_cancelled_while_waiting_for_a_slot(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, open_seconds=0.01)
+    breaker.record(True)
+    time.sleep(0.02)
+    limit = AdaptiveConcurrencyLimit(1, maximum=1)
+    assert limit.try_acquire()
+    for (name, value) in (('circuit_breaker', breaker), ('concurrency_limit', limit), ('rate_limiter', None),
+                          ('maintenance', None), ('metrics', None), ('progress', None)):
+        monkeypatch.setattr(api_basic, name, value)
+
+    async def run():
+        monkeypatch.setattr(async_engine, 'limit_condition', asyncio.Condition())
+        probe = asyncio.ensure_future(async_engine.request(None, 'results', 'GET', '/results/4711/count'))
+        await asyncio.sleep(0.01)
+        # The probe got through the breaker and waits for the slot
+        assert breaker.state == HALF_OPEN
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    asyncio.run(run())
+    # The next caller probes instead of waiting for the cancelled one
+    assert breaker.check() == 0
+    assert breaker.state == HALF_OPEN
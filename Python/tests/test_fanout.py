@@ -0,0 +1,90 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from analystApi import csv_transform
+from analystApi.csv_line import order_values
+from analystApi.exceptions import QueryMissingOrInvalidParameter
+
+
+class FakeQuery:
+    def __init__(self, count=10, fail=(), lazy_details=False):
+        self.id = '4711'
+        self.data = {}
+        self.details = None
+        self.lazy_details = lazy_details
+        self.details_pulled = 0
+        self.count = count
+        self.fail = fail
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def collect(self, value):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.05)
+        with self.lock:
+            self.in_flight -= 1
+        if value in self.fail:
+            raise QueryMissingOrInvalidParameter(f"{value} failed")
+        self.data[value] = self.count if value == 'count' else 1.0
+
+    def details_missing(self):
+        return self.lazy_details and self.details is None
+
+    def pull_details_for_query(self):
+        self.collect('details')
+        self.details_pulled += 1
+        self.details = {'peripherySpatialFilter': None}
+
+
+def collect(isq, values, row_fanout):
+    errors = []
+    csv_transform.row_fanout = row_fanout
+    csv_transform.fanout_executor = ThreadPoolExecutor(max_workers=8)
+    try:
+        csv_transform.collect_values(isq, 'ID', values, errors)
+    finally:
+        csv_transform.fanout_executor.shutdown()
+        csv_transform.fanout_executor = None
+    return errors
+
+
+def test_order_values():
+    assert order_values(['a', 'count', 'b']) == ['count', 'a', 'b']
+    assert order_values(['a', 'b']) == ['a', 'b']
+
+
+def test_values_are_collected_concurrently():
+    isq = FakeQuery()
+    assert collect(isq, ['a', 'b', 'count', 'c', 'd'], 2) == []
+    assert set(isq.data) == {'count', 'a', 'b', 'c', 'd'}
+    assert isq.max_in_flight == 2
+
+
+def test_lazy_details_are_pulled_with_the_values():
+    isq = FakeQuery(lazy_details=True)
+    assert collect(isq, ['count', 'a', 'b'], 4) == []
+    assert isq.details_pulled == 1
+    assert isq.max_in_flight == 3
+    csv_transform.pull_missing_details(isq, 'ID')
+    assert isq.details_pulled == 1
+
+
+def test_no_values_after_count_0():
+    isq = FakeQuery(count=0)
+    assert collect(isq, ['a', 'count', 'b'], 4) == []
+    assert isq.data == {'count': 0}
+
+
+def test_first_error_stops_the_line():
+    isq = FakeQuery(fail=('a',))
+    errors = collect(isq, ['count', 'a', 'b', 'c', 'd'], 1)
+    assert [str(e) for e in errors] == ['a failed']
+    assert 'c' not in isq.data and 'd' not in isq.data
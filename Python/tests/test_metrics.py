@@ -0,0 +1,47 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import urllib.request
+
+from analystApi.metrics import Metrics, MetricsExport
+
+
+def filled_metrics():
+    metrics = Metrics()
+    metrics.observe_response('results', 200, 0.08, 0, 120)
+    metrics.observe_response('results', 200, 0.1, 0, 80)
+    metrics.observe_response('results', 404, 3.0, 0, 20)
+    metrics.observe_error('georef', ConnectionError('reset'), 0.5)
+    metrics.observe_wait('results', 1.5)
+    metrics.count_retry('get_position', 'fast')
+    return metrics
+
+
+def test_render_prometheus_text():
+    lines = filled_metrics().render().splitlines()
+    assert 'analyst_api_request_duration_seconds_bucket{endpoint="results",le="0.05"} 0' in lines
+    assert 'analyst_api_request_duration_seconds_bucket{endpoint="results",le="0.1"} 2' in lines
+    assert 'analyst_api_request_duration_seconds_bucket{endpoint="results",le="+Inf"} 3' in lines
+    assert 'analyst_api_request_duration_seconds_count{endpoint="results"} 3' in lines
+    assert 'analyst_api_responses_total{endpoint="results",status="200"} 2' in lines
+    assert 'analyst_api_responses_total{endpoint="results",status="404"} 1' in lines
+    assert 'analyst_api_request_errors_total{endpoint="georef",error="ConnectionError"} 1' in lines
+    assert 'analyst_api_retries_total{function="get_position",kind="fast"} 1' in lines
+    assert 'analyst_api_wait_seconds_total{endpoint="results"} 1.5' in lines
+    assert 'analyst_api_received_bytes_total{endpoint="results"} 220' in lines
+    assert '# TYPE analyst_api_request_duration_seconds histogram' in lines
+
+
+def test_export_to_file_and_port(tmp_path):
+    metrics = filled_metrics()
+    filename = str(tmp_path / 'analyst.prom')
+    export = MetricsExport(metrics, filename, port=0, interval=3600)
+    try:
+        port = export.server.server_address[1]
+        with urllib.request.urlopen(f'http://localhost:{port}/metrics') as response:
+            assert response.read().decode('utf-8') == metrics.render()
+    finally:
+        export.close()
+    with open(filename) as f:
+        assert f.read() == metrics.render()
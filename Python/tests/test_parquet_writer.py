@@ -0,0 +1,38 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import datetime
+
+import pytest
+
+from analystApi.parquet_writer import ParquetWriter, pyarrow
+from analystApi.psql_writer import RESULT_COLUMNS
+
+COLUMN_TYPES = [('id', 'text NOT NULL'), ('fl_wohnen::von', 'numeric'), ('baujahr', 'integer'),
+                ('fl_wohnen::includeunknown', 'boolean'), ('datum', 'date')] + RESULT_COLUMNS + [('count', 'numeric')]
+FIELDNAMES = ['ID', 'fl_wohnen::von', 'baujahr', 'fl_wohnen::includeUNKNOWN', 'datum', '--RESULTS--', 'QUERY-ID',
+              'distance_used', 'precision', 'query', 'count']
+
+
+@pytest.mark.skipif(pyarrow is None, reason='requires pyarrow')
+def test_typed_row_groups(tmp_path):
+    filename = str(tmp_path / 'out.parquet')
+    writer = ParquetWriter(filename, COLUMN_TYPES, FIELDNAMES, flush_rows=2)
+    writer.writeheader()
+    for i in range(5):
+        writer.writerow({'ID': f'R{i}', 'fl_wohnen::von': '60', 'baujahr': '1920' if i else 'alt',
+                         'fl_wohnen::includeUNKNOWN': 't', 'datum': '2020-01-31', 'QUERY-ID': 4711 + i,
+                         'distance_used': 0.2, 'precision': 'HOUSE', 'query': '{\n    "segment": "WHG_K"\n}',
+                         'count': float(i) if i else None})
+    writer.close()
+
+    assert pyarrow.parquet.ParquetFile(filename).num_row_groups == 3
+    rows = pyarrow.parquet.read_table(filename).to_pylist()
+    assert len(rows) == 5
+    assert rows[1] == {'ID': 'R1', 'fl_wohnen::von': 60.0, 'baujahr': 1920, 'fl_wohnen::includeUNKNOWN': True,
+                       'datum': datetime.date(2020, 1, 31), '--RESULTS--': None, 'QUERY-ID': 4712,
+                       'distance_used': 0.2, 'precision': 'HOUSE', 'query': '{"segment":"WHG_K"}', 'count': 1.0}
+    # Values not fitting their column are null
+    assert rows[0]['baujahr'] is None
+    assert rows[0]['count'] is None
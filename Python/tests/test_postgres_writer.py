@@ -0,0 +1,130 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import csv
+import io
+import os
+
+import pytest
+
+from analystApi.postgres_writer import PostgresWriter, create_table_statement, upsert_statement, psycopg2
+from analystApi.psql_writer import RESULT_COLUMNS
+
+# e.g. "dbname=test", the table test_streaming is dropped and created there
+TEST_DSN = os.environ.get('ANALYST_API_TEST_POSTGRES')
+
+COLUMN_TYPES = [('id', 'text NOT NULL'), ('adresse', 'text NOT NULL'), ('fl_wohnen::von', 'numeric')] + \
+    RESULT_COLUMNS + [('count', 'numeric')]
+FIELDNAMES = ['ID', 'Adresse', 'fl_wohnen::von', '--RESULTS--', 'QUERY-ID', 'distance_used', 'precision', 'query',
+              'count']
+
+
+def test_statements():
+    create = create_table_statement('results', COLUMN_TYPES)
+    assert '"fl_wohnen::von" numeric,' in create
+    assert 'PRIMARY KEY ("id")' in create
+
+    upsert = upsert_statement('results', [name for (name, _) in COLUMN_TYPES])
+    assert 'ON CONFLICT ("id") DO UPDATE SET "adresse" = EXCLUDED."adresse"' in upsert
+    assert '"id" = EXCLUDED' not in upsert
+
+
+@pytest.mark.skipif(TEST_DSN is None or psycopg2 is None, reason='set ANALYST_API_TEST_POSTGRES to a database')
+def test_rows_are_upserted():
+    with psycopg2.connect(TEST_DSN) as connection, connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS test_streaming')
+
+    def row(entry_id, count, adresse='Brunsstr. 31, 72074 Tübingen'):
+        return {'ID': entry_id, 'Adresse': adresse, 'fl_wohnen::von': '60', '--RESULTS--': '', 'QUERY-ID': 4711,
+                'distance_used': 0.2, 'precision': 'HOUSE', 'query': '{\n    "segment": "WHG_K"\n}', 'count': count}
+
+    writer = PostgresWriter(TEST_DSN, 'test_streaming', COLUMN_TYPES, FIELDNAMES, flush_rows=2)
+    writer.writeheader()
+    writer.writerows([row('1', 10.0), row('2', 0.0), row('1', 12.0), row('3', 1.0, adresse=None)])
+    writer.close()
+
+    with psycopg2.connect(TEST_DSN) as connection, connection.cursor() as cursor:
+        cursor.execute('SELECT id, count, query::text FROM test_streaming ORDER BY id')
+        assert cursor.fetchall() == [('1', 12, '{\n    "segment": "WHG_K"\n}'), ('2', 0, '{\n    "segment": "WHG_K"\n}')]
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, statement):
+        pass
+
+    def fetchone(self):
+        return (None,)
+
+    def copy_expert(self, statement, file):
+        if self.connection.error is not None:
+            raise self.connection.error
+        rows = list(csv.reader(io.StringIO(file.read())))
+        if any(row[2] == 'invalid' for row in rows):
+            raise psycopg2.DataError('invalid input syntax for type numeric: "invalid"')
+        self.connection.staged += rows
+
+
+class FakeConnection:
+    """Takes the copied rows without a database, fails rows with fl_wohnen::von 'invalid' or every copy with error"""
+
+    def __init__(self):
+        self.error = None
+        self.staged = []
+        self.rows = []
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.rows += self.staged
+        self.staged = []
+
+    def rollback(self):
+        self.staged = []
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    if psycopg2 is None:
+        pytest.skip('psycopg2 is not installed')
+    connection = FakeConnection()
+    monkeypatch.setattr(psycopg2, 'connect', lambda dsn: connection)
+    return connection
+
+
+def fake_row(entry_id, fl_wohnen='60'):
+    return {'ID': entry_id, 'Adresse': 'Brunsstr. 31, 72074 Tübingen', 'fl_wohnen::von': fl_wohnen}
+
+
+def test_invalid_rows_are_left_out(connection):
+    writer = PostgresWriter('dbname=fake', 'results', COLUMN_TYPES, FIELDNAMES, flush_rows=3)
+    writer.writerows([fake_row('1'), fake_row('2', fl_wohnen='invalid'), fake_row('3'), fake_row('4')])
+    writer.close()
+    assert [row[0] for row in connection.rows] == ['1', '3', '4']
+    assert connection.closed
+
+
+def test_lost_connection_stops_the_writer(connection):
+    writer = PostgresWriter('dbname=fake', 'results', COLUMN_TYPES, FIELDNAMES, flush_rows=1)
+    writer.writerow(fake_row('1'))
+    writer.checkpoint()
+    connection.error = psycopg2.OperationalError('server closed the connection unexpectedly')
+    writer.writerow(fake_row('2'))
+    with pytest.raises(Exception, match='server closed the connection'):
+        writer.close()
+    assert [row[0] for row in connection.rows] == ['1']
+    assert connection.closed
@@ -0,0 +1,90 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from analystApi import profiling
+
+
+@pytest.fixture
+def profile():
+    profiling.profile = profiling.Profile(interval=0.001).start()
+    yield profiling.profile
+    profiling.profile.stop()
+    profiling.profile = None
+
+
+def busy(seconds):
+    end = time.thread_time() + seconds
+    while time.thread_time() < end:
+        pass
+
+
+@profiling.phased('collect')
+def collect():
+    busy(0.02)
+    create_query()
+
+
+@profiling.phased('create query')
+def create_query():
+    time.sleep(0.05)
+
+
+def test_nested_phases_are_counted_once(profile):
+    collect()
+    (collected, created) = (profile.phases['collect'], profile.phases['create query'])
+    assert (collected.calls, created.calls) == (1, 1)
+    assert created.seconds >= 0.05
+    assert collected.seconds < 0.05
+    assert collected.cpu_seconds >= 0.02
+    assert created.cpu_seconds < 0.01
+
+
+def test_coroutine_phases_measure_the_wall_clock(profile):
+    @profiling.phased('georef')
+    async def georef():
+        await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(georef(), georef())
+
+    asyncio.run(run())
+    stats = profile.phases['georef']
+    assert stats.calls == 2
+    assert stats.seconds >= 0.02
+    assert stats.cpu_seconds is None
+
+
+def test_timed_iteration(profile):
+    assert list(profiling.timed(iter('abc'), 'csv parse')) == ['a', 'b', 'c']
+    # One more step finds the end
+    assert profile.phases['csv parse'].calls == 4
+
+
+def test_no_phases_without_profile():
+    assert profiling.profile is None
+    collect()
+    with profiling.phase('json encode') as phase:
+        assert phase is None
+
+
+def test_folded_stacks_and_summary(profile, tmp_path):
+    worker = threading.Thread(target=collect, name='ThreadPoolExecutor-0_1')
+    worker.start()
+    worker.join()
+    profile.stop()
+    profile.write_folded(tmp_path / 'profile.folded')
+    lines = (tmp_path / 'profile.folded').read_text().splitlines()
+    assert lines
+    for line in lines:
+        (stack, weight) = line.rsplit(' ', 1)
+        assert int(weight) > 0
+    assert any(line.startswith('ThreadPoolExecutor;') and 'busy (' in line for line in lines)
+    summary = profile.summary()
+    assert 'collect' in summary and 'create query' in summary and 'busy (' in summary
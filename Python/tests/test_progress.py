@@ -0,0 +1,79 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import json
+import socket
+
+from analystApi import api_basic
+from analystApi.concurrency import AdaptiveConcurrencyLimit
+from analystApi.csv_line import ExecutionResult
+from analystApi.exceptions import GeorefOffline
+from analystApi.progress import Progress, ProgressReport, describe
+from analystApi.retry import RetryPolicy, SLOW
+
+
+def test_counts_rates_and_errors():
+    progress = Progress(10)
+    progress.line_done(ExecutionResult('1', 7, True, 0.1))
+    progress.line_done(ExecutionResult('2', 8, False, 0.1, 'GeorefNotFound'))
+    progress.line_done(ExecutionResult('', 0, False, error='KeyError'))
+    progress.line_done(ExecutionResult('4', 9, False, 0.1, 'GeorefNotFound'))
+    progress.request_started()
+    snapshot = progress.snapshot()
+    assert (snapshot['done'], snapshot['success'], snapshot['failed']) == (4, 1, 3)
+    assert snapshot['errors'] == {'GeorefNotFound': 2, 'KeyError': 1}
+    assert snapshot['in_flight_requests'] == 1
+    assert snapshot['concurrency_limit'] is None
+    assert snapshot['rows_per_second'] > 0
+    assert snapshot['eta_seconds'] is not None
+    # Nothing done since the last snapshot
+    assert progress.snapshot()['rows_per_second'] == 0
+    assert 'errors: GeorefNotFound 2, KeyError 1' in describe(snapshot)
+    assert 'concurrency limit' not in describe(snapshot)
+
+
+def test_concurrency_limit_is_reported():
+    limit = AdaptiveConcurrencyLimit(8, maximum=16, decrease_factor=0.5)
+    progress = Progress(10, limit)
+    snapshot = progress.snapshot()
+    assert snapshot['concurrency_limit'] == 8
+    assert 'concurrency limit: 8' in describe(snapshot)
+    assert limit.try_acquire()
+    limit.release(0.1, overloaded=True)
+    assert progress.snapshot()['concurrency_limit'] == 4
+
+
+def test_retries_are_counted(monkeypatch):
+    progress = Progress(1)
+    monkeypatch.setattr(api_basic, 'progress', progress)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise GeorefOffline("down")
+        return 'ok'
+
+    assert api_basic.call_with_retries(flaky, policy=RetryPolicy(delays={SLOW: (0.001, 0.001)})) == 'ok'
+    assert progress.snapshot()['retries'] == {SLOW: 2}
+
+
+def test_report_to_file_and_port(tmp_path):
+    progress = Progress(2)
+    filename = tmp_path / 'progress.jsonl'
+    logged = []
+    report = ProgressReport(progress, str(filename), port=0, interval=3600, log=logged.append)
+    try:
+        progress.line_done(ExecutionResult('1', 7, True, 0.1))
+        report.report()
+        with socket.create_connection(('localhost', report.port)) as connection:
+            latest = json.loads(connection.makefile().readline())
+        assert (latest['done'], latest['total'], latest['final']) == (1, 2, False)
+        assert latest['concurrency_limit'] is None
+    finally:
+        report.close()
+    lines = [json.loads(line) for line in filename.read_text().splitlines()]
+    assert [line['final'] for line in lines] == [False, True]
+    # Only the final snapshot is logged within the log interval
+    assert [snapshot['final'] for snapshot in logged] == [True]
@@ -0,0 +1,58 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import pytest
+
+from analystApi import api_basic
+
+VARS = {
+    'fl_wohnen': {'key': 'fl_wohnen', 'filterModelName': 'rangeFilter'},
+    'balkon': {'key': 'balkon', 'filterModelName': 'booleanFilter'},
+}
+POSITION = {'lat': 48.5, 'lon': 9.05, 'precision': 'HOUSE', 'displayNameDE': 'Brunsstr. 31', 'biggerArea': 'Tübingen'}
+
+
+@pytest.fixture
+def isq(monkeypatch):
+    monkeypatch.setattr(api_basic.client, 'column_documentation', dict(VARS))
+    isq = api_basic.immobrain_search_query()
+    isq.add_column('Segment', 'WHG_K')
+    isq.add_column('fl_wohnen::von', '60')
+    isq.add_filter('Adresse')
+    isq.filter['Adresse'].set_position(POSITION)
+    return isq
+
+
+def test_query_is_built_once(isq):
+    query = isq.to_query()
+    assert isq.to_query() is query
+    assert isq.get_query_hash() == api_basic.query_hash(query)
+
+
+def test_changed_filter_builds_the_query_again(isq):
+    query = isq.to_query()
+    key = isq.get_query_hash()
+    isq.add_column('fl_wohnen::bis', '120')
+    assert isq.to_query() is not query
+    assert isq.to_query()['rangeFilters'] == [{'var': 'fl_wohnen', 'includeUnknown': False,
+                                               'minValue': '60', 'maxValue': '120'}]
+    assert isq.get_query_hash() != key
+
+    isq.filter['Adresse'].set_position(dict(POSITION, lat=48.6))
+    assert isq.to_query()['peripherySpatialFilter']['coordinate']['lat'] == 48.6
+
+    isq.add_column('Adresse::distance', '0.5')
+    assert isq.to_query()['peripherySpatialFilter']['distance'] == '0.5'
+
+
+def test_new_filter_builds_the_query_again(isq):
+    isq.to_query()
+    isq.add_column('balkon::includeTRUE', '1')
+    assert isq.to_query()['yesNoFilters'] == [{'var': 'balkon', 'includeUnknown': False, 'includeTrue': True}]
+
+
+def test_filters_have_no_dict(isq):
+    for filter_ in isq.filter.values():
+        assert not hasattr(filter_, '__dict__')
+    assert not hasattr(isq, '__dict__')
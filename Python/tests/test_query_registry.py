@@ -0,0 +1,107 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import datetime
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from analystApi import api_basic
+from analystApi.cache import SqliteCache
+from analystApi.exceptions import AnalystApiServerError
+
+QUERY = {'segment': 'WHG_K'}
+
+
+class FakeApi:
+    """Answers /queries with new IDs and /results with the given status codes, the last one repeats"""
+
+    def __init__(self, results_status):
+        self.results_status = list(results_status)
+        self.created = []
+        self.results = []
+
+    def request(self, name, method, path, **kwargs):
+        if name == 'queries':
+            query_id = 8000 + len(self.created)
+            self.created.append(query_id)
+            return response(201, {'queryId': query_id})
+        self.results.append(path)
+        status = self.results_status.pop(0) if len(self.results_status) > 1 else self.results_status[0]
+        return response(status, {'value': 42} if status < 300 else {'error': 'failed'})
+
+
+def response(status, body):
+    return SimpleNamespace(status_code=status, text=json.dumps(body), url='http://api', elapsed=datetime.timedelta())
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    cache = SqliteCache(str(tmp_path / 'queries.sqlite'), table='queries')
+    monkeypatch.setattr(api_basic, 'query_registry', cache)
+    monkeypatch.setattr(api_basic, 'result_cache', None)
+    monkeypatch.setattr(api_basic, 'details_mode', api_basic.DETAILS_LAZY)
+    monkeypatch.setattr(api_basic.immobrain_search_query, 'to_query', lambda self: QUERY)
+    yield cache
+    cache.close()
+
+
+def use_api(monkeypatch, results_status):
+    api = FakeApi(results_status)
+    monkeypatch.setattr(api_basic, 'api_request', api.request)
+    return api
+
+
+def registered_query(registry, query_id=7000):
+    isq = api_basic.immobrain_search_query()
+    registry.put(isq.get_query_hash(), {'meta_data': {'queryId': query_id}, 'details': None})
+    return isq
+
+
+def test_registry_hit_needs_no_query(registry, monkeypatch):
+    api = use_api(monkeypatch, [200])
+    isq = registered_query(registry)
+    isq.collect('count')
+    assert (isq.id, isq.from_registry, isq.data) == (7000, True, {'count': 42})
+    assert api.created == []
+
+
+def test_expired_registry_id_is_created_once(registry, monkeypatch):
+    api = use_api(monkeypatch, [404, 200])
+    isq = registered_query(registry)
+    isq.collect('count')
+    assert api.created == [8000]
+    assert (isq.id, isq.from_registry, isq.data) == (8000, False, {'count': 42})
+    assert registry.get(isq.get_query_hash())['meta_data'] == {'queryId': 8000}
+
+
+def test_rejected_new_query_is_not_created_again(registry, monkeypatch):
+    api = use_api(monkeypatch, [404])
+    isq = registered_query(registry)
+    isq.collect('count')
+    # The registered ID and the new one were rejected, there is no third try
+    assert api.created == [8000]
+    assert len(api.results) == 2
+    assert isq.data == {}
+
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_outage_does_not_expire_the_registry(registry, monkeypatch, status):
+    api = use_api(monkeypatch, [status])
+    isq = registered_query(registry)
+    with pytest.raises(AnalystApiServerError):
+        isq.collect('count')
+    assert api.created == []
+    assert registry.get(isq.get_query_hash())['meta_data'] == {'queryId': 7000}
+
+
+def test_outage_after_creating_the_query(registry, monkeypatch):
+    api = use_api(monkeypatch, [503])
+    isq = api_basic.immobrain_search_query()
+    isq.generate_id(use_registry=False)
+    assert not isq.from_registry
+    with pytest.raises(AnalystApiServerError):
+        isq.collect('count')
+    assert api.created == [8000]
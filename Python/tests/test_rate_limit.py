@@ -0,0 +1,159 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import datetime
+import email.utils
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from analystApi import api_basic, rate_limit
+from analystApi.exceptions import QueryLimitReached
+from analystApi.rate_limit import RateLimiter, TokenBucket, parse_retry_after
+from analystApi.retry import RetryPolicy, SLOW
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+        self.wall = 1700000000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.wall
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        self.now += seconds
+        self.wall += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, 'time', clock)
+    return clock
+
+
+def test_steady_rate_spaces_requests(clock):
+    bucket = TokenBucket(10, 1)
+    # Waiting callers are served in order, one every 0.1 seconds
+    assert [bucket.reserve() for _ in range(3)] == pytest.approx([0.0, 0.1, 0.2])
+    clock.advance(0.2)
+    assert bucket.reserve() == pytest.approx(0.1)
+    clock.advance(1.0)
+    assert bucket.reserve() == 0.0
+
+
+def test_burst_capacity(clock):
+    limiter = RateLimiter({'queries': 5}, burst_seconds=2)
+    # Details share the budget of the queries
+    assert [limiter.reserve('queries' if i % 2 else 'details') for i in range(10)] == [0.0] * 10
+    assert limiter.reserve('queries') == pytest.approx(0.2)
+    assert limiter.reserve('georef') == 0.0
+
+
+def test_acquire_sleeps(clock):
+    limiter = RateLimiter({'georef': 2})
+    limiter.acquire('georef')
+    limiter.acquire('georef')
+    assert limiter.acquire('georef') == pytest.approx(0.5)
+    assert clock.now == pytest.approx(1000.5)
+
+
+@pytest.mark.parametrize('rates', [{}, {'results': None}, {'results': 0}])
+def test_unlimited_budgets(clock, rates):
+    limiter = RateLimiter(rates)
+    assert [limiter.reserve('results') for _ in range(1000)] == [0.0] * 1000
+    assert limiter.reserve('unknown') == 0.0
+
+
+def test_retry_after_seconds_blocks(clock):
+    limiter = RateLimiter({'results': 10})
+    limiter.retry_after('results', '3')
+    assert limiter.reserve('results') == pytest.approx(3.1)
+    assert limiter.reserve('queries') == 0.0
+    clock.advance(3.1)
+    assert limiter.reserve('results') == pytest.approx(0.1)
+
+
+def test_retry_after_date_blocks_unlimited_budget(clock):
+    limiter = RateLimiter({})
+    limiter.retry_after('details', email.utils.formatdate(clock.wall + 30, usegmt=True))
+    assert limiter.reserve('queries') == pytest.approx(30)
+    assert limiter.reserve('queries') == pytest.approx(30)
+    clock.advance(30.5)
+    assert limiter.reserve('queries') == 0.0
+
+
+def test_shorter_retry_after_does_not_shorten_a_block(clock):
+    limiter = RateLimiter({})
+    limiter.retry_after('georef', '10')
+    limiter.retry_after('georef', '2')
+    assert limiter.reserve('georef') == pytest.approx(10)
+
+
+def test_parse_retry_after(clock):
+    assert parse_retry_after('120') == 120.0
+    assert parse_retry_after('1.5') == 1.5
+    assert parse_retry_after('-5') == 0.0
+    assert parse_retry_after(email.utils.formatdate(clock.wall + 60, usegmt=True)) == pytest.approx(60)
+    # A date in the past
+    assert parse_retry_after(email.utils.formatdate(clock.wall - 60, usegmt=True)) == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('') is None
+    assert parse_retry_after('soon') is None
+
+
+class FakeSession:
+    """Answers the requests with the given (status, body, headers) in turn"""
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        (status, body, headers) = self.answers.pop(0)
+        text = json.dumps(body)
+        return SimpleNamespace(status_code=status, text=text, content=text.encode('utf-8'), headers=headers,
+                               url=url, elapsed=datetime.timedelta(), encoding=None)
+
+
+@pytest.fixture
+def api(monkeypatch):
+    client = api_basic.AnalystApiClient(endpoint='http://api')
+    (client.mounted, client.connections) = (True, threading.BoundedSemaphore(4))
+    monkeypatch.setattr(api_basic, 'client', client)
+    for name in ('query_registry', 'result_cache', 'circuit_breaker', 'concurrency_limit', 'maintenance', 'metrics',
+                 'progress'):
+        monkeypatch.setattr(api_basic, name, None)
+    monkeypatch.setattr(api_basic, 'rate_limiter', RateLimiter({}))
+    monkeypatch.setattr(api_basic, 'details_mode', api_basic.DETAILS_LAZY)
+    monkeypatch.setattr(api_basic.immobrain_search_query, 'to_query', lambda self: {'segment': 'WHG_K'})
+    return client
+
+
+def test_throttled_requests_are_sent_again(api):
+    throttled = (429, {'error': 'Too many requests'}, {'Retry-After': '0'})
+    api.session = FakeSession([throttled, (201, {'queryId': 4711}, {}), throttled, (200, {'value': 42}, {})])
+    isq = api_basic.immobrain_search_query()
+    api_basic.call_with_retries(isq.collect, 'count', policy=RetryPolicy(delays={SLOW: (0.001, 0.001)}))
+    assert (isq.id, isq.data) == (4711, {'count': 42})
+    assert [method for (method, _) in api.session.requests] == ['POST', 'POST', 'GET', 'GET']
+
+
+def test_license_limit_is_not_retried(api):
+    # Without Retry-After a 429 of /queries is the yearly limit of the license
+    api.session = FakeSession([(429, {'error': 'Limit reached'}, {})])
+    isq = api_basic.immobrain_search_query()
+    with pytest.raises(QueryLimitReached):
+        api_basic.call_with_retries(isq.collect, 'count', policy=RetryPolicy(delays={SLOW: (0.001, 0.001)}))
+    assert len(api.session.requests) == 1
@@ -0,0 +1,95 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import csv
+import io
+import os
+from collections import Counter
+
+import pytest
+
+from analystApi.batching_dictwriter import BatchingDictWriter
+from analystApi.csv_transform import load_completed_lines, select_lines
+
+INPUT_FIELDNAMES = ['ID', 'Adresse']
+FIELDNAMES = INPUT_FIELDNAMES + ['--RESULTS--', 'QUERY-ID', 'query', 'count']
+
+
+def row(i, query_id='7000', address='Brunsstr. 31, 72074 Tübingen'):
+    return {'ID': str(i), 'Adresse': address, '--RESULTS--': '', 'QUERY-ID': query_id,
+            'query': '{\n    "segment": "WHG_M"\n}', 'count': str(10 * i)}
+
+
+def completed(*rows):
+    return Counter(tuple(row[name] for name in INPUT_FIELDNAMES) for row in rows)
+
+
+def write_output(filename, rows, cut=0):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDNAMES, delimiter=',')
+    writer.writeheader()
+    writer.writerows(rows)
+    data = buffer.getvalue()
+    with open(filename, 'w', newline='') as f:
+        f.write(data[:len(data) - cut])
+
+
+def read_output(filename):
+    with open(filename, newline='') as f:
+        return list(csv.DictReader(f, delimiter=','))
+
+
+def test_lines_without_query_id_are_removed(tmp_path):
+    filename = str(tmp_path / 'in_executed.csv')
+    write_output(filename, [row(1), row(2, query_id=''), row(3)])
+    assert load_completed_lines(filename, FIELDNAMES, INPUT_FIELDNAMES) == completed(row(1), row(3))
+    assert read_output(filename) == [row(1), row(3)]
+    assert not os.path.exists(filename + '.resume')
+
+
+@pytest.mark.parametrize('cut', [2, 3, 20])
+def test_truncated_last_line_is_removed(tmp_path, cut):
+    # Cut off within the line break, within the last field and within the multi-line query
+    filename = str(tmp_path / 'in_executed.csv')
+    write_output(filename, [row(1), row(2)], cut=cut)
+    assert load_completed_lines(filename, FIELDNAMES, INPUT_FIELDNAMES) == completed(row(1))
+    assert read_output(filename) == [row(1)]
+
+
+def test_mismatched_header_is_refused(tmp_path):
+    filename = str(tmp_path / 'in_executed.csv')
+    write_output(filename, [row(1)])
+    with open(filename, newline='') as f:
+        before = f.read()
+    with pytest.raises(Exception, match='Cannot resume'):
+        load_completed_lines(filename, FIELDNAMES + ['price'], INPUT_FIELDNAMES)
+    with open(filename, newline='') as f:
+        assert f.read() == before
+    assert not os.path.exists(filename + '.resume')
+
+
+def test_rows_are_appended_after_resume(tmp_path):
+    filename = str(tmp_path / 'in_executed.csv')
+    write_output(filename, [row(1), row(2, query_id=''), row(3)], cut=5)
+    assert load_completed_lines(filename, FIELDNAMES, INPUT_FIELDNAMES) == completed(row(1))
+    # As csv_transform continues the output file
+    with open(filename, 'a') as f:
+        writer = BatchingDictWriter(f, fieldnames=FIELDNAMES, delimiter=',')
+        writer.writerows([row(2), row(3)])
+        writer.close()
+    assert read_output(filename) == [row(1), row(2), row(3)]
+
+
+def test_lines_with_the_same_id_are_resumed(tmp_path):
+    filename = str(tmp_path / 'in_executed.csv')
+    other_address = 'Einsteinufer 63a, 10587 Berlin'
+    # ID 1 is in the input three times, two of its lines were done
+    write_output(filename, [row(1), row(2, query_id=''), row(1, address=other_address)])
+    completed_lines = load_completed_lines(filename, FIELDNAMES, INPUT_FIELDNAMES)
+    lines = [{'ID': '1', 'Adresse': row(1)['Adresse']}, {'ID': '2', 'Adresse': row(2)['Adresse']},
+             {'ID': '1', 'Adresse': other_address}, {'ID': '1', 'Adresse': row(1)['Adresse']}]
+    # Every pass over the input, e.g. counting and executing, selects the same lines
+    for _ in range(2):
+        selected = select_lines('ID', INPUT_FIELDNAMES, completed_lines)
+        assert [line for line in lines if selected(line)] == lines[1:2] + lines[3:]
@@ -0,0 +1,72 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import random
+
+import pytest
+import requests
+
+from analystApi import api_basic
+from analystApi.exceptions import AnalystApiThrottled, GeorefOffline, QueryLimitReached, \
+    QueryMissingOrInvalidParameter
+from analystApi.retry import RetryPolicy, RetryBudget, FAST, SLOW, THROTTLED, NEVER, DEFAULT
+
+
+def test_classify():
+    policy = RetryPolicy()
+    assert policy.classify(GeorefOffline("down")) == SLOW
+    assert policy.classify(QueryMissingOrInvalidParameter("bad")) == NEVER
+    assert policy.classify(requests.exceptions.ConnectionError()) == FAST
+    assert policy.classify(ConnectionResetError()) == FAST
+    assert policy.classify(requests.exceptions.ReadTimeout()) == DEFAULT
+    assert policy.classify(RecursionError()) == NEVER
+
+
+def test_delays_grow_and_are_capped():
+    policy = RetryPolicy(delays={FAST: (1.0, 4.0)}, rng=random.Random(1))
+    error = ConnectionResetError()
+    for attempt in range(1, 10):
+        delay = policy.next_delay(error, attempt, 0)
+        assert 0 <= delay <= min(4.0, 2 ** (attempt - 1))
+    assert policy.next_delay(QueryMissingOrInvalidParameter("bad"), 1, 0) is None
+    assert policy.next_delay(error, policy.max_attempts, 0) is None
+
+
+def test_budget():
+    policy = RetryPolicy(budget=RetryBudget(2))
+    error = ConnectionResetError()
+    assert policy.next_delay(error, 1, 0) is not None
+    assert policy.next_delay(error, 1, 0) is not None
+    assert policy.next_delay(error, 1, 0) is None
+
+
+def test_call_with_retries():
+    policy = RetryPolicy(delays={SLOW: (0.001, 0.001)})
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise GeorefOffline("down")
+        return 'ok'
+
+    assert api_basic.call_with_retries(flaky, policy=policy) == 'ok'
+    assert len(calls) == 3
+
+    def invalid():
+        calls.append(1)
+        raise QueryMissingOrInvalidParameter("bad")
+
+    with pytest.raises(QueryMissingOrInvalidParameter):
+        api_basic.call_with_retries(invalid, policy=policy)
+    assert len(calls) == 4
+
+
+def test_throttled_waits_for_retry_after():
+    policy = RetryPolicy(rng=random.Random(1))
+    assert policy.classify(AnalystApiThrottled("slow down", 5.0)) == THROTTLED
+    assert policy.classify(QueryLimitReached("limit reached")) == NEVER
+    for attempt in range(1, 5):
+        assert policy.next_delay(AnalystApiThrottled("slow down", 5.0), attempt, 0) >= 5.0
+    assert policy.next_delay(AnalystApiThrottled("slow down", 5.0), 1, policy.max_elapsed - 2) == 2
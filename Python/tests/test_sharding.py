@@ -0,0 +1,36 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import csv
+
+from analystApi.sharding import shard_of, shard_output_file, merge_shards
+
+
+def test_shard_of_is_stable():
+    assert shard_of('4711', 4) == shard_of(' 4711 ', 4)
+    assert {shard_of(str(i), 4) for i in range(100)} == {0, 1, 2, 3}
+
+
+def test_merge_in_input_order(tmp_path):
+    input_file = tmp_path / 'in.csv'
+    output_file = str(tmp_path / 'in_executed.csv')
+    ids = ['a', 'b', 'c', 'a', 'd', 'e']
+    with open(input_file, 'w') as f:
+        f.write('ID,Segment\n' + ''.join(f'{i},WHG_K\n' for i in ids))
+
+    shards = 2
+    for shard_index in range(shards):
+        with open(shard_output_file(output_file, shard_index, shards), 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(['ID', 'Segment', 'count'])
+            # Lines are written in the order they are done, 'e' was not executed
+            for (n, i) in reversed(list(enumerate(ids))):
+                if shard_of(i, shards) == shard_index and i != 'e':
+                    writer.writerow([i, 'WHG_K', 'with\nnewline' if n == 1 else n])
+
+    assert merge_shards(str(input_file), output_file, shards) == 5
+    with open(output_file, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['ID'] for row in rows] == ['a', 'b', 'c', 'a', 'd']
+    assert rows[1]['count'] == 'with\nnewline'
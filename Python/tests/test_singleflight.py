@@ -0,0 +1,112 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from analystApi import api_basic, async_engine
+from analystApi.cache import SqliteCache
+from analystApi.singleflight import SingleFlight, AsyncSingleFlight
+
+
+def test_concurrent_calls_are_shared():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def fetch(address):
+        calls.append(address)
+        release.wait()
+        return address.upper()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(flight.do, 'key', fetch, 'brunsstr. 31') for _ in range(8)]
+        time.sleep(0.1)
+        release.set()
+        results = [f.result() for f in futures]
+
+    assert calls == ['brunsstr. 31']
+    assert results == ['BRUNSSTR. 31'] * 8
+
+
+def test_errors_are_shared_and_not_remembered():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError('offline')
+
+    with pytest.raises(ValueError):
+        flight.do('key', fail)
+    assert flight.do('key', lambda: 42) == 42
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'position'
+
+    async def run():
+        leader = asyncio.ensure_future(flight.do('key', fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do('key', fetch))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        results = await asyncio.gather(follower, return_exceptions=True)
+        assert leader.cancelled()
+        return results
+
+    assert asyncio.run(run()) == ['position']
+    assert calls == [1]
+
+
+POSITION = {'lat': 48.5, 'lon': 9.05, 'precision': 'HOUSE', 'displayNameDE': 'Brunsstr. 31', 'biggerArea': None}
+
+
+class LateCache(SqliteCache):
+    """The first lookup misses, as if a flight for the key finished right after it"""
+
+    def __init__(self, filename):
+        super().__init__(filename, table='georef')
+        self.lookups = 0
+
+    def get(self, key):
+        self.lookups += 1
+        if self.lookups == 1:
+            self.put(key, POSITION)
+            return None
+        return super().get(key)
+
+
+@pytest.fixture
+def late_cache(tmp_path, monkeypatch):
+    cache = LateCache(str(tmp_path / 'georef.sqlite'))
+    monkeypatch.setattr(api_basic, 'georef_cache', cache)
+    yield cache
+    cache.close()
+
+
+def test_leader_looks_into_the_cache_again(late_cache, monkeypatch):
+    requests = []
+    monkeypatch.setattr(api_basic, 'api_request', lambda *args, **kwargs: requests.append(args))
+    assert api_basic.georef('Brunsstr. 31, 72074 Tübingen') == POSITION
+    assert requests == []
+
+
+def test_async_leader_looks_into_the_cache_again(late_cache, monkeypatch):
+    requests = []
+
+    async def request(*args, **kwargs):
+        requests.append(args)
+
+    monkeypatch.setattr(async_engine, 'request', request)
+    assert asyncio.run(async_engine.georef(None, 'Brunsstr. 31, 72074 Tübingen')) == POSITION
+    assert requests == []
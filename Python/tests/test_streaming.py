@@ -0,0 +1,83 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from analystApi import api_basic, csv_transform
+from analystApi.csv_line import ExecutionResult
+from analystApi.utils import reservoir_sample
+
+
+def test_reservoir_sample_keeps_short_inputs():
+    assert reservoir_sample(iter(range(5)), 10) == [0, 1, 2, 3, 4]
+
+
+def test_reservoir_sample_is_uniform():
+    rng = random.Random(1)
+    counts = [0] * 10
+    for _ in range(3000):
+        sample = reservoir_sample((i for i in range(10)), 3, rng)
+        assert len(set(sample)) == 3
+        for i in sample:
+            counts[i] += 1
+    # Every line is drawn with probability 3/10, 900 times expected
+    assert all(800 < count < 1000 for count in counts)
+
+
+class Lines:
+    """Input lines that count how many were read"""
+
+    def __init__(self, n):
+        self.n = n
+        self.read = 0
+
+    def __iter__(self):
+        for i in range(self.n):
+            self.read += 1
+            yield {'ID': str(i)}
+
+
+@pytest.fixture
+def streaming(monkeypatch):
+    results = []
+    monkeypatch.setattr(api_basic, 'maintenance', None)
+    monkeypatch.setattr(csv_transform, 'count_result', results.append)
+    return results
+
+
+def test_lines_are_read_as_they_are_executed(streaming, monkeypatch):
+    lines = Lines(40)
+    lock = threading.Lock()
+    state = {'done': 0, 'ahead': 0}
+
+    def execute(args):
+        time.sleep(0.005)
+        with lock:
+            # Read but not done yet: the pending lines and the one waiting for a free slot
+            state['ahead'] = max(state['ahead'], lines.read - state['done'])
+            state['done'] += 1
+        return ExecutionResult(args[0]['ID'], 1, True, 0.005)
+
+    monkeypatch.setattr(csv_transform, 'execute_query_per_csv_line', execute)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        csv_transform.execute_streaming(executor, lines, [], None, max_pending_lines=3)
+    assert sorted(int(result.object_id) for result in streaming) == list(range(40))
+    assert state['ahead'] <= 3 + 1
+
+
+def test_worker_exit_is_raised_in_the_main_thread(streaming, monkeypatch):
+    def execute(args):
+        if args[0]['ID'] == '4':
+            raise SystemExit()
+        return ExecutionResult(args[0]['ID'], 1, True, 0.0)
+
+    monkeypatch.setattr(csv_transform, 'execute_query_per_csv_line', execute)
+    with pytest.raises(SystemExit):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            csv_transform.execute_streaming(executor, Lines(5), [], None, max_pending_lines=2)
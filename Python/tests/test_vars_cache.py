@@ -0,0 +1,111 @@
+# Python script to query REST-API from empirica-systeme, see https://www.empirica-systeme.de/en/portfolio/empirica-systeme-rest-api/
+# This work is licensed under a "Creative Commons Attribution 4.0 International License", sett http://creativecommons.org/licenses/by/4.0/
+# Documentation of REST-API at https://api.empirica-systeme.de/api-docs/
+
+import json
+import threading
+import time
+
+import pytest
+import requests
+
+from analystApi import api_basic
+from analystApi.cache import SqliteCache
+
+BODY = {'vars': [{'key': 'fl_wohnen', 'filterModelName': 'rangeFilter'}], 'dataVintage': '2024-06'}
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.text = json.dumps(body) if body is not None else ''
+        self.headers = headers or {}
+
+
+@pytest.fixture
+def api(monkeypatch, tmp_path):
+    """Fake /vars, returns the headers of the requests sent"""
+    cache = SqliteCache(str(tmp_path / 'vars.sqlite'), table='vars')
+    monkeypatch.setattr(api_basic, 'vars_cache', cache)
+    monkeypatch.setattr(api_basic, 'vars_max_age', 3600)
+    monkeypatch.setattr(api_basic, 'offline', False)
+    monkeypatch.setattr(api_basic, 'client', api_basic.AnalystApiClient('https://api.example', 'user', 'secret'))
+    sent = []
+    responses = []
+
+    def api_request(name, method, path, headers=None):
+        assert (name, method, path) == ('vars', 'GET', '/vars/')
+        sent.append(headers)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(api_basic, 'api_request', api_request)
+    yield sent, responses
+    cache.close()
+
+
+def test_documentation_is_cached(api):
+    (sent, responses) = api
+    responses.append(FakeResponse(200, BODY, {'ETag': '"v1"'}))
+    assert api_basic.fetch_variable_documentation() == (BODY, {})
+    assert api_basic.fetch_variable_documentation() == (BODY, {})
+    assert len(sent) == 1
+
+
+def test_old_documentation_is_revalidated(api, monkeypatch):
+    (sent, responses) = api
+    responses.append(FakeResponse(200, BODY, {'ETag': '"v1"', 'Last-Modified': 'Mon, 03 Jun 2024 10:00:00 GMT'}))
+    api_basic.fetch_variable_documentation()
+    monkeypatch.setattr(api_basic, 'vars_max_age', 0)
+
+    responses.append(FakeResponse(304))
+    assert api_basic.fetch_variable_documentation() == (BODY, {})
+    assert sent[1]['If-None-Match'] == '"v1"'
+    assert sent[1]['If-Modified-Since'] == 'Mon, 03 Jun 2024 10:00:00 GMT'
+
+    changed = dict(BODY, dataVintage='2024-07')
+    responses.append(FakeResponse(200, changed, {'ETag': '"v2"'}))
+    assert api_basic.fetch_variable_documentation() == (changed, {})
+
+    responses.append(requests.exceptions.ConnectionError('down'))
+    assert api_basic.fetch_variable_documentation() == (changed, {})
+
+
+def test_offline_uses_the_cache_only(api, monkeypatch):
+    (sent, responses) = api
+    monkeypatch.setattr(api_basic, 'offline', True)
+    with pytest.raises(Exception, match='no cached variable documentation'):
+        api_basic.fetch_variable_documentation()
+
+    monkeypatch.setattr(api_basic, 'offline', False)
+    responses.append(FakeResponse(200, BODY))
+    api_basic.fetch_variable_documentation()
+    monkeypatch.setattr(api_basic, 'offline', True)
+    monkeypatch.setattr(api_basic, 'vars_max_age', 0)
+    assert api_basic.fetch_variable_documentation() == (BODY, {})
+    assert len(sent) == 1
+
+
+def test_concurrent_queries_load_the_documentation_once(monkeypatch):
+    client = api_basic.AnalystApiClient('https://api.example', 'user', 'secret')
+    loads = []
+
+    def load_variable_documentation():
+        loads.append(threading.current_thread().name)
+        time.sleep(0.05)
+        return {item['key']: item for item in BODY['vars']}
+
+    monkeypatch.setattr(api_basic, 'load_variable_documentation', load_variable_documentation)
+    found = []
+    threads = [threading.Thread(target=lambda: found.append(client.documentation())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
+    assert all(documentation is found[0] for documentation in found)
+
+    with pytest.raises(Exception, match='in use already'):
+        client.configure(poolsize=10)